@@ -0,0 +1,180 @@
+"""
+Бенчмарк задержки обработчика successful_payment при конкурентных оплатах.
+
+Запускает N одновременных сценариев успешной оплаты (создание ключа -> запись в БД ->
+ответ пользователю) и параллельно "фоновые" апдейты, которые не трогают БД.
+Сетевые вызовы к VPN-серверам и Telegram заменены задержками, БД — настоящий SQLite-файл
+(задержку COMMIT медленного диска можно задать через --commit-latency).
+
+Режимы:
+- blocking: методы DbProcessor выполняются прямо в event loop (поведение до async-слоя);
+- executor: методы DbProcessor выполняются в потоке БД (текущее поведение).
+
+Запуск из корня репозитория:
+    PYTHONPATH=src python benchmarks/bench_successful_payment.py -n 200
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+os.environ.setdefault("TOKEN", "123456:benchmark")
+os.environ.setdefault("OUTLINE_API_URL", "https://127.0.0.1:1/benchmark")
+os.environ.setdefault("OUTLINE_CERT_SHA", "00")
+
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from api_processors.key_models import OutlineKey  # noqa: E402
+from bot.routers import payment_router  # noqa: E402
+from database.engine import SqliteProfile, create_db_engine  # noqa: E402
+from database.models import Base  # noqa: E402
+from initialization.db_processor_init import db_processor  # noqa: E402
+
+BLOCKING_METHODS = ("update_database_with_key",)
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+async def telegram_call(*args, **kwargs):
+    return None
+
+
+def make_message(user_id: int) -> SimpleNamespace:
+    message = SimpleNamespace(
+        from_user=SimpleNamespace(id=user_id),
+        successful_payment=SimpleNamespace(total_amount=15000),
+        edit_text=telegram_call,
+        dict=lambda: {"user_id": user_id},
+    )
+
+    async def answer(*args, **kwargs):
+        return message
+
+    message.answer = answer
+    return message
+
+
+def make_state() -> SimpleNamespace:
+    async def get_data():
+        return {"selected_period": "1 month", "vpn_type": "outline"}
+
+    return SimpleNamespace(
+        get_data=get_data,
+        update_data=telegram_call,
+        set_state=telegram_call,
+        clear=telegram_call,
+    )
+
+
+def setup_database(db_path: str, commit_latency: float) -> None:
+    engine = create_db_engine(f"sqlite:///{db_path}", SqliteProfile.from_env())
+    Base.metadata.create_all(engine)
+    if commit_latency:
+        # Имитация медленного диска (fsync на docker volume, конкурентный писатель)
+        event.listen(engine, "commit", lambda conn: time.sleep(commit_latency))
+    db_processor.engine = engine
+    db_processor.Session = sessionmaker(bind=engine, expire_on_commit=False)
+
+
+def set_mode(mode: str) -> None:
+    for name in BLOCKING_METHODS:
+        db_processor.__dict__.pop(name, None)
+        if mode == "blocking":
+            sync_method = getattr(type(db_processor), name).__wrapped__
+
+            async def blocking(*args, _sync_method=sync_method, **kwargs):
+                return _sync_method(db_processor, *args, **kwargs)
+
+            setattr(db_processor, name, blocking)
+
+
+async def run(mode: str, flows: int, network_delay: float) -> dict[str, list[float]]:
+    set_mode(mode)
+    key_counter = iter(range(10**9))
+    rnd = random.Random(0)
+
+    async def fake_create_vpn_key(user_id=None, data_limit=None):
+        await asyncio.sleep(network_delay * rnd.uniform(0.5, 1.5))
+        key_id = f"{mode}-{next(key_counter)}"
+        key = OutlineKey(
+            key_id=key_id,
+            name=f"key {key_id}",
+            password=None,
+            port=None,
+            method=None,
+            access_url=f"ss://{key_id}",
+            data_limit=200 * 1024**3,
+            used_bytes=0,
+        )
+        return key, 1
+
+    payment_router.async_outline_processor.create_vpn_key = fake_create_vpn_key
+
+    async def payment_flow(user_id: int) -> float:
+        start = time.perf_counter()
+        await payment_router.successful_payment(make_message(user_id), make_state())
+        return time.perf_counter() - start
+
+    async def unrelated_update() -> float:
+        # Апдейт, который не ходит в БД (например, нажатие кнопки меню),
+        # приходит в момент, когда оплаты пишут в БД
+        await asyncio.sleep(network_delay * rnd.uniform(0.5, 1.5))
+        start = time.perf_counter()
+        await asyncio.sleep(network_delay / 10)
+        return time.perf_counter() - start
+
+    results = await asyncio.gather(
+        *(payment_flow(user_id) for user_id in range(flows)),
+        *(unrelated_update() for _ in range(flows)),
+    )
+    return {"successful_payment": results[:flows], "unrelated_update": results[flows:]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", "--flows", type=int, default=200)
+    parser.add_argument(
+        "--network-delay", type=float, default=0.05, help="задержка сети, сек"
+    )
+    parser.add_argument(
+        "--commit-latency",
+        type=float,
+        default=0.005,
+        help="дополнительная задержка каждого COMMIT, сек",
+    )
+    parser.add_argument(
+        "--db-dir", default=None, help="каталог для файла БД (по умолчанию временный)"
+    )
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory(dir=args.db_dir) as tmp_dir:
+        for mode in ("blocking", "executor"):
+            setup_database(os.path.join(tmp_dir, f"{mode}.db"), args.commit_latency)
+            timings = asyncio.run(run(mode, args.flows, args.network_delay))
+            for handler, values in timings.items():
+                values_ms = [value * 1000 for value in values]
+                print(
+                    f"{mode:<9} {handler:<19} n={len(values_ms):<5} "
+                    f"p50={statistics.median(values_ms):8.1f} ms  "
+                    f"p99={percentile(values_ms, 99):8.1f} ms"
+                )
+            db_processor.engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
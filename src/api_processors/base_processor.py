@@ -18,6 +18,14 @@ class BaseProcessor(ABC):
         """
         pass
 
+    @abstractmethod
+    def create_vpn_keys(self, count: int, server_id: int = None):
+        """
+        Создает несколько VPN-ключей на указанном сервере за минимальное число запросов.
+        Возвращает список созданных ключей.
+        """
+        pass
+
     @abstractmethod
     def delete_key(self, key_id: str):
         """
@@ -49,3 +57,11 @@ class BaseProcessor(ABC):
         Возвращает словарь с данными о сервере.
         """
         pass
+
+    @abstractmethod
+    def get_transfer_total(self, server_id: int = None):
+        """
+        Получает суммарный трафик всех ключей сервера в байтах.
+        Используется для оценки загрузки канала сервера.
+        """
+        pass
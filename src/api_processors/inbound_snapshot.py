@@ -0,0 +1,76 @@
+import json
+import time
+import logging
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ClientEntry:
+    """
+    Клиент (ключ) панели 3x-ui вместе с inbound'ом, в котором он лежит, и расходом трафика.
+    """
+
+    inbound_id: int
+    client: dict
+    used_bytes: int = 0
+
+    @property
+    def key_id(self) -> str:
+        return self.client.get("id")
+
+
+@dataclass
+class InboundSnapshot:
+    """
+    Разобранный ответ /panel/inbound/list/ одного сервера.
+
+    settings каждого inbound'а разбирается один раз, клиенты индексируются по id и email,
+    а clientStats сразу сопоставляются клиентам, поэтому поиск ключа выполняется за O(1).
+    """
+
+    host: str
+    inbounds: list[dict]
+    clients_by_id: dict[str, ClientEntry] = field(default_factory=dict)
+    clients_by_email: dict[str, ClientEntry] = field(default_factory=dict)
+    created_at: float = field(default_factory=time.monotonic)
+
+    @classmethod
+    def from_inbound_list(cls, host: str, inbound_list: list[dict]) -> "InboundSnapshot":
+        """
+        Строит снимок из списка inbound'ов.
+        :param host: Адрес панели, с которой получен список
+        :param inbound_list: Поле obj ответа /panel/inbound/list/
+        :return: InboundSnapshot
+        """
+        snapshot = cls(host=host, inbounds=inbound_list)
+        for inbound in inbound_list:
+            used_bytes = {
+                stat.get("email"): stat.get("up", 0) + stat.get("down", 0)
+                for stat in inbound.get("clientStats") or []
+            }
+            try:
+                inbound_settings = json.loads(inbound.get("settings", "{}"))
+            except json.JSONDecodeError as ex:
+                logger.error(f"JSONDecodeError inbound.settings: {ex}")
+                continue
+
+            for client in inbound_settings.get("clients", []):
+                email = client.get("email")
+                entry = ClientEntry(
+                    inbound_id=inbound.get("id"),
+                    client=client,
+                    used_bytes=used_bytes.get(email, used_bytes.get(client.get("id"), 0)),
+                )
+                snapshot.clients_by_id[client.get("id")] = entry
+                if email:
+                    snapshot.clients_by_email[email] = entry
+        return snapshot
+
+    @property
+    def first_inbound(self) -> dict | None:
+        return self.inbounds[0] if self.inbounds else None
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.monotonic() - self.created_at < ttl
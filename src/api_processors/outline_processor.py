@@ -1,17 +1,31 @@
 import asyncio
 import base64
+import functools
 import json
+import os
 import re
+import time
 import typing
 import logging
+from collections import defaultdict
+from contextvars import ContextVar
+from dataclasses import dataclass, field
 from typing import Optional
 
 import aiohttp
-import asyncssh
 from coolname import generate_slug
+from dotenv import load_dotenv
 
 from api_processors.key_models import OutlineKey
 from api_processors.base_processor import BaseProcessor
+from api_processors.session_registry import ServerSession, ServerSessionRegistry
+from api_processors.single_flight import coalesce_requests
+from api_processors.ssh_provisioning import (
+    SERVICE_READY_TIMEOUT,
+    ProvisionStep,
+    SshPipeline,
+    wait_until_ready,
+)
 from bot.routers.admin_router_sending_message import (
     send_error_report,
     send_new_server_report,
@@ -19,6 +33,20 @@ from bot.routers.admin_router_sending_message import (
 
 logger = logging.getLogger(__name__)
 
+load_dotenv()
+
+# Файл с конфигурацией, который установщик Outline оставляет на сервере
+OUTLINE_ACCESS_FILE = "/opt/outline/access.txt"
+# Сколько секунд переиспользуется ответ /metrics/transfer сервера Outline
+OUTLINE_METRICS_TTL = float(os.getenv("OUTLINE_METRICS_TTL", 10))
+
+# Сессия сервера, с которым работает текущая задача.
+# У каждой asyncio-задачи своё значение, поэтому параллельные запросы
+# к разным серверам не перезаписывают сессию друг друга.
+_current_server_session: ContextVar[ServerSession | None] = ContextVar(
+    "outline_server_session", default=None
+)
+
 
 def get_db_processor():
     from initialization.db_processor_init import db_processor
@@ -34,6 +62,7 @@ class OutlineServerErrorException(Exception):
     pass
 
 
+@functools.lru_cache(maxsize=None)
 def get_aiohttp_fingerprint(ssl_assert_fingerprint: str) -> aiohttp.Fingerprint:
     """
     Преобразует строку с отпечатком SSL в aiohttp.Fingerprint
@@ -44,48 +73,109 @@ def get_aiohttp_fingerprint(ssl_assert_fingerprint: str) -> aiohttp.Fingerprint:
     return aiohttp.Fingerprint(base64.b16decode(fingerprint, casefold=True))
 
 
+@dataclass
+class MetricsSnapshot:
+    """
+    Ответ /metrics/transfer одного сервера Outline.
+    """
+
+    api_url: str
+    metrics: dict
+    created_at: float = field(default_factory=time.monotonic)
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.monotonic() - self.created_at < ttl
+
+
+@dataclass
+class MetricsStats:
+    """
+    Счётчики использования кэша метрик Outline.
+    hits — метрики взяты из кэша (в том числе дождавшись чужого запроса),
+    fetches — метрики загружены с сервера.
+    """
+
+    hits: int = 0
+    fetches: int = 0
+
+    def summary(self) -> str:
+        """Строка со счётчиками для лога."""
+        total = self.hits + self.fetches
+        hit_rate = self.hits / total * 100 if total else 0
+        return f"из кэша {self.hits}, с сервера {self.fetches} ({hit_rate:.1f}% из кэша)"
+
+
 class OutlineProcessor(BaseProcessor):
     """
     Класс для работы с сервером Outline
     """
 
+    protocol_type = "outline"
+
     def __init__(self):
-        self.api_url = None
         self.cert_sha256 = None
-        self.session: aiohttp.ClientSession | None = None
-        self.server_id = None
+        self.sessions = ServerSessionRegistry(ssl_factory=get_aiohttp_fingerprint)
+        self._metrics: dict[int, MetricsSnapshot] = {}
+        self._metrics_locks: defaultdict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self.metrics_stats = MetricsStats()
+
+    @property
+    def session(self) -> aiohttp.ClientSession | None:
+        entry = _current_server_session.get()
+        return entry.session if entry else None
+
+    @property
+    def api_url(self) -> str | None:
+        entry = _current_server_session.get()
+        return entry.base_url if entry else None
+
+    @property
+    def server_id(self) -> int | None:
+        entry = _current_server_session.get()
+        return entry.server_id if entry else None
 
     @staticmethod
     def create_server_session_by_id(func) -> typing.Callable:
         """
-        Декоратор для создания сессии для сервера по его id
-        Если сессия уже создана, то она не будет создана заново
+        Декоратор, выбирающий сессию сервера по server_id из реестра сессий.
+        Если server_id не передан, используется сессия, уже выбранная в текущей задаче
+        (например, в create_vpn_key после create_server_session).
         :return:
         """
 
+        @functools.wraps(func)
         async def wrapper(self, *args, **kwargs):
-            if self.session is None:
-                if kwargs.get("server_id") is None:
+            server_id = kwargs.get("server_id")
+            if server_id is None:
+                if self.session is None:
                     raise ValueError(
                         "!!!server_id must be passed as a keyword argument!!!"
                     )
+                return await func(self, *args, **kwargs)
 
-                server_id = kwargs.get("server_id")
+            entry = await self._get_server_session(server_id)
+            token = _current_server_session.set(entry)
+            try:
+                return await func(self, *args, **kwargs)
+            finally:
+                _current_server_session.reset(token)
 
-                server = get_db_processor().get_server_by_id(server_id)
-                self.api_url = server.api_url
-                self.server_id = server_id
-                connector = aiohttp.TCPConnector(
-                    ssl=get_aiohttp_fingerprint(
-                        ssl_assert_fingerprint=server.cert_sha256
-                    )
-                )
-                session = aiohttp.ClientSession(connector=connector)
-                self.session = session
+        return wrapper
 
-            return await func(self, *args, **kwargs)
+    async def _get_server_session(self, server_id: int) -> ServerSession:
+        """
+        Возвращает сессию сервера из реестра, при первом обращении читает сервер из БД.
+        :param server_id: ID сервера
+        :return: ServerSession
+        """
+        entry = self.sessions.get_cached(server_id)
+        if entry is not None:
+            return entry
 
-        return wrapper
+        server = await get_db_processor().get_server_by_id(server_id)
+        if server is None:
+            raise ValueError(f"Сервер с ID {server_id} не найден в базе данных")
+        return await self.sessions.get(server.id, server.api_url, server.cert_sha256)
 
     async def create_server_session(self, user_id : int | None = None) -> None:
         """
@@ -93,44 +183,62 @@ class OutlineProcessor(BaseProcessor):
 
         Метод выполняет следующие шаги:
         1. Получает сервер с минимальным количеством пользователей, использующий протокол "Outline".
-        2. Сохраняет URL API и идентификатор сервера в атрибутах объекта.
-        3. Создает `aiohttp.ClientSession` с SSL-коннектором, настроенным на отпечаток сертификата сервера.
+        2. Берёт сессию сервера из реестра (создаёт при первом обращении).
+        3. Делает её текущей для задачи: self.session, self.api_url и self.server_id указывают на этот сервер.
 
         :return: None
         """
 
         server = await get_db_processor().get_server_with_min_users("outline", user_id=user_id)
-
-        self.api_url = server.api_url
-        self.server_id = server.id
-
-        ssl_context = get_aiohttp_fingerprint(ssl_assert_fingerprint=server.cert_sha256)
-        connector = aiohttp.TCPConnector(ssl=ssl_context)
-
-        self.session = aiohttp.ClientSession(connector=connector)
+        await self.create_server_session_for_server(server)
 
     async def create_server_session_for_server(self, server) -> None:
         """
-        Создает сессию для конкретного сервера
+        Делает текущей для задачи сессию конкретного сервера
         :param server: Объект сервера
         :return: None
         """
-        self.api_url = server.api_url
-        self.server_id = server.id
-        connector = aiohttp.TCPConnector(
-            ssl=get_aiohttp_fingerprint(ssl_assert_fingerprint=server.cert_sha256)
-        )
-        self.session = aiohttp.ClientSession(connector=connector)
-
-    async def _get_metrics(self) -> dict:
-        """
-        Получает метрики с Outline сервера
-        :return:
-        """
-        async with self.session.get(url=f"{self.api_url}/metrics/transfer") as resp:
-            resp_json = await resp.json()
-            if resp.status >= 400 or "bytesTransferredByUserId" not in resp_json:
-                raise OutlineServerErrorException("Unable to get metrics")
+        entry = await self.sessions.get(server.id, server.api_url, server.cert_sha256)
+        _current_server_session.set(entry)
+
+    async def _get_metrics(self, refresh: bool = False) -> dict:
+        """
+        Получает метрики с Outline сервера.
+        Ответ переиспользуется OUTLINE_METRICS_TTL секунд; параллельные задачи,
+        которым нужны новые метрики, дожидаются одного запроса к серверу.
+
+        :param refresh: Получить метрики заново, даже если кэшированные ещё свежие.
+        :return: Ответ /metrics/transfer
+        """
+        server_id = self.server_id
+        requested_at = time.monotonic()
+        snapshot = self._metrics.get(server_id)
+        if (
+            not refresh
+            and snapshot is not None
+            and snapshot.api_url == self.api_url
+            and snapshot.is_fresh(OUTLINE_METRICS_TTL)
+        ):
+            self.metrics_stats.hits += 1
+            return snapshot.metrics
+
+        async with self._metrics_locks[server_id]:
+            snapshot = self._metrics.get(server_id)
+            # Пока ждали блокировку, другая задача могла уже получить свежие метрики
+            if (
+                snapshot is not None
+                and snapshot.api_url == self.api_url
+                and snapshot.created_at >= requested_at
+            ):
+                self.metrics_stats.hits += 1
+                return snapshot.metrics
+
+            self.metrics_stats.fetches += 1
+            async with self.session.get(url=f"{self.api_url}/metrics/transfer") as resp:
+                resp_json = await resp.json()
+                if resp.status >= 400 or "bytesTransferredByUserId" not in resp_json:
+                    raise OutlineServerErrorException("Unable to get metrics")
+            self._metrics[server_id] = MetricsSnapshot(self.api_url, resp_json)
             return resp_json
 
     async def _get_raw_keys(self) -> list[OutlineKey]:
@@ -149,32 +257,104 @@ class OutlineProcessor(BaseProcessor):
 
     async def create_vpn_key(self, user_id, data_limit=200 * 1024**3) -> tuple[OutlineKey, int]:
         """
-        Создает ключ для подключения к VPN
+        Создает ключ для подключения к VPN.
+        Имя и лимит передаются в запросе создания, поэтому обычно нужен один запрос к серверу.
+        Время этапов (выбор сервера, создание, донастройка) пишется в лог.
         :return: Кортеж из ключа и id сервера
         """
+        started = time.monotonic()
         await self.create_server_session(user_id=user_id)
+        session_ready = time.monotonic()
+
+        timings = {}
+        outline_key = await self._create_key_with_params(
+            generate_slug(2).replace("-", " "), data_limit, timings=timings
+        )
+        logger.info(
+            f"Ключ Outline {outline_key.key_id} создан на сервере {self.server_id} "
+            f"за {time.monotonic() - started:.3f} с: "
+            f"выбор сервера {session_ready - started:.3f} с, "
+            f"создание {timings['create']:.3f} с, донастройка {timings['update']:.3f} с"
+        )
+        return outline_key, self.server_id
 
-        async with self.session.post(url=f"{self.api_url}/access-keys/") as resp:
+    async def _create_key_with_params(
+        self, key_name: str, data_limit: int, timings: dict | None = None
+    ) -> OutlineKey:
+        """
+        Создает ключ сразу с именем и лимитом одним запросом POST /access-keys.
+        Старые версии Outline игнорируют параметры в теле запроса,
+        тогда имя и лимит устанавливаются отдельными запросами параллельно.
+
+        :param key_name: Имя ключа.
+        :param data_limit: Лимит в байтах.
+        :param timings: Словарь, в который записывается время этапов create и update, сек.
+        :return: OutlineKey
+        """
+        started = time.monotonic()
+        body = {"name": key_name, "limit": {"bytes": data_limit}}
+        async with self.session.post(url=f"{self.api_url}/access-keys/", json=body) as resp:
             if resp.status != 201:
                 raise OutlineServerErrorException("Unable to create key")
             key_data = await resp.json()
-
-        tmp_key = OutlineKey.from_key_json(key_data)
-        logger.info(tmp_key)
-
-        key_name = generate_slug(2).replace("-", " ")
-        # data_limit = 200 * 1024**3
-
-        await self.rename_key(tmp_key.key_id, key_name)
-        await self.update_data_limit(tmp_key.key_id, data_limit, self.server_id)
+        created = time.monotonic()
+
+        key_id = key_data.get("id")
+        updates = []
+        if key_data.get("name") != key_name:
+            updates.append(self.rename_key(key_id, key_name))
+        if (key_data.get("dataLimit") or {}).get("bytes") != data_limit:
+            updates.append(self.update_data_limit(key_id, data_limit))
+        if updates:
+            if not all(await asyncio.gather(*updates)):
+                logger.warning(
+                    f"Не удалось задать имя или лимит ключа {key_id} на сервере {self.server_id}"
+                )
 
         key_data["name"] = key_name
         key_data["used_bytes"] = 0
         key_data["dataLimit"] = {"bytes": data_limit}
+        if timings is not None:
+            timings["create"] = created - started
+            timings["update"] = time.monotonic() - created
+        return OutlineKey.from_key_json(key_data)
 
-        outline_key = OutlineKey.from_key_json(key_data)
-        return outline_key, self.server_id
+    @create_server_session_by_id
+    async def create_vpn_keys(
+        self,
+        count: int,
+        server_id: int = None,
+        data_limit: int = 200 * 1024**3,
+        concurrency: int = 10,
+    ) -> list[OutlineKey]:
+        """
+        Создает сразу несколько ключей на указанном сервере.
+        Каждый ключ создается одним запросом с именем и лимитом, запросы идут параллельно.
+        Учёт занятых мест на сервере (cnt_users) остаётся на вызывающей стороне.
 
+        :param count: Количество ключей.
+        :param server_id: Идентификатор сервера.
+        :param data_limit: Лимит каждого ключа в байтах.
+        :param concurrency: Максимальное число одновременных запросов.
+        :return: Список созданных ключей (может быть короче count при ошибках).
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def create() -> OutlineKey | None:
+            async with semaphore:
+                try:
+                    return await self._create_key_with_params(
+                        generate_slug(2).replace("-", " "), data_limit
+                    )
+                except Exception as e:
+                    logger.error(f"Ошибка при создании ключа на сервере {server_id}: {e}")
+                    return None
+
+        keys = [key for key in await asyncio.gather(*(create() for _ in range(count))) if key]
+        logger.info(f"Создано ключей Outline на сервере {server_id}: {len(keys)}/{count}")
+        return keys
+
+    @coalesce_requests("get_key_info")
     @create_server_session_by_id
     async def get_key_info(self, key_id: int, server_id=None) -> OutlineKey:
         """
@@ -208,12 +388,14 @@ class OutlineProcessor(BaseProcessor):
 
         :param key_id: Идентификатор ключа.
         :param server_id: Идентификатор сервера.
-        :return: True, если удаление прошло успешно.
+        :return: True, если ключ удалён или его уже нет на сервере (404).
         """
         async with self.session.delete(
             url=f"{self.api_url}/access-keys/{key_id}"
         ) as resp:
-            return resp.status == 204
+            if resp.status == 404:
+                logger.info(f"Ключ {key_id} уже отсутствует на сервере.")
+            return resp.status in (204, 404)
 
     @create_server_session_by_id
     async def rename_key(self, key_id, new_key_name, server_id=None) -> bool:
@@ -241,8 +423,9 @@ class OutlineProcessor(BaseProcessor):
         """
         current_metrics = await self._get_metrics()
         for key in keys:
+            # Метрики приходят с ключами-строками, а key_id у OutlineKey — число
             key.used_bytes = current_metrics.get("bytesTransferredByUserId", {}).get(
-                key.key_id, 0
+                str(key.key_id), 0
             )
         return keys
 
@@ -272,6 +455,38 @@ class OutlineProcessor(BaseProcessor):
         ) as resp:
             return resp.status == 204
 
+    @create_server_session_by_id
+    async def update_data_limits(
+        self, limits: dict[str, int], server_id: int = None, concurrency: int = 10
+    ) -> dict[str, bool]:
+        """
+        Устанавливает лимиты сразу для нескольких ключей одного сервера.
+        Запросы выполняются параллельно, не более `concurrency` одновременно.
+
+        :param limits: Словарь {key_id: лимит в байтах}
+        :param server_id: Идентификатор сервера.
+        :param concurrency: Максимальное число одновременных запросов.
+        :return: Словарь {key_id: True, если лимит обновлён}
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def update(key_id: str, limit: int) -> bool:
+            async with semaphore:
+                try:
+                    return await self.update_data_limit(
+                        key_id, limit, server_id=server_id
+                    )
+                except Exception as e:
+                    logger.error(
+                        f"Ошибка при обновлении лимита ключа {key_id} на сервере {server_id}: {e}"
+                    )
+                    return False
+
+        results = await asyncio.gather(
+            *(update(key_id, limit) for key_id, limit in limits.items())
+        )
+        return dict(zip(limits, results))
+
     @create_server_session_by_id
     async def delete_data_limit(self, key_id: int, server_id: int) -> bool:
         """
@@ -291,11 +506,19 @@ class OutlineProcessor(BaseProcessor):
 
         :return: Словарь с информацией о переданных байтах по каждому ключу.
         """
-        async with self.session.get(url=f"{self.api_url}/metrics/transfer") as resp:
-            resp_json = await resp.json()
-            if resp.status >= 400 or "bytesTransferredByUserId" not in resp_json:
-                raise OutlineServerErrorException("Unable to get metrics")
-        return resp_json
+        return await self._get_metrics(refresh=True)
+
+    @create_server_session_by_id
+    async def get_transfer_total(self, server_id: int = None) -> int:
+        """
+        Получает суммарный трафик всех ключей сервера по /metrics/transfer.
+        Outline считает трафик за скользящий период, поэтому значение может уменьшаться.
+
+        :param server_id: Идентификатор сервера.
+        :return: Трафик в байтах.
+        """
+        metrics = await self.get_transferred_data()
+        return sum(metrics["bytesTransferredByUserId"].values())
 
     async def get_server_info(self, server) -> dict:
         """
@@ -305,15 +528,13 @@ class OutlineProcessor(BaseProcessor):
         :return: Словарь с информацией о сервере.
         """
 
-        ssl_context = get_aiohttp_fingerprint(ssl_assert_fingerprint=server.cert_sha256)
-        connector = aiohttp.TCPConnector(ssl=ssl_context)
-        async with aiohttp.ClientSession(connector=connector) as session:
-            async with session.get(url=f"{server.api_url}/server") as resp:
-                resp_json = await resp.json()
-                if resp.status != 200:
-                    raise OutlineServerErrorException(
-                        "Unable to get information about the server"
-                    )
+        entry = await self.sessions.get(server.id, server.api_url, server.cert_sha256)
+        async with entry.session.get(url=f"{server.api_url}/server") as resp:
+            resp_json = await resp.json()
+            if resp.status != 200:
+                raise OutlineServerErrorException(
+                    "Unable to get information about the server"
+                )
         return resp_json
 
     async def set_server_name(self, name: str) -> bool:
@@ -411,23 +632,21 @@ class OutlineProcessor(BaseProcessor):
 
     async def _close(self) -> None:
         """
-        Закрывает активную сессию.
+        Закрывает сессии всех серверов.
         """
-        if self.session:
-            await self.session.close()
+        await self.sessions.close()
 
     async def close(self):
         """
-        Публичный метод для закрытия сессии.
+        Публичный метод для закрытия сессий (вызывается при остановке бота).
         """
-        if self.session:
-            await self.session.close()
+        await self.sessions.close()
 
     def __del__(self) -> None:
         """
-        Деструктор, пытающийся корректно закрыть сессию при уничтожении объекта.
+        Деструктор, пытающийся корректно закрыть сессии при уничтожении объекта.
         """
-        if self.session is None:
+        if not len(self.sessions):
             return
         try:
             loop = asyncio.get_running_loop()
@@ -455,65 +674,89 @@ class OutlineProcessor(BaseProcessor):
                 pass
         return None
 
+    @staticmethod
+    def parse_outline_access_file(text: str) -> dict | None:
+        """
+        Извлекает конфигурацию сервера Outline из файла access.txt,
+        который установщик сохраняет в OUTLINE_ACCESS_FILE (строки вида key:value).
+
+        :param text: Содержимое файла.
+        :return: Словарь с конфигурацией или None.
+        """
+        config = {}
+        for line in text.splitlines():
+            key, sep, value = line.strip().partition(":")
+            if sep:
+                config[key] = value
+        if "apiUrl" in config and "certSha256" in config:
+            return config
+        return None
+
     async def setup_server(self, server) -> bool:
         """
-        Устанавливает сервер Outline, выполняя установку необходимых пакетов через SSH и извлекая конфигурацию.
-        В случае неудачи делает до 5 попыток с паузой 10 секунд между ними.
+        Устанавливает сервер Outline по SSH и сохраняет его конфигурацию в БД.
+        Установка выполняется через SshPipeline: при повторной попытке уже выполненная
+        установка не повторяется, а конфигурация читается из access.txt. Вместо фиксированной
+        паузы после установки опрашивается API сервера.
 
         :param server: Объект сервера с необходимыми полями (ip, password и т.д.).
         :return: True, если установка прошла успешно, иначе False.
         """
-        max_attempts = 5
-        for attempt in range(max_attempts):
-            cmd_update = "sudo apt update"
-            cmd_install_outline = (
-                'sudo bash -c "$(wget -qO- https://raw.githubusercontent.com/Jigsaw-Code/outline-server/'
-                'master/src/server_manager/install_scripts/install_server.sh)"'
-            )
-            try:
-                async with asyncssh.connect(
-                    host=server.ip,
-                    username="root",
-                    password=server.password,
-                    known_hosts=None,
-                ) as conn:
-                    result_update = await conn.run(cmd_update)
-                    logger.info("Вывод обновления:\n" + result_update.stdout)
-                    if result_update.exit_status != 0:
-                        raise Exception(
-                            f"Ошибка выполнения обновления: {result_update.stderr}"
-                        )
-                    result_install = await conn.run(cmd_install_outline, input="y\n")
-                    stdout_outline = result_install.stdout
-                    stderr_outline = result_install.stderr
-                    logger.info("Вывод установки Outline:\n" + stdout_outline)
-                    if stderr_outline:
-                        logger.error("Ошибка установки Outline:\n" + stderr_outline)
-                        raise Exception("Ошибка установки Outline")
-                    config = self.extract_outline_config(stdout_outline)
-                    if config is None:
-                        raise Exception("Ошибка при извлечении конфигурации Outline")
-                    get_db_processor().update_server_by_id(
-                        server.id, config["apiUrl"], config["certSha256"]
+        outputs = await SshPipeline(
+            server,
+            [
+                [
+                    ProvisionStep(
+                        "install_outline",
+                        "apt-get update -q\n"
+                        'bash -c "$(wget -qO- https://raw.githubusercontent.com/Jigsaw-Code/outline-server/'
+                        'master/src/server_manager/install_scripts/install_server.sh)"',
+                        input="y\n",
                     )
-                    logger.info(f"🎉 Сервер Outline установлен")
-                    await send_new_server_report(
-                        server_id=server.id,
-                        ip=server.ip,
-                        protocol="outline",
-                        api_url=config["apiUrl"],
-                        cert_sha256=config["certSha256"],
+                ],
+                [
+                    ProvisionStep(
+                        "read_config", f"cat {OUTLINE_ACCESS_FILE}", resumable=False
                     )
-                    await asyncio.sleep(10)
-                    return True  # Успешно – возвращаем True
-            except Exception as e:
-                if attempt != 0:
-                    await send_error_report(e)
-                logger.error(f"Попытка {attempt + 1}/{max_attempts} не удалась: {e}")
-                if attempt < max_attempts - 1:
-                    logger.info("Повторная попытка через 10 секунд...")
-                    await asyncio.sleep(10)
-        return False
+                ],
+            ],
+        ).run()
+        if outputs is None:
+            return False
+
+        config = self.extract_outline_config(
+            outputs.get("install_outline", "")
+        ) or self.parse_outline_access_file(outputs["read_config"])
+        if config is None:
+            logger.error("Ошибка при извлечении конфигурации Outline")
+            await send_error_report(
+                f"Ошибка при извлечении конфигурации Outline сервера {server.id}"
+            )
+            return False
+
+        await get_db_processor().update_server_by_id(
+            server.id, config["apiUrl"], config["certSha256"]
+        )
+        server.api_url = config["apiUrl"]
+        server.cert_sha256 = config["certSha256"]
+        # Старая сессия указывает на прежний адрес/сертификат сервера
+        await self.sessions.invalidate(server.id)
+
+        if not await wait_until_ready(
+            lambda: self.get_server_info(server),
+            SERVICE_READY_TIMEOUT,
+            description=f"API Outline сервера {server.id}",
+        ):
+            return False
+        logger.info(f"🎉 Сервер Outline установлен")
+        await send_new_server_report(
+            server_id=server.id,
+            ip=server.ip,
+            protocol="outline",
+            api_url=config["apiUrl"],
+            cert_sha256=config["certSha256"],
+        )
+        return True
 
     @create_server_session_by_id
     async def extend_data_limit_plus_200gb(self, key_id: int, server_id=None) -> bool:
@@ -0,0 +1,151 @@
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, Hashable
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд простоя сессия сервера закрывается
+SESSION_IDLE_TIMEOUT = int(os.getenv("SESSION_IDLE_TIMEOUT", 600))
+# Максимум одновременных соединений с одним сервером
+SESSION_CONNECTIONS_PER_HOST = int(os.getenv("SESSION_CONNECTIONS_PER_HOST", 20))
+# Сколько секунд держать простаивающее keep-alive соединение
+SESSION_KEEPALIVE_TIMEOUT = 60
+
+
+@dataclass
+class ServerSession:
+    """
+    HTTP-сессия для конкретного сервера.
+    signature описывает параметры подключения (например, отпечаток сертификата);
+    при их изменении сессия пересоздаётся.
+    Поля authenticated, auth_generation и auth_lock описывают авторизацию для API
+    с входом по cookie: auth_generation растёт при каждом успешном логине,
+    auth_lock не даёт параллельным задачам логиниться одновременно.
+    """
+
+    server_id: int
+    base_url: str
+    signature: Hashable
+    session: aiohttp.ClientSession
+    last_used: float = field(default_factory=time.monotonic)
+    authenticated: bool = False
+    auth_generation: int = 0
+    auth_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class ServerSessionRegistry:
+    """
+    Реестр HTTP-сессий по ID сервера.
+
+    Для каждого сервера держится одна aiohttp.ClientSession с пулом keep-alive соединений,
+    поэтому запросы к разным серверам не мешают друг другу, а повторные запросы к серверу
+    не выполняют TLS-рукопожатие заново. Сессии, простаивающие дольше idle_timeout,
+    закрываются при следующем обращении к реестру.
+    """
+
+    def __init__(
+        self,
+        ssl_factory: Callable[[Hashable], aiohttp.Fingerprint | bool],
+        idle_timeout: float = SESSION_IDLE_TIMEOUT,
+        cookie_jar_factory: Callable[[], aiohttp.abc.AbstractCookieJar] | None = None,
+    ):
+        """
+        :param ssl_factory: Функция, возвращающая параметр ssl коннектора по signature
+        :param idle_timeout: Время простоя, после которого сессия закрывается, сек
+        :param cookie_jar_factory: Функция, создающая CookieJar новой сессии (по умолчанию стандартный)
+        """
+        self._ssl_factory = ssl_factory
+        self._cookie_jar_factory = cookie_jar_factory
+        self._idle_timeout = idle_timeout
+        self._sessions: dict[int, ServerSession] = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get_cached(self, server_id: int) -> ServerSession | None:
+        """
+        Возвращает открытую сессию сервера без обращения к базе данных.
+        :param server_id: ID сервера
+        :return: ServerSession или None, если сессии нет
+        """
+        entry = self._sessions.get(server_id)
+        if entry is None or entry.session.closed:
+            return None
+        entry.last_used = time.monotonic()
+        return entry
+
+    async def get(
+        self, server_id: int, base_url: str, signature: Hashable = None
+    ) -> ServerSession:
+        """
+        Возвращает сессию сервера, создавая её при первом обращении
+        или при изменении адреса/параметров подключения.
+        :param server_id: ID сервера
+        :param base_url: Базовый URL API сервера
+        :param signature: Параметры подключения, от которых зависит коннектор
+        :return: ServerSession
+        """
+        await self.evict_idle()
+
+        entry = self._sessions.get(server_id)
+        if (
+            entry is not None
+            and not entry.session.closed
+            and entry.base_url == base_url
+            and entry.signature == signature
+        ):
+            entry.last_used = time.monotonic()
+            return entry
+
+        connector = aiohttp.TCPConnector(
+            ssl=self._ssl_factory(signature),
+            limit_per_host=SESSION_CONNECTIONS_PER_HOST,
+            keepalive_timeout=SESSION_KEEPALIVE_TIMEOUT,
+        )
+        new_entry = ServerSession(
+            server_id=server_id,
+            base_url=base_url,
+            signature=signature,
+            session=aiohttp.ClientSession(
+                connector=connector,
+                cookie_jar=self._cookie_jar_factory() if self._cookie_jar_factory else None,
+            ),
+        )
+        self._sessions[server_id] = new_entry
+        if entry is not None:
+            logger.info(f"Параметры подключения к серверу {server_id} изменились, сессия пересоздана")
+            await entry.session.close()
+        return new_entry
+
+    async def invalidate(self, server_id: int) -> None:
+        """
+        Закрывает сессию сервера (например, после переустановки сервера).
+        :param server_id: ID сервера
+        """
+        entry = self._sessions.pop(server_id, None)
+        if entry is not None:
+            await entry.session.close()
+
+    async def evict_idle(self) -> None:
+        """
+        Закрывает сессии, которые не использовались дольше idle_timeout.
+        """
+        deadline = time.monotonic() - self._idle_timeout
+        for server_id, entry in list(self._sessions.items()):
+            if entry.last_used < deadline or entry.session.closed:
+                del self._sessions[server_id]
+                logger.debug(f"Закрываем неиспользуемую сессию сервера {server_id}")
+                await entry.session.close()
+
+    async def close(self) -> None:
+        """
+        Закрывает все сессии.
+        """
+        sessions, self._sessions = self._sessions, {}
+        for entry in sessions.values():
+            await entry.session.close()
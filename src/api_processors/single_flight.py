@@ -0,0 +1,101 @@
+import asyncio
+import functools
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SingleFlightStats:
+    """
+    Счётчики объединения запросов по операциям.
+    calls — запросы, ушедшие на сервер,
+    collapsed — запросы, дождавшиеся уже выполняющегося такого же запроса.
+    """
+
+    calls: Counter = field(default_factory=Counter)
+    collapsed: Counter = field(default_factory=Counter)
+
+    def summary(self) -> str:
+        """Строка со счётчиками по операциям для лога."""
+        operations = sorted(self.calls.keys() | self.collapsed.keys())
+        if not operations:
+            return "запросов не было"
+        return ", ".join(
+            f"{operation}: на сервер {self.calls[operation]}, объединено {self.collapsed[operation]}"
+            for operation in operations
+        )
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых параллельных запросов.
+
+    Пока запрос с ключом key выполняется, остальные запросы с тем же ключом не обращаются
+    к серверу, а дожидаются его результата (или исключения). После завершения запроса
+    ключ освобождается: результат не кэшируется, следующий запрос уйдёт на сервер.
+    """
+
+    def __init__(self):
+        self._in_flight: dict[Hashable, asyncio.Task] = {}
+        self.stats = SingleFlightStats()
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    async def run(self, key: tuple, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполняет func или присоединяется к уже выполняющемуся запросу с тем же ключом.
+        :param key: Ключ запроса; первый элемент — имя операции (для статистики)
+        :param func: Функция, создающая корутину запроса
+        :return: Результат запроса
+        """
+        operation = key[0]
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.stats.collapsed[operation] += 1
+            logger.debug(f"Запрос {key} объединён с уже выполняющимся")
+        else:
+            self.stats.calls[operation] += 1
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(functools.partial(self._release, key))
+        # Отмена одного ожидающего не отменяет общий запрос для остальных
+        return await asyncio.shield(task)
+
+    def _release(self, key: tuple, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # Исключение уже получили ожидающие; помечаем его прочитанным
+            task.exception()
+
+
+# Общий реестр выполняющихся запросов к VPN-серверам
+request_coalescer = SingleFlight()
+
+
+def coalesce_requests(operation: str) -> Callable:
+    """
+    Декоратор метода процессора вида method(self, key_id, server_id=...):
+    параллельные вызовы с одинаковыми протоколом, сервером и ключом выполняются одним запросом.
+    Вызовы без server_id не объединяются: сервер для них выбирается из контекста задачи.
+    :param operation: Имя операции в ключе и статистике
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            server_id = kwargs.get("server_id")
+            key_id = args[0] if args else kwargs.get("key_id")
+            if server_id is None or key_id is None:
+                return await func(self, *args, **kwargs)
+            key = (operation, self.protocol_type, server_id, str(key_id))
+            return await request_coalescer.run(key, lambda: func(self, *args, **kwargs))
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,222 @@
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+import asyncssh
+
+from bot.routers.admin_router_sending_message import send_error_report
+
+logger = logging.getLogger(__name__)
+
+# Каталог на сервере с отметками о выполненных шагах установки
+PROVISION_STATE_DIR = "/var/lib/vpn-bot-provision"
+# Сколько секунд ждать, пока на новом сервере поднимется SSH
+SSH_READY_TIMEOUT = int(os.getenv("SSH_READY_TIMEOUT", 300))
+# Сколько секунд ждать, пока после установки начнёт отвечать API VPN-сервера
+SERVICE_READY_TIMEOUT = int(os.getenv("SERVICE_READY_TIMEOUT", 180))
+# Интервал опроса готовности сервера, сек
+READY_POLL_INTERVAL = float(os.getenv("READY_POLL_INTERVAL", 3))
+# Сколько раз повторять установку (выполненные шаги при повторе пропускаются)
+PROVISION_MAX_ATTEMPTS = int(os.getenv("PROVISION_MAX_ATTEMPTS", 5))
+
+
+class ProvisioningError(Exception):
+    """
+    Исключение, возникающее при ошибке шага установки сервера
+    """
+
+    pass
+
+
+@dataclass(frozen=True)
+class ProvisionStep:
+    """
+    Шаг установки сервера: shell-скрипт, выполняемый за одно обращение по SSH.
+    После успешного выполнения на сервере сохраняется отметка, и при повторной
+    установке шаг пропускается.
+    """
+
+    name: str
+    script: str
+    strict: bool = True  # Ошибка шага прерывает установку (иначе — только предупреждение)
+    input: str | None = None  # Данные для stdin скрипта
+    resumable: bool = True  # False — шаг выполняется при каждой попытке (например, чтение конфигурации)
+
+    @property
+    def marker(self) -> str:
+        return f"{PROVISION_STATE_DIR}/{self.name}.done"
+
+    @property
+    def command(self) -> str:
+        """
+        Команда для SSH: строгий шаг прерывается на первой ошибке (set -e),
+        отметка о выполнении ставится только после успешного завершения.
+        """
+        if not self.resumable:
+            return self.script
+        prefix = "set -e\n" if self.strict else ""
+        return f"{prefix}{self.script}\ntouch {self.marker}"
+
+
+async def wait_until_ready(
+    check: Callable[[], Awaitable],
+    timeout: float,
+    interval: float = READY_POLL_INTERVAL,
+    description: str = "сервер",
+) -> bool:
+    """
+    Опрашивает check, пока он не вернёт истинное значение, вместо фиксированной паузы.
+    Исключения check считаются неготовностью.
+    :param check: Асинхронная проверка готовности
+    :param timeout: Максимальное время ожидания, сек
+    :param interval: Интервал между проверками, сек
+    :param description: Что ожидается (для логов)
+    :return: True, если готовность дождались, иначе False
+    """
+    started = time.monotonic()
+    last_error = None
+    while True:
+        try:
+            if await check():
+                logger.info(
+                    f"{description} готов через {time.monotonic() - started:.1f} с"
+                )
+                return True
+        except Exception as e:
+            last_error = e
+        if time.monotonic() - started >= timeout:
+            logger.error(f"Таймаут ожидания готовности: {description} ({last_error})")
+            return False
+        await asyncio.sleep(interval)
+
+
+class SshPipeline:
+    """
+    Установка сервера по SSH из этапов: шаги одного этапа выполняются параллельно
+    в одном SSH-соединении, этапы — друг за другом. Выполненные шаги отмечаются
+    на сервере, поэтому повторная попытка продолжает установку с места ошибки.
+    """
+
+    def __init__(
+        self,
+        server,
+        stages: list[list[ProvisionStep]],
+        max_attempts: int = PROVISION_MAX_ATTEMPTS,
+        ssh_timeout: float = SSH_READY_TIMEOUT,
+        poll_interval: float = READY_POLL_INTERVAL,
+    ):
+        """
+        :param server: Объект сервера с атрибутами ip и password
+        :param stages: Этапы установки
+        :param max_attempts: Сколько раз повторять установку
+        :param ssh_timeout: Сколько секунд ждать доступности SSH
+        :param poll_interval: Интервал опроса готовности, сек
+        """
+        self.server = server
+        self.stages = stages
+        self.max_attempts = max_attempts
+        self.ssh_timeout = ssh_timeout
+        self.poll_interval = poll_interval
+        self.completed: set[str] = set()
+
+    async def _connect(self) -> asyncssh.SSHClientConnection:
+        """
+        Подключается к серверу, опрашивая SSH до его готовности.
+        :return: SSH-соединение
+        """
+        connection = None
+
+        async def try_connect() -> bool:
+            nonlocal connection
+            connection = await asyncssh.connect(
+                host=self.server.ip,
+                username="root",
+                password=self.server.password,
+                known_hosts=None,
+            )
+            return True
+
+        if not await wait_until_ready(
+            try_connect,
+            self.ssh_timeout,
+            self.poll_interval,
+            description=f"SSH сервера {self.server.ip}",
+        ):
+            raise ProvisioningError(f"SSH сервера {self.server.ip} недоступен")
+        return connection
+
+    async def _load_completed(self, conn) -> None:
+        """
+        Читает с сервера отметки выполненных шагов (могли остаться от прошлых попыток).
+        """
+        result = await conn.run(
+            f"mkdir -p {PROVISION_STATE_DIR} && ls {PROVISION_STATE_DIR}", check=False
+        )
+        for line in (result.stdout or "").split():
+            if line.endswith(".done"):
+                self.completed.add(line.removesuffix(".done"))
+
+    async def _run_step(self, conn, step: ProvisionStep) -> str:
+        """
+        Выполняет шаг установки.
+        :return: stdout шага
+        """
+        started = time.monotonic()
+        logger.info(f"➡ {self.server.ip}: {step.name}")
+        result = await conn.run(step.command, input=step.input, check=False)
+        elapsed = time.monotonic() - started
+        if result.exit_status != 0:
+            message = (
+                f"Шаг {step.name} на {self.server.ip} завершился с ошибкой: "
+                f"{(result.stderr or '').strip()}"
+            )
+            if step.strict:
+                raise ProvisioningError(message)
+            logger.warning(f"⚠ {message}")
+        if step.resumable:
+            self.completed.add(step.name)
+        logger.info(f"✅ {self.server.ip}: {step.name} за {elapsed:.1f} с")
+        return result.stdout or ""
+
+    async def _run_attempt(self) -> dict[str, str]:
+        outputs = {}
+        async with await self._connect() as conn:
+            await self._load_completed(conn)
+            for stage in self.stages:
+                steps = [step for step in stage if step.name not in self.completed]
+                for step in stage:
+                    if step.name in self.completed:
+                        logger.info(f"⏭ {self.server.ip}: {step.name} уже выполнен")
+                results = await asyncio.gather(
+                    *(self._run_step(conn, step) for step in steps)
+                )
+                outputs.update(zip((step.name for step in steps), results))
+        return outputs
+
+    async def run(self) -> dict[str, str] | None:
+        """
+        Выполняет установку, при ошибке повторяет её с невыполненных шагов.
+        :return: stdout шагов, выполненных в успешной попытке, или None, если установка не удалась
+        """
+        started = time.monotonic()
+        for attempt in range(self.max_attempts):
+            try:
+                outputs = await self._run_attempt()
+                logger.info(
+                    f"🎉 Установка на {self.server.ip} завершена за "
+                    f"{time.monotonic() - started:.1f} с"
+                )
+                return outputs
+            except Exception as e:
+                if attempt != 0:
+                    await send_error_report(e)
+                logger.error(
+                    f"Попытка установки {attempt + 1}/{self.max_attempts} "
+                    f"на {self.server.ip} не удалась: {e}"
+                )
+                if attempt < self.max_attempts - 1:
+                    await asyncio.sleep(self.poll_interval)
+        return None
@@ -1,46 +1,161 @@
 from coolname import generate_slug
 from dotenv import load_dotenv
-import requests
-import asyncssh
+from dataclasses import dataclass
+from contextvars import ContextVar
+import functools
+from collections import defaultdict
+import aiohttp
+from yarl import URL
 import asyncio
-import urllib3
 import json
+import time
 import uuid
 import os
 import logging
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
 from api_processors.base_processor import BaseProcessor
+from api_processors.inbound_snapshot import ClientEntry, InboundSnapshot
 from api_processors.key_models import VlessKey
-
-from bot.routers.admin_router_sending_message import (
-    send_error_report,
-    send_new_server_report,
+from api_processors.session_registry import ServerSession, ServerSessionRegistry
+from api_processors.single_flight import coalesce_requests
+from api_processors.ssh_provisioning import (
+    SERVICE_READY_TIMEOUT,
+    ProvisionStep,
+    SshPipeline,
+    wait_until_ready,
 )
 
+from bot.routers.admin_router_sending_message import send_new_server_report
+
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
 NAME_VPN_CONFIG = "MyNewInbound"
 
+PANEL_USERNAME = "lisa_admin"
+PANEL_PORT = 2053
+SUB_PORT = 2096
+# Таймаут одного запроса к панели 3x-ui
+PANEL_REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=10)
+# Сколько секунд переиспользуется снимок /panel/inbound/list/ сервера
+INBOUND_SNAPSHOT_TTL = float(os.getenv("INBOUND_SNAPSHOT_TTL", 30))
+# Сколько клиентов добавляется в одном запросе addClient при пакетном создании
+VLESS_BATCH_SIZE = 50
+
+
+@dataclass
+class XuiPanel:
+    """
+    Панель 3x-ui сервера, с которой работает текущая задача.
+    """
+
+    server_id: int
+    ip: str
+    password: str
+    server_session: ServerSession
+
+    @property
+    def host(self) -> str:
+        return f"https://{self.ip}:{PANEL_PORT}"
+
+    @property
+    def data(self) -> dict:
+        return {"username": PANEL_USERNAME, "password": self.password}
+
+
+@dataclass
+class LoginStats:
+    """
+    Счётчики использования кэша авторизации в панелях 3x-ui.
+    hits — операция выполнена с уже авторизованной сессией,
+    misses — перед операцией потребовался логин,
+    relogins — повторный логин после 401/редиректа на страницу входа или ошибки запроса.
+    """
+
+    hits: int = 0
+    misses: int = 0
+    relogins: int = 0
+
+    def summary(self) -> str:
+        """Строка со счётчиками для лога."""
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total else 0
+        return (
+            f"без логина {self.hits}, с логином {self.misses} ({hit_rate:.1f}% из кэша), "
+            f"повторные логины {self.relogins}"
+        )
+
+
+class PanelAuthError(Exception):
+    """
+    Панель 3x-ui не считает сессию авторизованной (cookie истёк или сброшен).
+    """
+
+    pass
+
+
+# Панель текущей задачи: у каждой asyncio-задачи своё значение,
+# поэтому параллельные запросы к разным серверам не мешают друг другу
+_current_panel: ContextVar[XuiPanel | None] = ContextVar("xui_panel", default=None)
+
 
 class VlessProcessor(BaseProcessor):
+    protocol_type = "vless"
+    sub_port = SUB_PORT
+    port_panel = PANEL_PORT
+
     def __init__(self, ip, password):
-        self.ip = None
-        self.sub_port = None
-        self.port_panel = None
-        self.host = None
-        self.data = None
-        self.ses = None
-        self.con = None
-        self.server_id = None
+        # Для каждого сервера держится своя aiohttp-сессия с пулом соединений и cookie панели.
+        # Сертификат панели самоподписанный, поэтому проверка SSL отключена.
+        # unsafe=True нужен, чтобы CookieJar сохранял cookie для хоста, заданного IP-адресом.
+        self.sessions = ServerSessionRegistry(
+            ssl_factory=lambda signature: False,
+            cookie_jar_factory=lambda: aiohttp.CookieJar(unsafe=True),
+        )
+        self.login_stats = LoginStats()
+        # Снимки inbound'ов по ID сервера и блокировки их обновления
+        self._snapshots: dict[int, InboundSnapshot] = {}
+        self._snapshot_locks: defaultdict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    @property
+    def panel(self) -> XuiPanel | None:
+        return _current_panel.get()
+
+    @property
+    def ip(self) -> str | None:
+        return self.panel.ip if self.panel else None
+
+    @property
+    def host(self) -> str | None:
+        return self.panel.host if self.panel else None
+
+    @property
+    def data(self) -> dict | None:
+        return self.panel.data if self.panel else None
+
+    @property
+    def server_id(self) -> int | None:
+        return self.panel.server_id if self.panel else None
+
+    @property
+    def ses(self) -> aiohttp.ClientSession | None:
+        return self.panel.server_session.session if self.panel else None
+
+    @property
+    def con(self) -> bool:
+        """
+        Сессия текущей панели авторизована и cookie авторизации ещё не истёк.
+        """
+        if not self.panel or not self.panel.server_session.authenticated:
+            return False
+        # CookieJar сам удаляет просроченные cookie
+        return bool(self.ses.cookie_jar.filter_cookies(URL(self.host)))
 
     @staticmethod
     def create_server_session_by_id(func):
         """
-        Декоратор для создания сессии с сервером по переданному ID сервера.
+        Декоратор для работы с сервером по переданному ID сервера.
 
         :param func: Функция, которую декоратор оборачивает.
         :return: Результат выполнения функции, обернутой декоратором.
@@ -50,42 +165,47 @@ class VlessProcessor(BaseProcessor):
         2. Если `server_id` не передан, выбрасывает исключение.
         3. Использует `db_processor` для получения данных о сервере по ID.
         4. Если сервер не найден, выбрасывает исключение.
-        5. Инициализирует параметры подключения (IP, порт, данные).
-        6. Создает новую сессию с помощью `requests.Session`.
-        7. Выполняет исходную функцию с аргументами.
-        8. В случае ошибки при установке соединения выбрасывает исключение.
+        5. Берёт aiohttp-сессию сервера из реестра и делает панель сервера текущей для задачи.
+        6. Выполняет исходную функцию с аргументами (логин выполняется лениво в `_ensure_session_ok`).
         """
 
-        def wrapper(self, *args, **kwargs):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
             server_id = kwargs.get("server_id")
             if server_id is None:
                 raise ValueError("!!!server_id must be passed as a keyword argument!!!")
 
             from initialization.db_processor_init import db_processor
 
-            server = db_processor.get_server_by_id(server_id)
+            server = await db_processor.get_server_by_id(server_id)
             if server is None:
                 raise ValueError(f"Сервер с ID {server_id} не найден в базе данных")
 
-            self.ip = server.ip
-            self.sub_port = 2096
-            self.port_panel = 2053
-            self.host = f"https://{self.ip}:{self.port_panel}"
-            self.data = {"username": "lisa_admin", "password": server.password}
-
+            token = _current_panel.set(await self._get_panel(server))
             try:
-                self.ses = requests.Session()
-                self.ses.verify = False
-                self.con = self._connect()
-            except Exception as e:
-                asyncio.create_task(send_error_report(e))
-                self.ses = None
-                raise RuntimeError(f"Ошибка при установке соединения: {e}")
-
-            return func(self, *args, **kwargs)
+                return await func(self, *args, **kwargs)
+            finally:
+                _current_panel.reset(token)
 
         return wrapper
 
+    async def _get_panel(self, server) -> XuiPanel:
+        """
+        Возвращает панель сервера с сессией из реестра.
+        При смене IP или пароля сервера сессия пересоздаётся.
+        :param server: Объект сервера
+        :return: XuiPanel
+        """
+        server_session = await self.sessions.get(
+            server.id, f"https://{server.ip}:{PANEL_PORT}", server.password
+        )
+        return XuiPanel(
+            server_id=server.id,
+            ip=server.ip,
+            password=server.password,
+            server_session=server_session,
+        )
+
     async def create_server_session(self, user_id=None):
         """
         Создает сессию для подключения к серверу с минимальным количеством пользователей для типа "vless".
@@ -94,102 +214,110 @@ class VlessProcessor(BaseProcessor):
 
         Алгоритм работы:
         1. Получает сервер с минимальным количеством пользователей для типа "vless" с использованием `db_processor`.
-        2. Извлекает параметры подключения (IP, порты, данные для аутентификации).
-        3. Инициализирует объект сессии с помощью `requests.Session`.
-        4. Отключает проверку сертификатов с помощью `self.ses.verify = False`.
-        5. Устанавливает соединение с сервером через метод `_connect()`.
-        6. Сохраняет ID сервера в атрибуте `self.server_id`.
+        2. Берёт aiohttp-сессию сервера из реестра и делает панель сервера текущей для задачи.
+        Логин выполняется лениво при первом запросе через `_ensure_session_ok()`.
         """
         from initialization.db_processor_init import db_processor
 
-        # if self.ses is not None:
-        #     return
-
         server = await db_processor.get_server_with_min_users("vless", user_id=user_id)
 
-        self.ip = server.ip
-        self.sub_port = 2096
-        self.port_panel = 2053
-        self.host = f"https://{self.ip}:{self.port_panel}"
-        self.data = {"username": "lisa_admin", "password": server.password}
-        self.ses = requests.Session()
-        self.ses.verify = False
-        self.con = self._connect()
-        self.server_id = server.id
+        _current_panel.set(await self._get_panel(server))
 
-    def _connect(self) -> bool:
+    async def _connect(self) -> bool:
         """
         Логин в панель 3x-ui. Возвращает True, если успешно.
+        Cookie авторизации сохраняется в сессии сервера и используется следующими запросами.
         """
+        server_session = self.panel.server_session
         try:
-            resp = self.ses.post(f"{self.host}/login", data=self.data, timeout=10)
-            resp.raise_for_status()
-            resp_json = resp.json()
+            async with self.ses.post(
+                f"{self.host}/login", data=self.data, timeout=PANEL_REQUEST_TIMEOUT
+            ) as resp:
+                resp.raise_for_status()
+                resp_json = await resp.json(content_type=None)
             if resp_json.get("success") is True:
                 logger.debug(f"✅Подключение к панели 3x-ui {self.ip} прошло успешно!")
+                server_session.authenticated = True
+                server_session.auth_generation += 1
                 return True
             else:
                 msg = resp_json.get("msg", "Unknown error from /login")
                 logger.warning(f"🛑Ошибка логина: {msg} на {self.ip}")
+                server_session.authenticated = False
                 return False
-        except (requests.RequestException, ValueError) as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
             logger.error(f"Ошибка сети/JSON при логине к {self.host}: {e}")
+            server_session.authenticated = False
             return False
 
-    def _reconnect(self) -> bool:
+    async def _reconnect(self, generation: int | None = None) -> bool:
         """
-        Закрывает старую сессию, создаёт новую и пробует снова залогиниться.
+        Сбрасывает cookie сессии и пробует снова залогиниться.
+        Логины к одному серверу выполняются под блокировкой: если другая задача уже
+        переавторизовалась после неудачного запроса (generation изменился), повторный логин не нужен.
+        :param generation: Номер авторизации, с которой был сделан неудачный запрос
         """
-        logger.info("Переавторизация (reconnect) в 3x-ui...")
-        if self.ses:
-            self.ses.close()
-        self.ses = requests.Session()
-        self.ses.verify = False
-        self.con = self._connect()
-        return self.con
+        server_session = self.panel.server_session
+        async with server_session.auth_lock:
+            if generation is not None and server_session.auth_generation != generation and self.con:
+                return True
+            logger.info("Переавторизация (reconnect) в 3x-ui...")
+            self.login_stats.relogins += 1
+            self.ses.cookie_jar.clear()
+            server_session.authenticated = False
+            return await self._connect()
 
-    def _check_connect(self) -> bool:
+    async def _check_connect(self) -> bool:
         """
         Проверяем, есть ли уже inbound (подключение), или нужно создавать новое.
         """
         if not self.con:
             return False
 
-        try:
-            resource = self.ses.post(
-                f"{self.host}/panel/inbound/list/", data=self.data
-            ).json()
-            if not resource.get("success"):
-                logger.warning(
-                    f'🛑Ошибка при проверке подключения: {resource.get("msg")}'
-                )
-                return False
-            # Если inbound'ы есть, считаем, что подключение уже настроено
-            if resource.get("obj") and len(resource["obj"]) > 0:
-                logger.debug(f"Подключение уже есть")
-                return True
-
-            logger.warning(f"⚠️Подключение (inbound) не найдено")
-            return False
-        except requests.RequestException as e:
-            asyncio.create_task(send_error_report(e))
-            logger.error(f"Ошибка сети при _check_connect: {e}")
+        snapshot = await self._get_snapshot(refresh=True)
+        if snapshot is None:
+            logger.warning("🛑Ошибка при проверке подключения")
             return False
+        # Если inbound'ы есть, считаем, что подключение уже настроено
+        if snapshot.inbounds:
+            logger.debug(f"Подключение уже есть")
+            return True
+
+        logger.warning(f"⚠️Подключение (inbound) не найдено")
+        return False
 
-    def _ensure_session_ok(self) -> bool:
+    async def _ensure_session_ok(self) -> bool:
         """
-        "Рефреш сессии": если self.con = False, пытаемся залогиниться заново.
+        "Рефреш сессии": если сессия не авторизована или cookie истёк, логинимся заново.
+        Параллельные операции с одним сервером дожидаются одного логина.
         Возвращает True, если сессия теперь в порядке; False – если нет.
         """
-        if not self.con:
+        if self.con:
+            self.login_stats.hits += 1
+            return True
+
+        async with self.panel.server_session.auth_lock:
+            if self.con:
+                self.login_stats.hits += 1
+                return True
+            self.login_stats.misses += 1
             logger.info("Сессия неактивна, пробуем авторизоваться заново...")
-            ok = self._reconnect()
-            if not ok:
+            if not await self._connect():
                 logger.error("Не удалось переавторизоваться!")
                 return False
         return True
 
-    def _request_json(
+    @staticmethod
+    def _is_auth_error(resp: aiohttp.ClientResponse) -> bool:
+        """
+        Проверяет, что панель отклонила запрос из-за авторизации:
+        ответ 401 или редирект на страницу входа.
+        """
+        if resp.status == 401:
+            return True
+        return bool(resp.history) and resp.url.path.rstrip("/") in ("", "/login")
+
+    async def _request_json(
         self,
         endpoint: str,
         data: dict = None,
@@ -205,24 +333,36 @@ class VlessProcessor(BaseProcessor):
             data = {}
         url = f"{self.host}{endpoint}"
 
+        server_session = self.panel.server_session
         for attempt in range(max_retries):
+            generation = server_session.auth_generation
             try:
                 if method.lower() == "post":
-                    resp = self.ses.post(url, data=data, timeout=10, **kwargs)
+                    request = self.ses.post(
+                        url, data=data, timeout=PANEL_REQUEST_TIMEOUT, **kwargs
+                    )
                 else:
-                    resp = self.ses.get(url, timeout=10, **kwargs)
-
-                resp.raise_for_status()
-                result = resp.json()
-                return result
-
-            except (requests.RequestException, json.JSONDecodeError) as e:
+                    request = self.ses.get(url, timeout=PANEL_REQUEST_TIMEOUT, **kwargs)
+
+                async with request as resp:
+                    if self._is_auth_error(resp):
+                        raise PanelAuthError(f"Панель {self.ip} запросила повторный вход")
+                    resp.raise_for_status()
+                    # Панель отдаёт JSON с разными Content-Type, а при потере сессии — HTML
+                    return await resp.json(content_type=None)
+
+            except (
+                PanelAuthError,
+                aiohttp.ClientError,
+                asyncio.TimeoutError,
+                ValueError,
+            ) as e:
                 logger.error(
                     f"Ошибка при запросе {url}, попытка {attempt + 1}/{max_retries}: {e}"
                 )
                 if attempt < max_retries - 1:
                     # Пробуем переавторизоваться и повторить
-                    ok = self._reconnect()
+                    ok = await self._reconnect(generation)
                     if not ok:
                         logger.error("Переавторизация не удалась.")
                         return None
@@ -231,17 +371,17 @@ class VlessProcessor(BaseProcessor):
 
         return None
 
-    def _add_new_connect(self) -> tuple[bool, str]:
+    async def _add_new_connect(self) -> tuple[bool, str]:
         """
         Добавляет новый inbound (подключение).
         """
-        if not self._ensure_session_ok():
+        if not await self._ensure_session_ok():
             return False, "Сессия недоступна"
 
         logger.debug(f"Добавляем новое подключение на сервере {self.ip}...")
 
         # Шаг 1: Получаем ключи (privateKey/publicKey)
-        cert_ok, cert_obj_or_msg = self._get_new_x25519_cert()
+        cert_ok, cert_obj_or_msg = await self._get_new_x25519_cert()
         if not cert_ok:
             logger.warning(f"Не удалось получить X25519-сертификат: {cert_obj_or_msg}")
             return False, cert_obj_or_msg
@@ -320,11 +460,12 @@ class VlessProcessor(BaseProcessor):
         }
 
         # Шаг 3: Добавляем inbound
-        resp_json = self._request_json(
+        resp_json = await self._request_json(
             "/panel/inbound/add", data=payload, headers=header
         )
         if not resp_json:
             return False, "Пустой ответ /panel/inbound/add"
+        self._invalidate_snapshot()
         if resp_json.get("success"):
             logger.debug("Успешно создали inbound!")
             return True, "OK"
@@ -333,14 +474,14 @@ class VlessProcessor(BaseProcessor):
             logger.warning(f"Ошибка при добавлении inbound: {msg}")
             return False, msg
 
-    def _get_new_x25519_cert(self) -> tuple[bool, dict]:
+    async def _get_new_x25519_cert(self) -> tuple[bool, dict]:
         """
         Запрашивает у панели новую пару ключей (privateKey / publicKey).
         """
-        if not self._ensure_session_ok():
+        if not await self._ensure_session_ok():
             return False, "Сессия недоступна"
 
-        resp_json = self._request_json("/server/getNewX25519Cert", data=self.data)
+        resp_json = await self._request_json("/server/getNewX25519Cert", data=self.data)
         if not resp_json:
             return False, "Не получили JSON /server/getNewX25519Cert"
         if resp_json.get("success"):
@@ -348,7 +489,70 @@ class VlessProcessor(BaseProcessor):
         else:
             return False, resp_json.get("msg", "Неизвестная ошибка")
 
-    def _get_link(self, key_id: str, key_name: str) -> str | bool:
+    async def _get_snapshot(self, refresh: bool = False) -> InboundSnapshot | None:
+        """
+        Возвращает снимок inbound'ов текущего сервера.
+        Снимок переиспользуется INBOUND_SNAPSHOT_TTL секунд; параллельные задачи,
+        которым нужен новый снимок, дожидаются одного запроса к панели.
+
+        :param refresh: Получить снимок заново, даже если кэшированный ещё свежий.
+        :return: InboundSnapshot или None, если список inbound'ов получить не удалось.
+        """
+        server_id = self.server_id
+        requested_at = time.monotonic()
+        snapshot = self._snapshots.get(server_id)
+        if (
+            not refresh
+            and snapshot is not None
+            and snapshot.host == self.host
+            and snapshot.is_fresh(INBOUND_SNAPSHOT_TTL)
+        ):
+            return snapshot
+
+        async with self._snapshot_locks[server_id]:
+            snapshot = self._snapshots.get(server_id)
+            # Пока ждали блокировку, другая задача могла уже получить свежий снимок
+            if (
+                snapshot is not None
+                and snapshot.host == self.host
+                and snapshot.created_at >= requested_at
+            ):
+                return snapshot
+
+            resource = await self._request_json("/panel/inbound/list/", data=self.data)
+            if not resource or not resource.get("success"):
+                logger.warning(f"Не удалось получить inbound list сервера {server_id}.")
+                return None
+            snapshot = InboundSnapshot.from_inbound_list(
+                self.host, resource.get("obj") or []
+            )
+            self._snapshots[server_id] = snapshot
+            return snapshot
+
+    def _invalidate_snapshot(self) -> None:
+        """
+        Сбрасывает снимок inbound'ов текущего сервера (после изменений на панели).
+        """
+        self._snapshots.pop(self.server_id, None)
+
+    async def _find_client(self, key_id: str) -> ClientEntry | None:
+        """
+        Ищет клиента по ID в снимке inbound'ов.
+        Если ключа нет в кэшированном снимке, снимок один раз обновляется.
+
+        :param key_id: ID клиента (client.id)
+        :return: ClientEntry или None, если ключ не найден.
+        """
+        snapshot = await self._get_snapshot()
+        if snapshot is None:
+            return None
+        entry = snapshot.clients_by_id.get(key_id)
+        if entry is None:
+            snapshot = await self._get_snapshot(refresh=True)
+            entry = snapshot.clients_by_id.get(key_id) if snapshot else None
+        return entry
+
+    async def _get_link(self, key_id: str, key_name: str) -> str | bool:
         """
         Генерация ссылки для клиента (vless://...) для подключения к серверу.
 
@@ -359,26 +563,24 @@ class VlessProcessor(BaseProcessor):
 
         Алгоритм работы:
         1. Проверяется наличие активного соединения.
-        2. Выполняется POST-запрос к панели управления для получения списка inbound соединений.
-        3. Проверяется наличие успешного ответа и данных о первом inbound соединении.
-        4. Извлекаются параметры настройки потока (streamSettings), включая публичный ключ.
-        5. Формируется ссылка для клиента с использованием полученных данных.
-        6. В случае ошибок в процессе генерируется лог с подробным описанием.
+        2. Берётся первый inbound из снимка inbound'ов сервера.
+        3. Извлекаются параметры настройки потока (streamSettings), включая публичный ключ.
+        4. Формируется ссылка для клиента с использованием полученных данных.
+        5. В случае ошибок в процессе генерируется лог с подробным описанием.
         """
 
-        if not self._ensure_session_ok():
+        if not await self._ensure_session_ok():
             return False
 
-        resource = self._request_json("/panel/inbound/list/", data=self.data)
-        if not resource or not resource.get("success"):
+        snapshot = await self._get_snapshot()
+        if snapshot is None:
             logger.error("Не удалось получить inbound/list для _get_link.")
             return False
-        inbound_list = resource.get("obj", [])
-        if not inbound_list:
+        inbound_obj = snapshot.first_inbound
+        if not inbound_obj:
             logger.error("Нет inbound'ов (пусто).")
             return False
 
-        inbound_obj = inbound_list[0]
         stream_settings_str = inbound_obj.get("streamSettings")
         if not stream_settings_str:
             return False
@@ -403,49 +605,52 @@ class VlessProcessor(BaseProcessor):
             f"&fp=chrome&sni={sni}&sid={sid}&spx=%2F&flow={flow}#{key_name}"
         )
 
-    async def create_vpn_key(
-        self,
-        user_id: int | None = None,
-        expire_time: int = 0,
-        sni: str = "dl.google.com",
-        port: int = 443,
-        data_limit: int = 200 * 1024**3,
-    ) -> tuple[VlessKey, int]:
+    async def _get_target_inbound(self) -> tuple[dict | None, str]:
         """
-        Создает новый VPN-ключ VLESS на удаленном сервере,
-        помещая клиента в первый доступный inbound (или создаёт inbound, если его нет).
-        ...
-        """
-        await self.create_server_session(user_id=user_id)
-        if not self._ensure_session_ok():
-            return None, "Сессия недоступна"
+        Возвращает inbound, в который добавляются новые клиенты (первый в списке).
+        Если получить список не удалось, пробует создать inbound.
 
-        inbound_list_data = self._request_json("/panel/inbound/list/", data=self.data)
-        if not inbound_list_data or not inbound_list_data.get("success"):
+        :return: Кортеж (inbound или None, сообщение об ошибке)
+        """
+        snapshot = await self._get_snapshot()
+        if snapshot is None:
             logger.warning(
                 "Не удалось получить inbound/list, пробуем создать inbound..."
             )
-            add_ok, add_msg = self._add_new_connect()
+            add_ok, add_msg = await self._add_new_connect()
             if not add_ok:
                 return None, f"Не удалось создать inbound: {add_msg}"
-            inbound_list_data = self._request_json(
-                "/panel/inbound/list/", data=self.data
-            )
-            if not inbound_list_data or not inbound_list_data.get("obj"):
+            snapshot = await self._get_snapshot(refresh=True)
+            if snapshot is None or not snapshot.inbounds:
                 return None, "Inbound list по-прежнему пуст"
 
-        inbound_list = inbound_list_data.get("obj", [])
-        if not inbound_list:
+        first_inbound = snapshot.first_inbound
+        if not first_inbound:
             return None, "Нет inbound для создания клиента"
-        first_inbound = inbound_list[0]
-        inbound_id = first_inbound.get("id")
-        if not inbound_id:
+        if not first_inbound.get("id"):
             return None, "Inbound не имеет ID"
+        return first_inbound, "OK"
 
-        # 2) Формируем ссылку
-        stream_settings_str = first_inbound.get("streamSettings", "{}")
+    async def _add_clients(
+        self,
+        count: int,
+        expire_time: int,
+        sni: str,
+        port: int,
+        data_limit: int,
+    ) -> tuple[list[VlessKey] | None, str]:
+        """
+        Добавляет `count` клиентов в первый inbound одним запросом addClient.
+
+        :return: Кортеж (список созданных ключей или None, сообщение об ошибке)
+        """
+        inbound, msg = await self._get_target_inbound()
+        if inbound is None:
+            return None, msg
+
+        # Параметры ссылки
         try:
-            stream_settings = json.loads(stream_settings_str)
+            stream_settings = json.loads(inbound.get("streamSettings", "{}"))
         except json.JSONDecodeError:
             logger.error("Невалидный JSON streamSettings")
             return None, "Невалидный JSON streamSettings"
@@ -457,57 +662,113 @@ class VlessProcessor(BaseProcessor):
         short_ids = reality.get("shortIds", [])
         sid = short_ids[0] if short_ids else "deced1f3"
 
-        key_name = generate_slug(2).replace("-", " ")
-        unique_id = str(uuid.uuid4())
-
-        access_url = (
-            f"vless://{unique_id}@{self.ip}:{port}/?type=tcp&security=reality&pbk={public_key}"
-            f"&fp=chrome&sni={sni}&sid={sid}&spx=%2F&flow={flow}#{key_name}"
-        )
-
-        # 3) Добавляем клиента
-        payload = {
-            "id": inbound_id,
-            "settings": json.dumps(
+        keys = []
+        clients = []
+        for _ in range(count):
+            key_name = generate_slug(2).replace("-", " ")
+            unique_id = str(uuid.uuid4())
+            keys.append(
+                VlessKey(
+                    key_id=unique_id,
+                    email=unique_id,
+                    name=key_name,
+                    access_url=(
+                        f"vless://{unique_id}@{self.ip}:{port}/?type=tcp&security=reality&pbk={public_key}"
+                        f"&fp=chrome&sni={sni}&sid={sid}&spx=%2F&flow={flow}#{key_name}"
+                    ),
+                    used_bytes=0,
+                    data_limit=data_limit,
+                )
+            )
+            clients.append(
                 {
-                    "clients": [
-                        {
-                            "id": unique_id,
-                            "alterId": 0,
-                            "email": unique_id,
-                            "limitIp": 5,
-                            "totalGB": data_limit,
-                            "expiryTime": expire_time,
-                            "enable": True,
-                            "flow": flow,
-                            "subId": unique_id,
-                            "comment": key_name,
-                        }
-                    ]
+                    "id": unique_id,
+                    "alterId": 0,
+                    "email": unique_id,
+                    "limitIp": 5,
+                    "totalGB": data_limit,
+                    "expiryTime": expire_time,
+                    "enable": True,
+                    "flow": flow,
+                    "subId": unique_id,
+                    "comment": key_name,
                 }
-            ),
+            )
+
+        payload = {
+            "id": inbound.get("id"),
+            "settings": json.dumps({"clients": clients}),
         }
         header = {"Accept": "application/json"}
-        resource = self._request_json(
+        resource = await self._request_json(
             "/panel/inbound/addClient", data=payload, headers=header
         )
+        self._invalidate_snapshot()
         if not resource:
             return None, "Нет ответа /panel/inbound/addClient"
         if resource.get("success"):
-            return (
-                VlessKey(
-                    key_id=unique_id,
-                    email=unique_id,
-                    name=key_name,
-                    access_url=access_url,
-                    used_bytes=0,
-                    data_limit=data_limit,
-                ),
-                self.server_id,
-            )
+            return keys, "OK"
         else:
-            msg = resource.get("msg", "Неизвестная ошибка addClient")
+            return None, resource.get("msg", "Неизвестная ошибка addClient")
+
+    async def create_vpn_key(
+        self,
+        user_id: int | None = None,
+        expire_time: int = 0,
+        sni: str = "dl.google.com",
+        port: int = 443,
+        data_limit: int = 200 * 1024**3,
+    ) -> tuple[VlessKey, int]:
+        """
+        Создает новый VPN-ключ VLESS на удаленном сервере,
+        помещая клиента в первый доступный inbound (или создаёт inbound, если его нет).
+        ...
+        """
+        await self.create_server_session(user_id=user_id)
+        if not await self._ensure_session_ok():
+            return None, "Сессия недоступна"
+
+        keys, msg = await self._add_clients(1, expire_time, sni, port, data_limit)
+        if keys is None:
             return None, msg
+        return keys[0], self.server_id
+
+    @create_server_session_by_id
+    async def create_vpn_keys(
+        self,
+        count: int,
+        server_id: int = None,
+        expire_time: int = 0,
+        sni: str = "dl.google.com",
+        port: int = 443,
+        data_limit: int = 200 * 1024**3,
+    ) -> list[VlessKey]:
+        """
+        Создает сразу несколько VPN-ключей на указанном сервере.
+        Клиенты добавляются пачками по VLESS_BATCH_SIZE в одном запросе addClient.
+        Учёт занятых мест на сервере (cnt_users) остаётся на вызывающей стороне.
+
+        :param count: Количество ключей.
+        :param server_id: Идентификатор сервера.
+        :return: Список созданных ключей (может быть короче count, если часть пачек не создалась).
+        """
+        if not await self._ensure_session_ok():
+            return []
+
+        created = []
+        for start in range(0, count, VLESS_BATCH_SIZE):
+            batch_size = min(VLESS_BATCH_SIZE, count - start)
+            keys, msg = await self._add_clients(
+                batch_size, expire_time, sni, port, data_limit
+            )
+            if keys is None:
+                logger.error(
+                    f"Не удалось создать {batch_size} ключей на сервере {server_id}: {msg}"
+                )
+                break
+            created.extend(keys)
+        logger.info(f"Создано ключей VLESS на сервере {server_id}: {len(created)}/{count}")
+        return created
 
     @create_server_session_by_id
     async def rename_key(self, key_id: str, server_id: int, new_key_name: str) -> bool:
@@ -521,145 +782,135 @@ class VlessProcessor(BaseProcessor):
         :return: True, если ключ успешно переименован, иначе False.
         """
 
-        if not self._ensure_session_ok():
+        if not await self._ensure_session_ok():
             return False
 
-        resource = self._request_json("/panel/inbound/list/", data=self.data)
-        if not resource or not resource.get("success"):
-            logger.warning("Не получили inbound list при rename_key.")
+        entry = await self._find_client(key_id)
+        if entry is None:
+            logger.warning(f"Ключ {key_id} не найден при rename_key.")
             return False
 
-        inbound_list = resource.get("obj", [])
-        for inbound in inbound_list:
-            inbound_id = inbound.get("id")
-            settings_str = inbound.get("settings", "{}")
-            try:
-                inbound_settings = json.loads(settings_str)
-            except json.JSONDecodeError:
-                continue
-            clients = inbound_settings.get("clients", [])
-            for client in clients:
-                if client.get("id") == key_id:
-                    old_comment = client.get("comment", "")
-                    client["comment"] = new_key_name
-                    update_payload = {
-                        "id": inbound_id,
-                        "settings": json.dumps({"clients": [client]}),
-                    }
-                    resp = self._request_json(
-                        f"/panel/inbound/updateClient/{key_id}", data=update_payload
-                    )
-                    if not resp:
-                        logger.warning("Нет ответа updateClient (rename_key).")
-                        return False
-                    if resp.get("success"):
-                        logger.debug(
-                            f"Переименовали {key_id}: {old_comment} -> {new_key_name}"
-                        )
-                        return True
-                    else:
-                        logger.warning(f"Ошибка rename_key: {resp.get('msg')}")
-                        return False
-        return False
+        # Копия, чтобы не менять клиента в общем снимке
+        client = dict(entry.client)
+        old_comment = client.get("comment", "")
+        client["comment"] = new_key_name
+        update_payload = {
+            "id": entry.inbound_id,
+            "settings": json.dumps({"clients": [client]}),
+        }
+        resp = await self._request_json(
+            f"/panel/inbound/updateClient/{key_id}", data=update_payload
+        )
+        self._invalidate_snapshot()
+        if not resp:
+            logger.warning("Нет ответа updateClient (rename_key).")
+            return False
+        if resp.get("success"):
+            logger.debug(f"Переименовали {key_id}: {old_comment} -> {new_key_name}")
+            return True
+        else:
+            logger.warning(f"Ошибка rename_key: {resp.get('msg')}")
+            return False
 
     @create_server_session_by_id
     async def delete_key(self, key_id: str, server_id: int | None = None) -> bool:
         """
         Удаляет клиентский ключ по указанному ID на сервере,
         находя реальный inbound, где лежит ключ.
+        :return: True, если ключ удалён или его уже нет на сервере;
+            False, если сервер недоступен или отказал в удалении.
         """
-        if not self._ensure_session_ok():
+        if not await self._ensure_session_ok():
             return False
 
-        resource = self._request_json("/panel/inbound/list/", data=self.data)
-        if not resource or not resource.get("success"):
-            logger.warning("Не получили inbound list при delete_key.")
+        # Свежий снимок отличает отсутствующий ключ от недоступной панели
+        snapshot = await self._get_snapshot(refresh=True)
+        if snapshot is None:
             return False
-
-        inbound_list = resource.get("obj", [])
-        if not inbound_list:
+        entry = snapshot.clients_by_id.get(key_id)
+        if entry is None:
+            logger.info(f"Ключ {key_id} уже отсутствует на сервере.")
+            return True
+
+        url = f"/panel/inbound/{entry.inbound_id}/delClient/{key_id}"
+        del_resp = await self._request_json(url, data=self.data)
+        self._invalidate_snapshot()
+        if not del_resp:
+            logger.warning("Нет ответа при удалении ключа.")
+            return False
+        if del_resp.get("success"):
+            logger.debug(f"Удалили ключ {key_id}.")
+            return True
+        else:
+            msg = del_resp.get("msg", "Неизвестная ошибка delClient")
+            logger.warning(f"Ошибка при удалении ключа {key_id}: {msg}")
             return False
 
-        for inbound in inbound_list:
-            inbound_id = inbound.get("id")
-            settings_str = inbound.get("settings", "{}")
-            try:
-                inbound_settings = json.loads(settings_str)
-            except json.JSONDecodeError:
-                continue
-
-            for client in inbound_settings.get("clients", []):
-                if client.get("id") == key_id:
-                    # Удаляем
-                    url = f"/panel/inbound/{inbound_id}/delClient/{key_id}"
-                    del_resp = self._request_json(url, data=self.data)
-                    if not del_resp:
-                        logger.warning("Нет ответа при удалении ключа.")
-                        return False
-                    if del_resp.get("success"):
-                        logger.debug(f"Удалили ключ {key_id}.")
-                        return True
-                    else:
-                        msg = del_resp.get("msg", "Неизвестная ошибка delClient")
-                        logger.warning(f"Ошибка при удалении ключа {key_id}: {msg}")
-                        return False
-        return False
-
+    @coalesce_requests("get_key_info")
     @create_server_session_by_id
     async def get_key_info(self, key_id: str, server_id: int = None) -> VlessKey | None:
         """
         Получает информацию о VPN-ключе VLESS с удаленного сервера.
+        Данные берутся из снимка inbound'ов, поэтому расход трафика может отставать
+        не более чем на INBOUND_SNAPSHOT_TTL секунд.
 
         :param key_id: Уникальный идентификатор ключа.
         :param server_id: Идентификатор сервера (опционально).
         :return: Объект `VlessKey`, содержащий информацию о ключе, либо None, если ключ не найден.
         """
 
-        if not self._ensure_session_ok():
-            return None
-
-        resource = self._request_json("/panel/inbound/list/", data=self.data)
-        if not resource or not resource.get("success"):
-            logger.warning("Не удалось получить inbound list при get_key_info.")
+        if not await self._ensure_session_ok():
             return None
 
-        inbound_list = resource.get("obj", [])
-        if not inbound_list:
-            logger.warning("Список inbound пуст, ключ не найден (get_key_info).")
+        entry = await self._find_client(key_id)
+        if entry is None:
+            logger.warning(f"Ключ {key_id} не найден в inbound'ах.")
             return None
 
-        used_bytes = 0
-        for inbound in inbound_list:
-            for stat in inbound.get("clientStats", []):
-                if stat.get("email") == key_id:
-                    used_bytes = stat.get("up", 0) + stat.get("down", 0)
-                    break
+        name = entry.client.get("comment", "")
+        return VlessKey(
+            key_id=key_id,
+            name=name,
+            email=entry.client.get("email", ""),
+            access_url=await self._get_link(key_id, name),
+            used_bytes=entry.used_bytes,
+            data_limit=entry.client.get("totalGB") or 0,
+        )
 
-        # clients
-        for inbound in inbound_list:
-            settings_str = inbound.get("settings", "{}")
-            try:
-                inbound_settings = json.loads(settings_str)
-            except json.JSONDecodeError as ex:
-                logger.error(f"JSONDecodeError inbound.settings: {ex}")
-                continue
-
-            for client in inbound_settings.get("clients", []):
-                if client.get("id") == key_id:
-                    name = client.get("comment", "")
-                    email = client.get("email", "")
-                    access_url = self._get_link(key_id, name)
-                    data_limit = client.get("totalGB") or 0
-                    return VlessKey(
-                        key_id=key_id,
-                        name=name,
-                        email=email,
-                        access_url=access_url,
-                        used_bytes=used_bytes,
-                        data_limit=data_limit,
-                    )
-        logger.warning(f"Ключ {key_id} не найден в inbound'ах.")
-        return None
+    async def _update_client_limit(
+        self, entry: ClientEntry, new_limit_bytes: int, key_name: str = None
+    ) -> bool:
+        """
+        Отправляет updateClient с новым totalGB (и при желании comment) для клиента.
+        """
+        key_id = entry.key_id
+        # Копия, чтобы не менять клиента в общем снимке
+        client = dict(entry.client)
+        old_comment = client.get("comment", "")
+        client["totalGB"] = new_limit_bytes
+        if key_name:
+            client["comment"] = key_name
+
+        update_payload = {
+            "id": entry.inbound_id,
+            "settings": json.dumps({"clients": [client]}),
+        }
+        resp = await self._request_json(
+            f"/panel/inbound/updateClient/{key_id}", data=update_payload
+        )
+        self._invalidate_snapshot()
+        if not resp:
+            logger.warning("Нет ответа updateClient (update_data_limit).")
+            return False
+        if resp.get("success"):
+            logger.debug(
+                f"Обновили лимит ключа {key_id}: old='{old_comment}',"
+                f" new='{client.get('comment')}', limit={new_limit_bytes}"
+            )
+            return True
+        msg = resp.get("msg", "Неизвестная ошибка update_data_limit")
+        logger.warning(f"Ошибка update_data_limit {key_id}: {msg}")
+        return False
 
     @create_server_session_by_id
     async def update_data_limit(
@@ -672,55 +923,99 @@ class VlessProcessor(BaseProcessor):
         """
         Меняет totalGB (и при желании comment) у клиента, где client.id == key_id.
         """
-        if not self._ensure_session_ok():
+        if not await self._ensure_session_ok():
             return False
 
-        resource = self._request_json("/panel/inbound/list/", data=self.data)
-        if not resource or not resource.get("success"):
-            logger.warning("Не получили inbound list при update_data_limit.")
+        entry = await self._find_client(key_id)
+        if entry is None:
+            logger.warning(f"Ключ {key_id} не найден при update_data_limit.")
             return False
+        return await self._update_client_limit(entry, new_limit_bytes, key_name)
 
-        inbound_list = resource.get("obj", [])
-        if not inbound_list:
-            logger.warning("Пуст inbound_list при update_data_limit.")
-            return False
+    @create_server_session_by_id
+    async def get_keys(self, server_id: int = None) -> list[VlessKey]:
+        """
+        Получает все ключи сервера с расходом трафика одним запросом inbound/list.
+        Снимок всегда запрашивается заново. Ссылка для подключения не формируется (access_url=None).
 
-        for inbound in inbound_list:
-            inbound_id = inbound.get("id")
-            settings_str = inbound.get("settings", "{}")
-            try:
-                inbound_settings = json.loads(settings_str)
-            except json.JSONDecodeError:
-                continue
-
-            for client in inbound_settings.get("clients", []):
-                if client.get("id") == key_id:
-                    old_comment = client.get("comment", "")
-                    client["totalGB"] = new_limit_bytes
-                    if key_name:
-                        client["comment"] = key_name
-
-                    update_payload = {
-                        "id": inbound_id,
-                        "settings": json.dumps({"clients": [client]}),
-                    }
-                    resp = self._request_json(
-                        f"/panel/inbound/updateClient/{key_id}", data=update_payload
-                    )
-                    if not resp:
-                        logger.warning("Нет ответа updateClient (update_data_limit).")
-                        return False
-                    if resp.get("success"):
-                        logger.debug(
-                            f"Обновили лимит ключа {key_id}: old='{old_comment}',"
-                            f" new='{client.get('comment')}', limit={new_limit_bytes}"
-                        )
-                        return True
-                    else:
-                        msg = resp.get("msg", "Неизвестная ошибка update_data_limit")
-                        logger.warning(f"Ошибка update_data_limit {key_id}: {msg}")
-                        return False
-        return False
+        :param server_id: Идентификатор сервера.
+        :return: Список VlessKey.
+        """
+        if not await self._ensure_session_ok():
+            raise RuntimeError(f"Сессия с сервером {server_id} недоступна")
+
+        snapshot = await self._get_snapshot(refresh=True)
+        if snapshot is None:
+            raise RuntimeError(f"Не удалось получить inbound list сервера {server_id}")
+
+        return [
+            VlessKey(
+                key_id=entry.key_id,
+                name=entry.client.get("comment", ""),
+                email=entry.client.get("email", ""),
+                access_url=None,
+                used_bytes=entry.used_bytes,
+                data_limit=entry.client.get("totalGB") or 0,
+            )
+            for entry in snapshot.clients_by_id.values()
+        ]
+
+    @create_server_session_by_id
+    async def get_transfer_total(self, server_id: int = None) -> int:
+        """
+        Получает суммарный трафик (up + down из clientStats) всех клиентов сервера.
+        Счётчики 3x-ui обнуляются при сбросе трафика, поэтому значение может уменьшаться.
+
+        :param server_id: Идентификатор сервера.
+        :return: Трафик в байтах.
+        """
+        if not await self._ensure_session_ok():
+            raise RuntimeError(f"Сессия с сервером {server_id} недоступна")
+
+        snapshot = await self._get_snapshot(refresh=True)
+        if snapshot is None:
+            raise RuntimeError(f"Не удалось получить inbound list сервера {server_id}")
+        return sum(entry.used_bytes for entry in snapshot.clients_by_id.values())
+
+    @create_server_session_by_id
+    async def update_data_limits(
+        self, limits: dict[str, int], server_id: int = None, concurrency: int = 10
+    ) -> dict[str, bool]:
+        """
+        Устанавливает лимиты сразу для нескольких ключей одного сервера
+        по одному снимку inbound'ов.
+        Запросы updateClient выполняются параллельно, не более `concurrency` одновременно.
+
+        :param limits: Словарь {key_id: лимит в байтах}
+        :param server_id: Идентификатор сервера.
+        :param concurrency: Максимальное число одновременных запросов.
+        :return: Словарь {key_id: True, если лимит обновлён}
+        """
+        results = {key_id: False for key_id in limits}
+        if not await self._ensure_session_ok():
+            return results
+
+        snapshot = await self._get_snapshot()
+        if snapshot is None:
+            logger.warning(f"Не получили inbound list сервера {server_id} при update_data_limits.")
+            return results
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def update(entry: ClientEntry) -> None:
+            async with semaphore:
+                results[entry.key_id] = await self._update_client_limit(
+                    entry, limits[entry.key_id]
+                )
+
+        await asyncio.gather(
+            *(
+                update(snapshot.clients_by_id[key_id])
+                for key_id in limits
+                if key_id in snapshot.clients_by_id
+            )
+        )
+        return results
 
     async def setup_server(self, server):
         """
@@ -730,60 +1025,50 @@ class VlessProcessor(BaseProcessor):
 
         :return: `True` в случае успешной установки, иначе `False`.
 
-        Алгоритм работы:
-        1. Подключается к серверу через SSH.
-        2. Останавливает и удаляет старый Docker.
-        3. Очищает систему от остаточных файлов Docker.
-        4. Устанавливает свежую версию Docker и Docker Compose.
-        5. Загружает и выполняет скрипт установки `setup.sh`.
-        6. Передает в `setup.sh` необходимые данные для автоматической настройки.
-        7. Логирует все этапы выполнения, включая возможные ошибки.
-        """
-
-        # Команды для остановки Docker-сервисов
-        stop_docker_cmds = [
-            "sudo systemctl stop docker",
-            "sudo systemctl stop docker.socket",
-            "sudo systemctl stop containerd",
-            "sudo systemctl stop containerd.socket",
-            "sudo killall -9 dockerd containerd",
-            "sudo apt remove --purge -y docker docker.io containerd runc",
-            "sudo umount /var/run/docker/netns/default || true",
-            "sudo rm -rf /var/lib/docker /etc/docker /var/run/docker*",
-        ]
-
-        # Команды для удаления старого Docker (включая удаление файла репозитория)
-        remove_docker_cmds = [
-            "sudo apt update",
-            "sudo apt install -y ca-certificates curl gnupg lsb-release",
-            "sudo install -m 0755 -d /etc/apt/keyrings",
-            "curl -fsSL https://download.docker.com/linux/ubuntu/gpg | sudo tee /etc/apt/keyrings/docker.asc > /dev/null",
-            "sudo chmod a+r /etc/apt/keyrings/docker.asc",
-            # Удаляем старый файл репозитория (если существует)
-            "sudo rm -f /etc/apt/sources.list.d/docker.list",
-            "apt remove --purge -y docker docker-engine docker.io containerd runc",
-            "rm -rf /var/lib/docker /etc/docker /var/run/docker*",
-        ]
+        Установка выполняется через SshPipeline этапами:
+        1. Остановка и удаление старого Docker параллельно с загрузкой docker-compose и `setup.sh`.
+        2. Установка Docker (один `apt-get update` на всю установку).
+        3. Запуск `setup.sh` с ответами для автоматической настройки.
+        Выполненные шаги при повторной попытке пропускаются. Вместо фиксированной паузы
+        после установки опрашивается панель 3X-UI, пока она не начнёт отвечать.
+        """
 
-        # Команды для установки Docker и Docker Compose
-        install_docker_cmds = [
-            "sudo apt update",
-            "apt install -y apt-transport-https ca-certificates curl software-properties-common",
-            # Добавляем ключ и репозиторий Docker для Ubuntu 22.04 (jammy)
-            "curl -fsSL https://download.docker.com/linux/ubuntu/gpg | sudo tee /etc/apt/keyrings/docker.asc > /dev/null",
-            "sudo chmod a+r /etc/apt/keyrings/docker.asc",
-            # Удаляем старый репозиторий, если он есть, и создаём новый
-            "sudo rm -f /etc/apt/sources.list.d/docker.list",
-            "echo 'deb [arch=amd64 signed-by=/etc/apt/keyrings/docker.asc] https://download.docker.com/linux/ubuntu jammy stable' | sudo tee /etc/apt/sources.list.d/docker.list > /dev/null",
-            "sudo apt update",
-            "apt install -y docker-ce docker-ce-cli containerd.io",
-            'curl -L "https://github.com/docker/compose/releases/latest/download/docker-compose-$(uname -s)-$(uname -m)" -o /usr/local/bin/docker-compose',
-            "sudo chmod +x /usr/local/bin/docker-compose",
-        ]
+        # Остановка и удаление старого Docker (ошибки не прерывают установку)
+        cleanup_docker = "\n".join(
+            [
+                "systemctl stop docker docker.socket containerd containerd.socket",
+                "killall -9 dockerd containerd",
+                "DEBIAN_FRONTEND=noninteractive apt-get remove --purge -y -q "
+                "docker docker-engine docker.io containerd runc",
+                "umount /var/run/docker/netns/default",
+                "rm -rf /var/lib/docker /etc/docker /var/run/docker* /etc/apt/sources.list.d/docker.list",
+            ]
+        )
+        # Установка Docker из репозитория Docker для Ubuntu 22.04 (jammy)
+        install_docker = "\n".join(
+            [
+                "export DEBIAN_FRONTEND=noninteractive",
+                "install -m 0755 -d /etc/apt/keyrings",
+                "curl -fsSL https://download.docker.com/linux/ubuntu/gpg -o /etc/apt/keyrings/docker.asc",
+                "chmod a+r /etc/apt/keyrings/docker.asc",
+                "echo 'deb [arch=amd64 signed-by=/etc/apt/keyrings/docker.asc] https://download.docker.com/linux/ubuntu jammy stable' "
+                "> /etc/apt/sources.list.d/docker.list",
+                "apt-get update -q",
+                "apt-get install -y -q ca-certificates curl gnupg lsb-release apt-transport-https "
+                "software-properties-common docker-ce docker-ce-cli containerd.io",
+            ]
+        )
+        fetch_docker_compose = (
+            'curl -fsSL "https://github.com/docker/compose/releases/latest/download/docker-compose-$(uname -s)-$(uname -m)" '
+            "-o /usr/local/bin/docker-compose\n"
+            "chmod +x /usr/local/bin/docker-compose"
+        )
+        fetch_setup_script = (
+            "curl -sSL https://raw.githubusercontent.com/torikki-tou/team418/main/setup.sh -o setup.sh\n"
+            "chmod +x setup.sh"
+        )
         vless_email = os.getenv("VLESS_EMAIL")
         vless_bot_token = os.getenv("VLESS_BOT_TOKEN")
-        # Команда для скачивания setup.sh
-        setup_script = "curl -sSL https://raw.githubusercontent.com/torikki-tou/team418/main/setup.sh -o setup.sh && chmod +x setup.sh"
         # Данные для автоматического ввода в setup.sh (каждая строка — ответ на соответствующий вопрос)
         setup_answers = (
             "\n".join(
@@ -800,92 +1085,38 @@ class VlessProcessor(BaseProcessor):
             )
             + "\n"
         )
-        max_attempts = 5
-        for attempt in range(max_attempts):
-            try:
-                async with asyncssh.connect(
-                    host=server.ip,
-                    username="root",
-                    password=server.password,
-                    known_hosts=None,
-                ) as conn:
-                    logger.info(f"Попытка {attempt + 1}/{max_attempts}...")
-                    logger.info(f"🔗 Подключение к серверу {server.ip} установлено!")
-
-                    # Остановка и удаление старого Docker
-                    logger.info("🛑 Останавливаем старый Docker...")
-                    for cmd in stop_docker_cmds:
-                        logger.info(f"➡ Выполняем: {cmd}")
-                        result = await conn.run(cmd, check=False)
-                        if result.exit_status != 0:
-                            logger.warning(
-                                f"⚠ Ошибка при выполнении {cmd}: {result.stderr.strip()}"
-                            )
-
-                    logger.info("🗑️ Удаляем старый Docker (очистка)...")
-                    for cmd in remove_docker_cmds:
-                        logger.info(f"➡ Выполняем: {cmd}")
-                        result = await conn.run(cmd, check=False)
-                        if result.exit_status != 0:
-                            logger.warning(
-                                f"⚠ Ошибка при выполнении {cmd}: {result.stderr.strip()}"
-                            )
-                        else:
-                            logger.info(result.stdout)
-
-                    # Установка нового Docker
-                    logger.info("⬇ Устанавливаем Docker и Docker Compose...")
-                    for cmd in install_docker_cmds:
-                        logger.info(f"➡ Выполняем: {cmd}")
-                        result = await conn.run(cmd, check=False)
-                        if result.exit_status != 0:
-                            raise Exception(
-                                f"Ошибка при установке Docker: {cmd}\n{result.stderr.strip()}"
-                            )
-                        logger.info(result.stdout)
-
-                    # Скачивание setup.sh
-                    logger.info("📥 Загружаем setup.sh...")
-                    result = await conn.run(setup_script)
-                    if result.exit_status != 0:
-                        raise Exception(
-                            f"Ошибка при загрузке setup.sh: {result.stderr.strip()}"
-                        )
-                    logger.info(result.stdout)
-
-                    # Запуск setup.sh с автоматическим вводом ответов
-                    logger.info(
-                        "⚙️ Запускаем setup.sh с автоматическим вводом данных..."
-                    )
-                    result = await conn.run('bash -c "./setup.sh"', input=setup_answers)
-                    if result.exit_status != 0:
-                        raise Exception(
-                            f"Ошибка при установке 3X-UI: {result.stderr.strip()}"
-                        )
-                    logger.info(result.stdout)
-                    await send_new_server_report(
-                        server_id=server.id,
-                        ip=server.ip,
-                        protocol="vless",
-                        management_panel_url=f"https://{server.ip}:2053",
-                    )
-                    logger.info(
-                        f"🎉 3X-UI успешно установлена! Теперь панель доступна на {server.ip}:2053"
-                    )
-                    await asyncio.sleep(30)
-                    return True
 
-            except Exception as e:
-                if attempt != 0:
-                    await send_error_report(e)
-                logger.info(
-                    f"❌ Ошибка при установке 3X-UI: {e}, попытка {attempt + 1}/{max_attempts}"
-                )
-                if attempt < max_attempts - 1:
-                    logger.info("Повторная попытка через 10 секунд...")
-                    await asyncio.sleep(10)
+        outputs = await SshPipeline(
+            server,
+            [
+                [
+                    ProvisionStep("cleanup_docker", cleanup_docker, strict=False),
+                    ProvisionStep("fetch_docker_compose", fetch_docker_compose),
+                    ProvisionStep("fetch_setup_script", fetch_setup_script),
+                ],
+                [ProvisionStep("install_docker", install_docker)],
+                [ProvisionStep("run_setup", "./setup.sh", input=setup_answers)],
+            ],
+        ).run()
+        if outputs is None:
+            return False
 
-        return False
+        if not await wait_until_ready(
+            lambda: self.get_server_info(server),
+            SERVICE_READY_TIMEOUT,
+            description=f"Панель 3X-UI сервера {server.id}",
+        ):
+            return False
+        await send_new_server_report(
+            server_id=server.id,
+            ip=server.ip,
+            protocol="vless",
+            management_panel_url=f"https://{server.ip}:2053",
+        )
+        logger.info(
+            f"🎉 3X-UI успешно установлена! Теперь панель доступна на {server.ip}:2053"
+        )
+        return True
 
     async def get_server_info(self, server) -> dict:
         """
@@ -903,17 +1134,14 @@ class VlessProcessor(BaseProcessor):
         }
         """
         # Инициализация соединения с сервером панели
-        self.ip = server.ip
-        self.port_panel = 2053
-        self.host = f"https://{self.ip}:{self.port_panel}"
-        self.data = {"username": "lisa_admin", "password": server.password}
-        self.ses = requests.Session()
-        self.ses.verify = False
-
-        if not self._connect():
-            raise Exception("Не удалось подключиться к панели сервера")
+        token = _current_panel.set(await self._get_panel(server))
+        try:
+            if not await self._ensure_session_ok():
+                raise Exception("Не удалось подключиться к панели сервера")
 
-        resp = self._request_json("/server/info", data=self.data)
+            resp = await self._request_json("/server/info", data=self.data)
+        finally:
+            _current_panel.reset(token)
         if not resp:
             raise Exception("Сервер не вернул JSON при get_server_info")
         if resp.get("success"):
@@ -921,6 +1149,12 @@ class VlessProcessor(BaseProcessor):
         else:
             raise Exception(resp.get("msg", "Ошибка получения информации о сервере"))
 
+    async def close(self):
+        """
+        Закрывает сессии всех серверов (вызывается при остановке бота).
+        """
+        await self.sessions.close()
+
     @create_server_session_by_id
     async def extend_data_limit_plus_200gb(self, key_id: str, server_id=None) -> bool:
         """
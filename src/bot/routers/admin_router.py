@@ -245,7 +245,7 @@ async def make_key_for_admin(callback: CallbackQuery, state: FSMContext):
             reply_markup=get_back_admin_panel_keyboard(),
         )
 
-        db_processor.update_database_with_key(
+        await db_processor.update_database_with_key(
             callback.from_user.id, key, chosen_period, server_id, protocol_type
         )
 
@@ -54,7 +54,7 @@ async def choosing_key_handler(callback: CallbackQuery, state: FSMContext):
         return
 
     # Получаем информацию о ключе из базы данных
-    key = db_processor.get_key_by_id(selected_key_id)
+    key = await db_processor.get_key_by_id(selected_key_id)
     keyboard = await get_key_action_keyboard(key.key_id)
     await callback.message.edit_text(
         f"Выберите действие для ключа: «{key.name}»",
@@ -73,7 +73,7 @@ async def show_traffic_handler(callback: CallbackQuery, state: FSMContext):
     key_info = data.get("key_info")
     key = data.get("key")
     if key_info is None:
-        key = db_processor.get_key_by_id(data.get("selected_key_id"))
+        key = await db_processor.get_key_by_id(data.get("selected_key_id"))
         processor = await get_processor(key.protocol_type)
         key_info = await processor.get_key_info(key.key_id, server_id=key.server_id)
         logger.info(f"Key info: {key_info}")
@@ -107,7 +107,7 @@ async def show_traffic_handler(callback: CallbackQuery, state: FSMContext):
 )
 async def show_expiration_date_handler(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
-    key = db_processor.get_key_by_id(data["selected_key_id"])
+    key = await db_processor.get_key_by_id(data["selected_key_id"])
 
     expiration_date = key.expiration_date.replace(
         hour=0, minute=0, second=0, microsecond=0
@@ -179,8 +179,8 @@ async def confirm_rename_handler(callback: CallbackQuery, state: FSMContext):
     new_name = data["new_name"]
 
     # Получаем информацию о ключе из базы данных
-    db_processor.rename_key(key_id, new_name)
-    key = db_processor.get_key_by_id(key_id)
+    await db_processor.rename_key(key_id, new_name)
+    key = await db_processor.get_key_by_id(key_id)
 
     await state.update_data(key_name=key.name)
 
@@ -220,7 +220,7 @@ async def show_key_url_handler(callback: CallbackQuery, state: FSMContext):
     key_info = data.get("key_info")
     key_name = data.get("key_name")
     if key_info is None:
-        key = db_processor.get_key_by_id(data.get("selected_key_id"))
+        key = await db_processor.get_key_by_id(data.get("selected_key_id"))
         key_name = key.name
         processor = await get_processor(key.protocol_type)
         key_info = await processor.get_key_info(key.key_id, server_id=key.server_id)
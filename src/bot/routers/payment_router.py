@@ -17,6 +17,7 @@ from aiogram.types import (
 from initialization.outline_processor_init import async_outline_processor
 from initialization.vless_processor_init import vless_processor
 from initialization.db_processor_init import db_processor
+from initialization.key_pool_init import key_pool
 from bot.fsm.states import GetKey, SubscriptionExtension
 from initialization.bot_init import bot
 from bot.keyboards.keyboards import (
@@ -85,9 +86,9 @@ async def handle_period_selection(callback: CallbackQuery, state: FSMContext):
             | SubscriptionExtension.choose_extension_period
         ):
             selected_key_id = data.get("selected_key_id")
-            vpn_type = db_processor.get_vpn_type_by_key_id(selected_key_id)
+            vpn_type = await db_processor.get_vpn_type_by_key_id(selected_key_id)
             await state.update_data(vpn_type=vpn_type)
-            key = db_processor.get_key_by_id(selected_key_id)
+            key = await db_processor.get_key_by_id(selected_key_id)
             await state.update_data(key_name=key.name)
             title = "Продление ключа"
             description = f"Продление ключа «{key.name}» от VPN {vpn_type} на {selected_period} {moths}"
@@ -140,14 +141,13 @@ async def successful_payment(message: Message, state: FSMContext):
         data = await state.get_data()
         period = data.get("selected_period")
         LogSender.log_payment_details(message)
-        # Создание нового ключа VPN
+        # Выдача ключа VPN из пула (или создание нового, если пул пуст)
         match data.get("vpn_type").lower():
             case "outline":
                 protocol_type = "Outline"
-                key, server_id = await async_outline_processor.create_vpn_key(user_id=message.from_user.id)
             case "vless":
                 protocol_type = "VLESS"
-                key, server_id = await vless_processor.create_vpn_key(user_id=message.from_user.id)
+        key, server_id = await key_pool.get_key(protocol_type, user_id=message.from_user.id)
 
         logger.info(f"Key created: {key} for user {message.from_user.id}")
 
@@ -161,7 +161,7 @@ async def successful_payment(message: Message, state: FSMContext):
         )
 
         # Обновление базы данных
-        db_processor.update_database_with_key(
+        await db_processor.update_database_with_key(
             message.from_user.id, key, period, server_id, protocol_type
         )
 
@@ -199,9 +199,9 @@ async def successful_extension_payment(message: Message, state: FSMContext):
         add_period = 30 * add_period
 
         new_message = await message.answer(text="Оплата прошла успешно")
-        expiration_date = extend_key_in_db(key_id=key_id, add_period=add_period)
+        expiration_date = await extend_key_in_db(key_id=key_id, add_period=add_period)
 
-        key_obj = db_processor.get_key_by_id(key_id)
+        key_obj = await db_processor.get_key_by_id(key_id)
         protocol = key_obj.protocol_type.lower()
         server_id = key_obj.server_id
         if protocol == "outline":
@@ -9,9 +9,8 @@ from aiogram import F, Router
 
 from database.models import VpnKey
 from database.models import User
-from initialization.outline_processor_init import async_outline_processor
-from initialization.vless_processor_init import vless_processor
 from initialization.db_processor_init import db_processor
+from initialization.key_pool_init import key_pool
 from bot.utils.send_message import send_key_to_user
 from bot.fsm.states import GetKey, ManageKeys
 from bot.keyboards.keyboards import (
@@ -47,7 +46,7 @@ async def handle_trial_key_choice(callback: CallbackQuery, state: FSMContext):
     Если использовал возвращаем сообщение, что пробный период уже заюзан
     И делаем 2 кнопки - назад и купить ключ"""
     current_state = await state.get_state()
-    usage_trial_period = db_processor.check_trial_period_usage(callback.from_user.id)
+    usage_trial_period = await db_processor.check_trial_period_usage(callback.from_user.id)
     if usage_trial_period:
         await callback.message.edit_text(
             "Вы уже использовали пробный период. "
@@ -65,14 +64,11 @@ async def handle_trial_key_choice(callback: CallbackQuery, state: FSMContext):
             case ManageKeys.no_active_keys:
                 protocol_type = callback.data.split("_")[1]
 
-        match protocol_type.lower():
-            case "outline":
-                processor = async_outline_processor
-            case "vless":
-                processor = vless_processor
-        key, server_id = await processor.create_vpn_key(data_limit=10 * 1024**3, user_id=callback.from_user.id)
+        key, server_id = await key_pool.get_key(
+            protocol_type, user_id=callback.from_user.id, data_limit=10 * 1024**3
+        )
         user_id = callback.from_user.id
-        db_processor.update_database_with_key(
+        await db_processor.update_database_with_key(
             user_id, key, 2, server_id, protocol_type, True
         )
 
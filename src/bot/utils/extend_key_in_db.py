@@ -11,7 +11,11 @@ logger = logging.getLogger(__name__)
 
 # add_period: в днях
 # возвращает новую дату конца активации ключа
-def extend_key_in_db(key_id: str, add_period: int):
+async def extend_key_in_db(key_id: str, add_period: int):
+    return await db_processor.run_sync(_extend_key_in_db, key_id, add_period)
+
+
+def _extend_key_in_db(key_id: str, add_period: int):
     session = db_processor.get_session()
     try:
         # Находим ключ по его ID
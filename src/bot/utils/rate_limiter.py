@@ -0,0 +1,39 @@
+import asyncio
+
+
+class RateLimiter:
+    """
+    Ограничивает частоту операций: не более `rate` вызовов acquire() в секунду.
+    Вызовы равномерно распределяются во времени, ожидающие обслуживаются по очереди.
+    """
+
+    def __init__(self, rate: float):
+        if rate <= 0:
+            raise ValueError("rate должен быть больше нуля")
+        self._interval = 1 / rate
+        self._next_time = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            if self._next_time > now:
+                await asyncio.sleep(self._next_time - now)
+                now = self._next_time
+            self._next_time = now + self._interval
+
+    def pause(self, seconds: float) -> None:
+        """
+        Откладывает следующие вызовы на `seconds` секунд
+        (например, после ответа Telegram "Too Many Requests").
+        """
+        loop = asyncio.get_running_loop()
+        self._next_time = max(self._next_time, loop.time() + seconds)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
@@ -1,10 +1,14 @@
+import asyncio
 import logging
+import os
 
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message
 from outline_vpn.outline_vpn import OutlineKey
 
 from bot.lexicon.lexicon import Notification
+from bot.utils.rate_limiter import RateLimiter
 from bot.utils.string_makers import get_your_key_string
 from initialization.bot_init import bot
 from bot.keyboards.keyboards import (
@@ -16,6 +20,11 @@ from bot.keyboards.keyboards import (
 
 logger = logging.getLogger(__name__)
 
+# Telegram допускает около 30 сообщений в секунду при массовой рассылке
+TELEGRAM_MESSAGES_PER_SECOND = float(os.getenv("TELEGRAM_MESSAGES_PER_SECOND", 25))
+# Число одновременно выполняемых запросов к Telegram при рассылке
+TELEGRAM_SEND_CONCURRENCY = 20
+
 
 async def send_key_to_user(
     message: Message,
@@ -57,3 +66,48 @@ async def send_message_subscription_expired(user_tg_id, keys):
         parse_mode="HTML",
         reply_markup=get_key_name_extension_keyboard_with_names(keys),
     )
+
+
+async def send_messages_subscription_expired(
+    keys_by_user: dict[str, dict[str, tuple[str, int]]],
+    rate: float = TELEGRAM_MESSAGES_PER_SECOND,
+) -> int:
+    """
+    Параллельно рассылает уведомления об истекающих ключах, не превышая `rate` сообщений в секунду.
+    При ответе Telegram "Too Many Requests" рассылка приостанавливается на указанное время
+    и сообщение отправляется повторно.
+
+    :param keys_by_user: Словарь {user_telegram_id: {key_id: (name, days_left)}}
+    :param rate: Максимальное число сообщений в секунду
+    :return: Количество успешно отправленных уведомлений
+    """
+    limiter = RateLimiter(rate)
+    items = iter(keys_by_user.items())
+    sent = 0
+
+    async def worker():
+        nonlocal sent
+        for user_tg_id, keys in items:
+            for attempt in range(3):
+                await limiter.acquire()
+                try:
+                    await send_message_subscription_expired(user_tg_id, keys)
+                    sent += 1
+                    break
+                except TelegramRetryAfter as e:
+                    logger.warning(
+                        f"Превышен лимит Telegram, пауза {e.retry_after} с (пользователь {user_tg_id})"
+                    )
+                    limiter.pause(e.retry_after)
+                except TelegramForbiddenError:
+                    logger.info(f"Пользователь {user_tg_id} заблокировал бота")
+                    break
+                except Exception as e:
+                    logger.error(
+                        f"Ошибка отправки уведомления пользователю {user_tg_id}: {e}"
+                    )
+                    break
+
+    workers_count = min(TELEGRAM_SEND_CONCURRENCY, len(keys_by_user))
+    await asyncio.gather(*(worker() for _ in range(workers_count)))
+    return sent
@@ -1,22 +1,42 @@
 from datetime import datetime, timedelta
 import os
+import math
 import logging
 import requests
 import asyncio
+import functools
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from git import Repo
 from typing import Optional
 
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import (
-    func,
-    create_engine,
-)
+from sqlalchemy import Integer, cast, func, select, text, update
 
 from bot.routers.admin_router_sending_message import send_error_report
 from initialization.vdsina_processor_init import vdsina_processor
-from bot.utils.send_message import send_message_subscription_expired
-from database.models import Base, VpnKey, Server, User
+from bot.utils.send_message import send_messages_subscription_expired
+from database.engine import SqliteProfile, create_db_engine
+from database.migrations import run_migrations
+from database.placement import (
+    PlacementStrategy,
+    SERVER_PLAN_ID,
+    get_placement_strategy,
+    get_server_plan,
+    server_bandwidth_rate_expr,
+    server_capacity_expr,
+)
+from database.models import (
+    Base,
+    KeyMigration,
+    PendingKeyLimit,
+    PooledKey,
+    Server,
+    ServerLoadSample,
+    User,
+    VpnKey,
+)
 from dotenv import load_dotenv
 
 logger = logging.getLogger(__name__)
@@ -32,25 +52,96 @@ github_remote_url = (
 )
 git_repo_dir = os.path.abspath("DB_LISA")
 
+# За сколько дней до окончания срока ключа отправляется уведомление
+EXPIRING_KEYS_NOTIFICATION_DAYS = 2
+# Период продления лимита трафика ключа, дней
+DATA_LIMIT_PERIOD_DAYS = 30
+# Размер пачки при фиксации удаления истекших ключей в БД
+EXPIRED_KEYS_BATCH_SIZE = 500
+# Сколько серверов одновременно обрабатываются при удалении истекших ключей
+EXPIRED_KEYS_DELETE_CONCURRENCY = int(os.getenv("EXPIRED_KEYS_DELETE_CONCURRENCY", 10))
+# Сколько серверов одновременно обрабатываются при ежемесячном обновлении лимитов
+DATA_LIMIT_SYNC_CONCURRENCY = int(os.getenv("DATA_LIMIT_SYNC_CONCURRENCY", 10))
+# Сколько запросов на обновление лимитов одновременно отправляется на один сервер
+DATA_LIMIT_UPDATE_CONCURRENCY = int(os.getenv("DATA_LIMIT_UPDATE_CONCURRENCY", 10))
+# Протоколы, для которых поддерживается резерв серверов
+SERVER_PROTOCOL_TYPES = ("outline", "vless")
+# Сколько пустых серверов на протокол держать в резерве минимум и максимум
+# (по умолчанию минимум 0: серверы заранее создаются только по скорости заполнения)
+SERVER_STANDBY_MIN = int(os.getenv("SERVER_STANDBY_MIN", 0))
+SERVER_STANDBY_MAX = int(os.getenv("SERVER_STANDBY_MAX", 3))
+# На сколько часов вперёд по текущей скорости заполнения должен хватать резерв
+SERVER_STANDBY_LEAD_HOURS = float(os.getenv("SERVER_STANDBY_LEAD_HOURS", 2))
+# За какой период оценивается скорость заполнения серверов
+SERVER_FILL_RATE_WINDOW_HOURS = int(os.getenv("SERVER_FILL_RATE_WINDOW_HOURS", 24))
+# Сколько серверов одновременно опрашиваются при замере трафика
+TRAFFIC_SAMPLE_CONCURRENCY = int(os.getenv("TRAFFIC_SAMPLE_CONCURRENCY", 10))
+# Сколько раз покупатель ждёт создания сервера, прежде чем получить отказ
+SERVER_WAIT_ATTEMPTS = 3
+
 
 class DbProcessor:
-    def __init__(self):
-        # Создаем движок для подключения к базе данных
-        base_dir = os.path.dirname(
-            os.path.abspath(__file__)
-        )  # Получаем путь к текущему файлу (db_processor_init.py)
-        db_path = os.path.join(
-            base_dir, "..", "database", "vpn_users.db"
-        )  # Поднимаемся на уровень выше
-        db_uri = "sqlite:////app/database/vpn_users.db"  # Создаем абсолютный путь
-
-        self.engine = create_engine(db_uri, echo=True)
+    def __init__(
+            self,
+            db_uri: str | None = None,
+            profile: SqliteProfile | None = None,
+            placement: PlacementStrategy | None = None,
+    ):
+        # Создаем движок для подключения к базе данных (URI и профиль SQLite берутся из окружения)
+        self.profile = profile or SqliteProfile.from_env()
+        self.engine = create_db_engine(db_uri, self.profile)
         self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
-        self._server_creation_lock = asyncio.Lock()
+        # Стратегия выбора сервера для новых ключей (SERVER_PLACEMENT_STRATEGY)
+        self.placement = placement or get_placement_strategy()
+        # Фоновые задачи создания серверов по протоколам; их завершения ждут покупатели,
+        # которым не хватило мест
+        self._provisioning_tasks: defaultdict[str, set[asyncio.Task]] = defaultdict(set)
+        # Номер последнего сервера, имя которому выдано при создании
+        self._last_server_number = 0
+        # Отдельный поток для синхронных запросов SQLAlchemy, чтобы не блокировать event loop.
+        # По умолчанию один поток: SQLite всё равно допускает только одного писателя.
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.profile.executor_workers, thread_name_prefix="db"
+        )
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    @staticmethod
+    def run_in_db_thread(func):
+        """
+        Декоратор: выполняет синхронный метод в потоке БД и возвращает корутину.
+        Исходная синхронная функция доступна через атрибут `__wrapped__`.
+        """
+
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            return await self.run_sync(func, self, *args, **kwargs)
+
+        return wrapper
+
+    async def run_sync(self, func, *args, **kwargs):
+        """
+        Выполняет синхронную функцию в потоке БД, не блокируя event loop.
+        :param func: Синхронная функция, работающая с сессией
+        :return: Результат выполнения функции
+        """
+        self._loop = asyncio.get_running_loop()
+        return await self._loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs)
+        )
+
+    def _schedule_error_report(self, message: str) -> None:
+        """
+        Отправляет отчёт об ошибке из потока БД через event loop бота.
+        :param message: Текст ошибки
+        """
+        if self._loop is not None and not self._loop.is_closed():
+            asyncio.run_coroutine_threadsafe(send_error_report(message), self._loop)
 
     def init_db(self):
-        """Синхронная инициализация базы данных."""
+        """Синхронная инициализация базы данных и применение миграций схемы."""
         Base.metadata.create_all(self.engine)
+        schema_version = run_migrations(self.engine)
+        logger.info(f"Версия схемы БД: {schema_version}")
 
     def get_session(self):
         """Создает и возвращает новую сессию."""
@@ -73,11 +164,49 @@ class DbProcessor:
         finally:
             session.close()
 
+    @run_in_db_thread
     def get_key_by_id(self, key_id: str) -> VpnKey | None:
         """Возвращает объект ключа (VpnKey) по его ID или None, если ключ не найден."""
         with self.session_scope() as session:
             return session.query(VpnKey).filter_by(key_id=key_id).first()
 
+    @run_in_db_thread
+    def get_migrated_key(self, key_id: str) -> VpnKey | None:
+        """
+        Возвращает ключ, в который был перенесён ключ с ID key_id
+        (с учётом нескольких переносов подряд), или None.
+        """
+        with self.session_scope() as session:
+            visited = set()
+            while key_id not in visited:
+                visited.add(key_id)
+                migration = (
+                    session.query(KeyMigration)
+                    .filter_by(old_key_id=key_id)
+                    .order_by(KeyMigration.id.desc())
+                    .first()
+                )
+                if migration is None:
+                    return None
+                key_id = migration.new_key_id
+                key = session.query(VpnKey).filter_by(key_id=key_id).first()
+                if key is not None:
+                    return key
+            return None
+
+    @run_in_db_thread
+    def set_key_access_url(self, key_id: str, access_url: str) -> None:
+        """
+        Сохраняет ссылку для подключения ключа (для ключей, созданных до появления столбца access_url).
+        :param key_id: ID ключа
+        :param access_url: Ссылка для подключения
+        """
+        with self.session_scope() as session:
+            session.query(VpnKey).filter_by(key_id=key_id).update(
+                {VpnKey.access_url: access_url}, synchronize_session=False
+            )
+
+    @run_in_db_thread
     def get_vpn_type_by_key_id(self, key_id: str) -> str:
         """
         Возвращает тип протокола VPN по ID ключа.
@@ -92,6 +221,7 @@ class DbProcessor:
                 logger.error(f"Ошибка при получении информации о ключе {key_id}")
                 return None
 
+    @run_in_db_thread
     def check_trial_period_usage(self, user_id: int):
         """
         Проверяет, использовал ли пользователь пробный период.
@@ -105,6 +235,7 @@ class DbProcessor:
             else:
                 return False
 
+    @run_in_db_thread
     def update_database_with_key(
             self,
             user_id,
@@ -158,168 +289,460 @@ class DbProcessor:
                 protocol_type=protocol_type,
                 name=key.name,
                 server_id=server_id,
+                access_url=key.access_url,
             )
             session.add(new_key)
         return True
 
+    @run_in_db_thread
+    def get_keys_by_user_id(self, user_id) -> list[VpnKey]:
+        """
+        Возвращает список ключей пользователя.
+        :param user_id:
+        :return: Список ключей (пустой, если пользователь не найден)
+        """
+        with self.session_scope() as session:
+            return (
+                session.query(VpnKey)
+                .filter_by(user_telegram_id=str(user_id))
+                .all()
+            )
+
+    @run_in_db_thread
+    def _get_expiring_keys(
+            self, today: datetime, user_id: int | str | None = None
+    ) -> list[tuple[str, str, str, int]]:
+        """
+        Возвращает ключи, срок действия которых закончится в ближайшие
+        EXPIRING_KEYS_NOTIFICATION_DAYS дней (не считая сегодняшнего).
+        Отбор и подсчёт оставшихся дней выполняются одним SQL-запросом.
+        :param today: Начало текущего дня
+        :param user_id: Telegram ID пользователя (если None — по всем пользователям)
+        :return: Список кортежей (user_telegram_id, key_id, name, days_left)
+        """
+        days_left = cast(
+            func.julianday(func.date(VpnKey.expiration_date))
+            - func.julianday(func.date(today)),
+            Integer,
+        )
+        with self.session_scope() as session:
+            query = session.query(
+                VpnKey.user_telegram_id,
+                VpnKey.key_id,
+                VpnKey.name,
+                days_left.label("days_left"),
+            ).filter(
+                VpnKey.expiration_date >= today + timedelta(days=1),
+                VpnKey.expiration_date
+                < today + timedelta(days=EXPIRING_KEYS_NOTIFICATION_DAYS + 1),
+            )
+            if user_id is not None:
+                query = query.filter(VpnKey.user_telegram_id == str(user_id))
+            return [tuple(row) for row in query.order_by(VpnKey.user_telegram_id)]
+
     async def get_expiring_keys_by_user_id(self, user_id) -> dict[str, tuple[str, int]]:
         """
         Возвращает словарь с истекшими ключами пользователя.
         :param user_id:
-        :return:
+        :return: Словарь {key_id: (name, days_left)}
         """
-        with self.session_scope() as session:
-            user = session.query(User).filter_by(user_telegram_id=str(user_id)).first()
-            keys = await self._check_user_keys(user)
-            return keys
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        rows = await self._get_expiring_keys(today, user_id=user_id)
+        return {key_id: (name, days_left) for _, key_id, name, days_left in rows}
 
     async def check_and_notification_by_expiring_keys(self):
         """
-        Асинхронная проверка базы данных на истекшие ключи.
-        - Если ключ истекает через 3 дня, отправляется уведомление.
-        - Если ключ истекает сегодня, он удаляется из базы данных.
+        Асинхронная проверка базы данных на истекающие ключи.
+        Если ключ истекает в ближайшие 2 дня, пользователю отправляется уведомление.
+        Уведомления рассылаются параллельно с учётом ограничений Telegram.
         :return:
         """
-        with self.session_scope() as session:
-            users = session.query(User).all()
-            # Обрабатываем каждого пользователя
-            for user in users:
-                user_expiring_keys = await self._check_user_keys(user)
-                if user_expiring_keys:
-                    # Отправляем уведомление пользователю об истекающих ключах
-                    await send_message_subscription_expired(
-                        user.user_telegram_id, user_expiring_keys
-                    )
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        rows = await self._get_expiring_keys(today)
 
-    @staticmethod
-    async def _check_user_keys(user):
+        expiring_keys_by_users = defaultdict(dict)
+        for user_telegram_id, key_id, name, days_left in rows:
+            expiring_keys_by_users[user_telegram_id][key_id] = (name, days_left)
+
+        logger.info(
+            f"Уведомления об истекающих ключах: {len(rows)} ключей, "
+            f"{len(expiring_keys_by_users)} пользователей"
+        )
+        sent = await send_messages_subscription_expired(expiring_keys_by_users)
+        logger.info(f"Отправлено уведомлений: {sent}/{len(expiring_keys_by_users)}")
+
+    @run_in_db_thread
+    def _remove_keys(self, key_ids: list[str], server_id: int) -> int:
         """
-        Проверяет ключи пользователя на истечение и выполняет соответствующие действия.
-        :param user: Объект пользователя
-        :return: Словарь с истекающими ключами пользователя для уведомления
+        Удаляет пачку ключей одного сервера из базы данных одной транзакцией
+        и уменьшает счётчик пользователей сервера.
+        :param key_ids: ID ключей
+        :param server_id: ID сервера, на котором находились ключи
+        :return: Количество удалённых ключей
         """
-        expiring_keys = {}
-        now = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        for key in user.keys:
-            time_diff = (
-                    key.expiration_date.replace(hour=0, minute=0, second=0, microsecond=0)
-                    - now
-            )
-            if timedelta(days=0) < time_diff <= timedelta(days=2):
-                # Ключ будет действителен не более 2х дней
-                expiring_keys[key.key_id] = (
-                    key.name,
-                    max(time_diff, timedelta(days=0)).days,
-                )
-        return expiring_keys
+        if not key_ids:
+            return 0
+        with self.session_scope() as session:
+            deleted = (
+                session.query(VpnKey)
+                .filter(VpnKey.key_id.in_(key_ids))
+                .delete(synchronize_session=False)
+            )
+            self._change_server_users(session, server_id, -deleted)
+            return deleted
 
-    @staticmethod
-    async def _delete_expired_key(key, session):
+    async def _delete_expired_keys_on_server(
+            self, server_id: int, keys: list, semaphore: asyncio.Semaphore
+    ) -> int:
         """
-        Удаляет истекший ключ из базы данных.
-        :param key: Ключ для удаления
-        :param session: Сессия базы данных
+        Удаляет истекшие ключи одного сервера: запросы к серверу идут последовательно,
+        удаление из базы данных фиксируется пачками после ответа сервера.
+        :param server_id: ID сервера
+        :param keys: Истекшие ключи сервера
+        :param semaphore: Ограничение числа одновременно обрабатываемых серверов
+        :return: Количество удалённых ключей
         """
         from utils.get_processor import get_processor
 
-        processor = await get_processor(key.protocol_type.lower())
-        await processor.delete_key(key.key_id, server_id=key.server_id)
-        session.delete(key)
-
-        # Обновляем количество пользователей на сервере
-        key.server.cnt_users = max(0, key.server.cnt_users - 1)
+        deleted = 0
+        async with semaphore:
+            for start in range(0, len(keys), EXPIRED_KEYS_BATCH_SIZE):
+                removed_key_ids = []
+                for key in keys[start:start + EXPIRED_KEYS_BATCH_SIZE]:
+                    processor = await get_processor(key.protocol_type.lower())
+                    # Если сервер не удалил ключ, он остаётся в базе и будет удалён при следующем запуске
+                    try:
+                        deleted_on_server = await processor.delete_key(key.key_id, server_id=server_id)
+                    except Exception as e:
+                        logger.error(
+                            f"Ошибка при удалении ключа {key.key_id} с сервера {server_id}: {e}"
+                        )
+                        continue
+                    if not deleted_on_server:
+                        logger.error(f"Сервер {server_id} не удалил ключ {key.key_id}")
+                        continue
+                    removed_key_ids.append(key.key_id)
+                deleted += await self._remove_keys(removed_key_ids, server_id)
+        return deleted
+
+    @run_in_db_thread
+    def _get_expired_keys(self, today: datetime) -> list:
+        """
+        Возвращает ключи, срок действия которых истекает сегодня или уже истёк.
+        Фильтрация выполняется в SQL по индексу expiration_date, читаются только нужные столбцы.
+        :param today: Начало текущего дня
+        :return: Список строк (key_id, server_id, protocol_type)
+        """
+        # Ключ истёк, если дата окончания (без учёта времени) <= сегодня,
+        # то есть expiration_date < начала завтрашнего дня
+        cutoff = today + timedelta(days=1)
+        with self.session_scope() as session:
+            return (
+                session.query(VpnKey.key_id, VpnKey.server_id, VpnKey.protocol_type)
+                .filter(VpnKey.expiration_date < cutoff)
+                .all()
+            )
 
     async def check_and_delete_expired_keys(self):
         """
         Удаляет истекшие ключи из базы данных.
         """
-        with self.session_scope() as session:
-            keys = session.query(VpnKey).all()
-            for key in keys:
-                now = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-                if (
-                        key.expiration_date.replace(
-                            hour=0, minute=0, second=0, microsecond=0
-                        )
-                        <= now
-                ):
-                    await self._delete_expired_key(key, session)
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        keys = await self._get_expired_keys(today)
+        logger.info(f"Найдено истекших ключей: {len(keys)}")
+
+        keys_by_server = defaultdict(list)
+        for key in keys:
+            keys_by_server[key.server_id].append(key)
+
+        semaphore = asyncio.Semaphore(EXPIRED_KEYS_DELETE_CONCURRENCY)
+        results = await asyncio.gather(
+            *(
+                self._delete_expired_keys_on_server(server_id, server_keys, semaphore)
+                for server_id, server_keys in keys_by_server.items()
+            ),
+            return_exceptions=True,
+        )
+        deleted = 0
+        for server_id, result in zip(keys_by_server, results):
+            if isinstance(result, Exception):
+                error_text = f"Ошибка при удалении истекших ключей сервера {server_id}: {result}"
+                logger.error(error_text)
+                await send_error_report(error_text)
+            else:
+                deleted += result
+        logger.info(f"Удалено истекших ключей: {deleted}/{len(keys)}")
 
     async def get_server_with_min_users(self, protocol_type: str, user_id: int | None = None) -> Server | None:
         """
-        Возвращает сервер с минимальным количеством пользователей
-        (для id<=2 лимит 100, для id>2 лимит 200). Если подходящего нет – создаёт новый.
+        Возвращает сервер с местом, выбранный стратегией self.placement
+        (вместимость сервера — Server.max_users), заняв в нём место.
+        Выбор сервера — короткая операция в БД без общей блокировки, поэтому покупки
+        не ждут друг друга. Если мест нет, запускается (или переиспользуется) фоновое создание
+        сервера этого протокола, и покупатель ждёт его завершения. Обычно этого не происходит:
+        резерв пустых серверов поддерживает check_count_keys_on_servers.
         """
-        from utils.get_processor import get_processor
         from initialization.bot_init import bot
-        if self._server_creation_lock.locked():
-            await asyncio.sleep(1)
-            if self._server_creation_lock.locked():
+
+        protocol_type = protocol_type.lower()
+        for attempt in range(SERVER_WAIT_ATTEMPTS):
+            selected_server = await self.reserve_server(protocol_type)
+            if selected_server:
+                return selected_server
+
+            logger.info(f"Сервера с протоколом {protocol_type} и свободным местом не найдено.")
+            if attempt == 0 and user_id:
                 await bot.send_message(
                     user_id,
-                    "Сейчас система обрабатывает запросы и сервер находится под высокой нагрузкой. "
-                    "Пожалуйста, ожидайте! Ключ автоматически добавится в менеджер ключей в течение 7 минут."
+                    (
+                        "Пожалуйста, ожидайте!\n\n"
+                        "В связи с большой загруженностью сервиса в данный момент, "
+                        "добавление нового ключа единоразово может занять до 7 минут. \n\n"
+                        "Ваш ключ автоматически добавится в менеджер ключей."
+                    )
                 )
-        async with self._server_creation_lock:
-            with self.session_scope() as session:
-                count_servers = session.query(Server).count()
-                servers = (
-                    session.query(Server)
-                    .filter(func.lower(Server.protocol_type) == protocol_type.lower())
-                    .order_by(Server.cnt_users.asc())
-                    .with_for_update()  # Блокируем строку для изменения
-                    .all()
+
+            tasks = set(self._provisioning_tasks[protocol_type]) or {
+                self.start_provisioning(protocol_type)
+            }
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            if not pending and all(task.result() is None for task in done):
+                return None
+        return None
+
+    def start_provisioning(self, protocol_type: str) -> asyncio.Task:
+        """
+        Запускает создание сервера в фоне.
+        :param protocol_type: Тип протокола
+        :return: Задача, возвращающая установленный сервер или None
+        """
+        protocol_type = protocol_type.lower()
+        task = asyncio.create_task(self._provision_in_background(protocol_type))
+        tasks = self._provisioning_tasks[protocol_type]
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return task
+
+    async def _provision_in_background(self, protocol_type: str) -> Server | None:
+        try:
+            # Параллельно создаваемые серверы ещё не в БД: номер в имени берётся
+            # с учётом уже выданных, чтобы имена не повторялись
+            count_servers = max(await self.get_servers_count(), self._last_server_number)
+            self._last_server_number = count_servers + 1
+            return await self.provision_server(protocol_type, count_servers)
+        except Exception as e:
+            logger.error(f"Ошибка при создании сервера {protocol_type}: {e}")
+            await send_error_report(f"Ошибка при создании сервера {protocol_type}: {e}")
+            return None
+
+    @staticmethod
+    def _change_server_users(session, server_id: int, delta: int) -> None:
+        """
+        Изменяет cnt_users сервера на delta одним UPDATE на стороне БД
+        (значение не читается в Python, поэтому параллельные изменения не теряются).
+        :param session: Сессия SQLAlchemy
+        :param server_id: ID сервера
+        :param delta: На сколько изменить (отрицательное — освободить места)
+        """
+        if delta:
+            session.execute(
+                update(Server)
+                .where(Server.id == server_id)
+                .values(cnt_users=func.max(Server.cnt_users + delta, 0))
+            )
+
+    @run_in_db_thread
+    def reserve_server(
+            self,
+            protocol_type: str,
+            exclude_server_ids: tuple[int, ...] = (),
+            placement: PlacementStrategy | None = None,
+            filters: tuple = (),
+    ) -> Server | None:
+        """
+        Выбирает сервер согласно стратегии self.placement (по умолчанию наименее загруженный)
+        и занимает в нём место одним условным UPDATE ... WHERE cnt_users < вместимость RETURNING id.
+        Проверка и увеличение счётчика выполняются атомарно в БД, поэтому выбор
+        безопасен при параллельных покупках, в том числе из разных процессов.
+        :param protocol_type: Тип протокола
+        :param exclude_server_ids: Серверы, которые нельзя выбирать
+        :param placement: Стратегия выбора (по умолчанию self.placement)
+        :param filters: Дополнительные условия на сервер-кандидат (SQL-выражения)
+        :return: Сервер или None, если мест нет
+        """
+        placement = placement or self.placement
+        candidate_id = (
+            select(Server.id)
+            .where(
+                Server.protocol_type == protocol_type.lower(),
+                Server.status == "active",
+                Server.cnt_users < server_capacity_expr(),
+                Server.id.not_in(exclude_server_ids),
+                *filters,
+            )
+            .order_by(*placement.order_by())
+            .limit(1)
+            .scalar_subquery()
+        )
+        with self.session_scope() as session:
+            server_id = session.execute(
+                update(Server)
+                .where(Server.id == candidate_id, Server.cnt_users < server_capacity_expr())
+                .values(cnt_users=Server.cnt_users + 1)
+                .returning(Server.id)
+            ).scalar()
+            if server_id is None:
+                return None
+            return session.get(Server, server_id)
+
+    @run_in_db_thread
+    def reserve_server_slots(
+            self, protocol_type: str, count: int
+    ) -> tuple[Server | None, int]:
+        """
+        Занимает до count мест на сервере с протоколом protocol_type, выбранном стратегией self.placement.
+        Используется для заблаговременного создания ключей пачкой на одном сервере.
+        Счётчик меняется условным UPDATE (только если cnt_users не изменился с момента чтения),
+        при конфликте выбор повторяется.
+        :param protocol_type: Тип протокола
+        :param count: Сколько мест требуется
+        :return: Кортеж из сервера (None, если мест нет) и количества занятых мест
+        """
+        capacity = server_capacity_expr()
+        with self.session_scope() as session:
+            while True:
+                candidate = session.execute(
+                    select(Server.id, Server.cnt_users, capacity)
+                    .where(
+                        Server.protocol_type == protocol_type.lower(),
+                        Server.status == "active",
+                        Server.cnt_users < capacity,
+                    )
+                    .order_by(*self.placement.order_by())
+                    .limit(1)
+                ).first()
+                if candidate is None:
+                    return None, 0
+                server_id, cnt_users, max_users = candidate
+                reserved = min(count, max_users - cnt_users)
+                updated = session.execute(
+                    update(Server)
+                    .where(Server.id == server_id, Server.cnt_users == cnt_users)
+                    .values(cnt_users=cnt_users + reserved)
+                    .returning(Server.id)
+                ).scalar()
+                if updated is not None:
+                    return session.get(Server, server_id), reserved
+
+    @run_in_db_thread
+    def release_server_slots(self, server_id: int, count: int) -> None:
+        """
+        Возвращает места, занятые на сервере, но не использованные
+        (например, если часть ключей не удалось создать).
+        :param server_id: ID сервера
+        :param count: Количество освобождаемых мест
+        """
+        if count <= 0:
+            return
+        with self.session_scope() as session:
+            self._change_server_users(session, server_id, -count)
+
+    @run_in_db_thread
+    def add_pooled_keys(self, keys: list, server_id: int, protocol_type: str) -> None:
+        """
+        Сохраняет заранее созданные ключи в пул.
+        :param keys: Список OutlineKey/VlessKey
+        :param server_id: ID сервера, на котором созданы ключи
+        :param protocol_type: Тип протокола
+        """
+        now = datetime.now()
+        with self.session_scope() as session:
+            session.add_all(
+                PooledKey(
+                    key_id=str(key.key_id),
+                    protocol_type=protocol_type.lower(),
+                    server_id=server_id,
+                    name=key.name,
+                    access_url=key.access_url,
+                    data_limit=key.data_limit,
+                    created_at=now,
                 )
+                for key in keys
+            )
 
-                selected_server = None
-                for server in servers:
-                    max_users = 200 if server.id > 2 else 100
-                    if server.cnt_users < max_users:
-                        selected_server = server
-                        break
-                    # Если есть хотя бы один сервер с местом, берем его
-                    # считаем их количество по-разному
-                if not selected_server:
-                    print("Сервера с местом не найдено", user_id)
-                    if user_id:
-                        await bot.send_message(
-                            user_id,
-                            (
-                                "Пожалуйста, ожидайте!\n\n"
-                                "В связи с большой загруженностью сервиса в данный момент, "
-                                "добавление нового ключа единоразово может занять до 7 минут. \n\n"
-                                "Ваш ключ автоматически добавится в менеджер ключей."
+    @run_in_db_thread
+    def claim_pooled_key(
+            self, protocol_type: str, data_limit: int | None = None
+    ) -> PooledKey | None:
+        """
+        Забирает из пула самый старый ключ с протоколом protocol_type.
+        Ключ удаляется из пула условным DELETE, поэтому два параллельных вызова
+        не получат один и тот же ключ. Если требуемый лимит отличается от лимита ключа,
+        в той же транзакции сохраняется запись PendingKeyLimit.
+        :param protocol_type: Тип протокола
+        :param data_limit: Требуемый лимит трафика в байтах
+        :return: PooledKey или None, если пул пуст
+        """
+        with self.session_scope() as session:
+            while True:
+                pooled_key = (
+                    session.query(PooledKey)
+                    .filter_by(protocol_type=protocol_type.lower())
+                    .order_by(PooledKey.created_at.asc())
+                    .first()
+                )
+                if pooled_key is None:
+                    return None
+                deleted = (
+                    session.query(PooledKey)
+                    .filter_by(server_id=pooled_key.server_id, key_id=pooled_key.key_id)
+                    .delete(synchronize_session=False)
+                )
+                if deleted:
+                    session.expunge(pooled_key)
+                    if data_limit is not None and pooled_key.data_limit != data_limit:
+                        session.merge(
+                            PendingKeyLimit(
+                                server_id=pooled_key.server_id,
+                                key_id=pooled_key.key_id,
+                                protocol_type=pooled_key.protocol_type,
+                                data_limit=data_limit,
+                                created_at=datetime.now(),
                             )
                         )
+                    return pooled_key
 
-                    logger.info(f"Сервера с протоколом {protocol_type} не найдено.")
-                    new_server, server_ip, server_password = (
-                        await self.create_new_server(count_servers)
-                    )
+    @run_in_db_thread
+    def get_pending_key_limits(self) -> list[PendingKeyLimit]:
+        """Возвращает лимиты выданных из пула ключей, ещё не применённые на сервере."""
+        with self.session_scope() as session:
+            return session.query(PendingKeyLimit).all()
 
-                    if not new_server:
-                        await send_error_report("Ошибка при создании нового сервера")
-                        logger.error("Ошибка при создании нового сервера")
-                        return None
+    @run_in_db_thread
+    def complete_pending_key_limit(self, server_id: int, key_id: str, data_limit: int) -> None:
+        """
+        Удаляет запись о неприменённом лимите после его применения на сервере.
+        :param server_id: ID сервера
+        :param key_id: ID ключа на сервере
+        :param data_limit: Применённый лимит (запись с другим лимитом не удаляется)
+        """
+        with self.session_scope() as session:
+            session.query(PendingKeyLimit).filter_by(
+                server_id=server_id, key_id=str(key_id), data_limit=data_limit
+            ).delete(synchronize_session=False)
 
-                    new_server_db = self.add_server(
-                        new_server, protocol_type, server_ip, server_password
-                    )
-                    processor = await get_processor(protocol_type.lower())
-                    result = await processor.setup_server(new_server_db)
-                    if not result:
-                        await send_error_report(
-                            "Ошибка при настройке сервера {protocol_type}"
-                        )
-                        logger.error(
-                            f"Ошибка при настройке сервера типа {protocol_type}"
-                        )
-                        return None
-                    selected_server = new_server_db
-                selected_server.cnt_users += 1
-                # self.increment_server_user_count(selected_server.id)
-                # selected_server = self.get_server_by_id(selected_server.id)
-                return selected_server
+    @run_in_db_thread
+    def count_pooled_keys(self, protocol_type: str) -> int:
+        """
+        Возвращает количество ключей в пуле для протокола protocol_type.
+        :param protocol_type: Тип протокола
+        """
+        with self.session_scope() as session:
+            return (
+                session.query(PooledKey)
+                .filter_by(protocol_type=protocol_type.lower())
+                .count()
+            )
 
     @staticmethod
     def get_server_info(server_id):
@@ -346,7 +769,9 @@ class DbProcessor:
         :return: True, если сервер активен, иначе False
         """
         for _ in range(timeout // 5):  # Проверяем каждые 5 секунд
-            server_data = self.get_server_info(server_id)
+            # Запрос к VDSina синхронный, выполняем его в отдельном потоке,
+            # чтобы фоновое создание сервера не блокировало выдачу ключей
+            server_data = await asyncio.to_thread(self.get_server_info, server_id)
             if server_data and server_data.get("status") == "active":
                 return True
             logger.info("Сервер еще не активен, ждем...")
@@ -374,9 +799,6 @@ class DbProcessor:
                     return ip_list[0].get("ip")
         except Exception as e:
             logger.error(f"Ошибка при получении IP сервера {server_id} {e}")
-            asyncio.create_task(
-                send_error_report(f"Ошибка при получении IP сервера {server_id} {e}")
-            )
         return None
 
     @staticmethod
@@ -398,30 +820,8 @@ class DbProcessor:
                     return password
         except Exception as e:
             logger.error(f"Ошибка при получении пароля сервера {server_id} {e}")
-            asyncio.create_task(
-                send_error_report(
-                    f"Ошибка при получении пароля сервера {server_id} {e}"
-                )
-            )
         return None
 
-    async def get_notification(self, user_id: int) -> Server:
-        # Попытка захватить блокировку с таймаутом
-        try:
-            print("bwvhbeirvbi3erwbfybvewrybvyerbuycerb")
-            await asyncio.wait_for(self._server_creation_lock.acquire(), timeout=1.0)
-        except Exception as e:
-            pass
-        finally:
-            print("Люблю даню костина")
-            # Если не удалось захватить блокировку, уведомляем пользователя о высокой нагрузке
-            from initialization.bot_init import bot
-            await bot.send_message(
-                user_id,
-                "Сейчас система обрабатывает запросы и сервер находится под высокой нагрузкой. "
-                "Пожалуйста, попробуйте снова через некоторое время."
-            )
-
     async def create_new_server(self, count_servers):
         """
         Создает новый сервер с выбранным тарифным планом.
@@ -429,7 +829,7 @@ class DbProcessor:
         """
         template_id = 31  # Шаблон Outline VPN (Ubuntu 22)
         server_name = "Server-64tb" + str(count_servers + 1)
-        server_plan_id = 17 #1
+        server_plan_id = SERVER_PLAN_ID
 
         logger.info(
             f"Отправляем запрос на создание нового сервера с именем {server_name} и тарифом {server_plan_id}"
@@ -456,24 +856,34 @@ class DbProcessor:
             )
             logger.error("Сервер не стал активным, невозможно получить IP и пароль")
             return None
-        server_ip = self.get_server_ip(server_id)
-        server_password = self.get_server_password(server_id)
+        # Запросы к VDSina синхронные, выполняем их в отдельных потоках,
+        # чтобы не блокировать цикл событий бота
+        server_ip, server_password = await asyncio.gather(
+            asyncio.to_thread(self.get_server_ip, server_id),
+            asyncio.to_thread(self.get_server_password, server_id),
+        )
+        if not server_ip or not server_password:
+            await send_error_report(f"Не удалось получить IP или пароль сервера {server_id}")
         logger.info(f"Сервер готов: IP={server_ip}, Пароль={server_password}")
         return new_server, server_ip, server_password
 
+    @run_in_db_thread
     def add_server(
             self,
             server_data: dict,
             protocol_type: str,
             server_ip: str,
             server_password: str,
+            status: str = "active",
     ) -> Server:
         """
          Добавляет информацию о сервере в базу данных.
         :param server_data: Словарь с данными сервера.
         :param protocol_type: Тип протокола (например, "Outline").
+        :param status: Состояние сервера (provisioning, пока сервер не установлен).
         :return: Объект нового сервера.
         """
+        plan = get_server_plan()
         with self.session_scope() as session:
             new_server = Server(
                 ip=server_ip,
@@ -481,7 +891,11 @@ class DbProcessor:
                 api_url="https://userapi.vdsina.ru",
                 cert_sha256=server_data.get("cert_sha256", ""),
                 cnt_users=0,
-                protocol_type=protocol_type,
+                protocol_type=protocol_type.lower(),
+                status=status,
+                max_users=plan.max_users,
+                bandwidth_budget=plan.bandwidth_budget,
+                weight=plan.weight,
             )
             session.add(new_server)
             session.commit()
@@ -489,6 +903,7 @@ class DbProcessor:
             logger.info(f"Сервер {new_server.id} успешно добавлен в БД.")
             return new_server
 
+    @run_in_db_thread
     def get_server_id_by_key_id(self, key_id) -> int:
         """
         Возвращает ID сервера по ID ключа.
@@ -500,14 +915,13 @@ class DbProcessor:
             if key:
                 return key.server_id
             else:
-                asyncio.create_task(
-                    send_error_report(
-                        f"Ошибка при получении ID сервера по ключу {key_id}"
-                    )
+                self._schedule_error_report(
+                    f"Ошибка при получении ID сервера по ключу {key_id}"
                 )
                 logger.error(f"Ошибка при получении информации о ключе {key_id}")
                 return None
 
+    @run_in_db_thread
     def get_server_by_id(self, server_id: str) -> Server:
         """
         Возвращает сервер по ID.
@@ -519,21 +933,12 @@ class DbProcessor:
             if server:
                 logger.info(f"Найден сервер с id: {server_id}")
             else:
-                asyncio.create_task(
-                    send_error_report(f"Сервер с id {server_id} не найден.")
-                )
+                self._schedule_error_report(f"Сервер с id {server_id} не найден.")
                 logger.error(f"Сервер с id {server_id} не найден.")
                 raise ValueError("Нет сервера с переданным id")
             return server
 
-    # def increment_server_user_count(self, server_id: int) -> Server:
-    #     with self.session_scope() as session:
-    #         server = session.query(Server).filter_by(id=server_id).one()
-    #         server.cnt_users += 1
-    #         session.commit()
-    #         session.refresh(server)
-    #         return server
-
+    @run_in_db_thread
     def rename_key(self, key_id: str, new_name: str) -> bool:
         """
         Изменяет имя ключа.
@@ -550,87 +955,478 @@ class DbProcessor:
             logger.info(f"Имя ключа с ID {key_id} изменено на {new_name}")
             return True
 
+    async def provision_server(self, protocol_type: str, count_servers: int) -> Server | None:
+        """
+        Создаёт сервер в VDSina, добавляет его в БД и устанавливает на нём VPN.
+        Пока идёт установка, сервер имеет состояние provisioning и не выбирается для ключей.
+        :param protocol_type: Тип протокола
+        :param count_servers: Текущее количество серверов (используется в имени нового сервера)
+        :return: Установленный сервер или None при ошибке
+        """
+        from utils.get_processor import get_processor
+
+        new_server, server_ip, server_password = (
+            await self.create_new_server(count_servers) or (None, None, None)
+        )
+        if not new_server:
+            # create_new_server сам отправляет отчёт об ошибке
+            return None
+
+        new_server_db = await self.add_server(
+            new_server, protocol_type, server_ip, server_password, status="provisioning"
+        )
+        processor = await get_processor(protocol_type)
+        logger.info(f"Передаем сервер {new_server_db.id} в setup_server")
+        try:
+            result = await processor.setup_server(new_server_db)
+        except Exception as e:
+            logger.error(f"Ошибка при настройке сервера {new_server_db.id}: {e}")
+            result = False
+        if not result:
+            await self.set_server_status(new_server_db.id, "failed")
+            logger.error(f"Ошибка при настройке нового сервера {protocol_type}")
+            await send_error_report(f"Ошибка при настройке нового сервера {protocol_type}")
+            return None
+
+        await self.set_server_status(new_server_db.id, "active")
+        logger.info(f"Настроен сервер {new_server_db.id} ({protocol_type})")
+        return new_server_db
+
+    @run_in_db_thread
+    def set_server_status(self, server_id: int, status: str) -> None:
+        """
+        Изменяет состояние сервера.
+        :param server_id: ID сервера
+        :param status: active / provisioning / failed
+        """
+        with self.session_scope() as session:
+            session.query(Server).filter_by(id=server_id).update(
+                {Server.status: status}, synchronize_session=False
+            )
+
+    @run_in_db_thread
+    def record_server_load(self, now: datetime | None = None) -> None:
+        """
+        Сохраняет замер суммарного числа пользователей по каждому протоколу
+        и удаляет замеры старше окна оценки скорости заполнения.
+        :param now: Время замера (по умолчанию текущее)
+        """
+        now = now or datetime.now()
+        with self.session_scope() as session:
+            totals = dict(
+                session.query(Server.protocol_type, func.sum(Server.cnt_users))
+                .filter(Server.protocol_type.in_(SERVER_PROTOCOL_TYPES))
+                .group_by(Server.protocol_type)
+                .all()
+            )
+            session.add_all(
+                ServerLoadSample(
+                    protocol_type=protocol_type,
+                    total_users=totals.get(protocol_type) or 0,
+                    taken_at=now,
+                )
+                for protocol_type in SERVER_PROTOCOL_TYPES
+            )
+            session.query(ServerLoadSample).filter(
+                ServerLoadSample.taken_at
+                < now - timedelta(hours=SERVER_FILL_RATE_WINDOW_HOURS)
+            ).delete(synchronize_session=False)
+
+    @run_in_db_thread
+    def get_fill_rate(self, protocol_type: str) -> float:
+        """
+        Оценивает скорость заполнения серверов протокола по замерам за окно
+        SERVER_FILL_RATE_WINDOW_HOURS (освобождение мест не уменьшает оценку ниже нуля).
+        :param protocol_type: Тип протокола
+        :return: Пользователей в час
+        """
+        with self.session_scope() as session:
+            samples = (
+                session.query(ServerLoadSample.total_users, ServerLoadSample.taken_at)
+                .filter_by(protocol_type=protocol_type.lower())
+                .order_by(ServerLoadSample.taken_at.asc())
+                .all()
+            )
+        if len(samples) < 2:
+            return 0.0
+        (first_users, first_at), (last_users, last_at) = samples[0], samples[-1]
+        hours = (last_at - first_at).total_seconds() / 3600
+        if hours <= 0:
+            return 0.0
+        return max(last_users - first_users, 0) / hours
+
+    @run_in_db_thread
+    def get_spare_capacity(self, protocol_type: str) -> int:
+        """
+        Считает свободные места на установленных серверах протокола.
+        :param protocol_type: Тип протокола
+        :return: Количество свободных мест
+        """
+        protocol_type = protocol_type.lower()
+        with self.session_scope() as session:
+            spare_slots = (
+                session.query(
+                    func.sum(func.max(server_capacity_expr() - Server.cnt_users, 0))
+                )
+                .filter(Server.protocol_type == protocol_type, Server.status == "active")
+                .scalar()
+            )
+            return spare_slots or 0
+
+    @staticmethod
+    def count_servers_to_provision(
+            spare_slots: int, provisioning: int, fill_rate: float
+    ) -> int:
+        """
+        Определяет, сколько серверов нужно создать, чтобы резерв покрывал
+        SERVER_STANDBY_LEAD_HOURS часов заполнения (но не меньше вместимости SERVER_STANDBY_MIN
+        и не больше вместимости SERVER_STANDBY_MAX серверов).
+        Резерв считается в местах: свободные места на частично заполненных серверах
+        и вместимость устанавливаемых серверов засчитываются полностью.
+        :param spare_slots: Свободные места на установленных серверах
+        :param provisioning: Серверы, которые уже устанавливаются
+        :param fill_rate: Скорость заполнения, пользователей в час
+        :return: Количество серверов для создания
+        """
+        server_capacity = get_server_plan().max_users
+        target_slots = min(
+            max(fill_rate * SERVER_STANDBY_LEAD_HOURS, SERVER_STANDBY_MIN * server_capacity),
+            SERVER_STANDBY_MAX * server_capacity,
+        )
+        missing_slots = target_slots - (spare_slots + provisioning * server_capacity)
+        return max(math.ceil(missing_slots / server_capacity), 0)
+
     async def check_count_keys_on_servers(self):
         """
-        Проверяет число пользователей на серверах с тарифом 17.
-        Если все серверы с тарифом 17 заполнены (>= 100 для старых, >= 200 для серверов с именем Server64tb-),
-        создается новый сервер с тарифом 17.
+        Поддерживает резерв установленных пустых серверов по каждому протоколу.
+        Размер резерва зависит от скорости заполнения серверов (по замерам cnt_users),
+        поэтому при выдаче ключа не приходится ждать создания и установки сервера.
+        Серверы создаются фоновыми задачами, метод не ждёт их завершения.
+        """
+        await self.record_server_load()
+        for protocol_type in SERVER_PROTOCOL_TYPES:
+            fill_rate = await self.get_fill_rate(protocol_type)
+            spare_slots = await self.get_spare_capacity(protocol_type)
+            provisioning = len(self._provisioning_tasks[protocol_type])
+            to_provision = self.count_servers_to_provision(
+                spare_slots, provisioning, fill_rate
+            )
+            if not to_provision:
+                continue
+            logger.info(
+                f"Резерв серверов {protocol_type}: свободно {spare_slots} мест, "
+                f"заполнение {fill_rate:.1f} польз./час, создаём серверов: {to_provision}"
+            )
+            for _ in range(to_provision):
+                self.start_provisioning(protocol_type)
+
+    async def sample_server_traffic(self) -> None:
+        """
+        Замеряет суммарный трафик ключей на каждом установленном сервере
+        и обновляет скорость трафика сервера (Server.traffic_rate),
+        по которой стратегия bandwidth_aware выбирает сервер для новых ключей.
         """
         from utils.get_processor import get_processor
-        async with self._server_creation_lock:
-            with self.session_scope() as session:
-                count_servers = session.query(Server).count()
-                protocol_types = ("outline", "vless")
-                for protocol_type in protocol_types:
-                    servers = (
-                        session.query(Server)
-                        .filter_by(protocol_type=protocol_type)
-                        .all()
-                    )
-                    all_full = True
-                    for server in servers:
-                        max_users = 200 if server.id > 2 else 100
-                        if server.cnt_users < max_users:
-                            all_full = False
-                            break
-
-                    if all_full:
-                        logger.info(
-                            f"Все сервера с тарифом 17 для типа {protocol_type} заполнены, создаем новый сервер с тарифом 17."
-                        )
-                        # При создании нового сервера используем новый префикс
-                        new_server, server_ip, server_password = (
-                            await self.create_new_server(count_servers)
+
+        servers = await self._get_active_servers()
+        semaphore = asyncio.Semaphore(TRAFFIC_SAMPLE_CONCURRENCY)
+
+        async def sample(server: Server) -> None:
+            async with semaphore:
+                processor = await get_processor(server.protocol_type)
+                total = await processor.get_transfer_total(server_id=server.id)
+            await self._update_server_traffic(server.id, total, datetime.now())
+
+        results = await asyncio.gather(
+            *(sample(server) for server in servers), return_exceptions=True
+        )
+        for server, result in zip(servers, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Не удалось замерить трафик сервера {server.id}: {result}")
+
+    @run_in_db_thread
+    def _get_active_servers(self) -> list[Server]:
+        """Возвращает установленные серверы (в состоянии active)."""
+        with self.session_scope() as session:
+            return session.query(Server).filter(Server.status == "active").all()
+
+    @run_in_db_thread
+    def _update_server_traffic(self, server_id: int, total: int, now: datetime) -> None:
+        """
+        Сохраняет замер трафика сервера и пересчитывает скорость трафика
+        по разнице с предыдущим замером. Если счётчик уменьшился (сброс статистики
+        на сервере), скорость не пересчитывается, замер становится новой точкой отсчёта.
+        :param server_id: ID сервера
+        :param total: Суммарный трафик ключей, байт
+        :param now: Время замера
+        """
+        with self.session_scope() as session:
+            server = session.get(Server, server_id)
+            if server is None:
+                return
+            if (
+                server.traffic_total is not None
+                and server.traffic_sampled_at is not None
+                and total >= server.traffic_total
+            ):
+                seconds = (now - server.traffic_sampled_at).total_seconds()
+                if seconds > 0:
+                    server.traffic_rate = (total - server.traffic_total) / seconds
+            server.traffic_total = total
+            server.traffic_sampled_at = now
+
+    @run_in_db_thread
+    def get_overloaded_servers(self, max_utilization: float) -> list[Server]:
+        """
+        Возвращает установленные серверы, на которых ключей больше вместимости
+        или скорость трафика превышает max_utilization от допустимой тарифом.
+        Серверы, с которых уже перенесены ключи, но старые ключи ещё не удалены,
+        пропускаются: их загрузка ещё не отражает перенос.
+        :param max_utilization: Допустимая доля скорости трафика тарифа
+        :return: Список серверов
+        """
+        pending_migrations = select(KeyMigration.old_server_id).where(
+            KeyMigration.old_key_deleted.is_(False)
+        )
+        with self.session_scope() as session:
+            return (
+                session.query(Server)
+                .filter(
+                    Server.status == "active",
+                    Server.id.not_in(pending_migrations),
+                    (Server.cnt_users > server_capacity_expr())
+                    | (
+                        (server_bandwidth_rate_expr() > 0)
+                        & (
+                            func.coalesce(Server.traffic_rate, 0)
+                            > server_bandwidth_rate_expr() * max_utilization
                         )
-                        count_servers += 1
-                        if new_server:
-                            logger.info(
-                                f"Создан новый сервер типа {protocol_type}, записываем в БД."
-                            )
-                            new_server_db = self.add_server(
-                                new_server, protocol_type, server_ip, server_password
-                            )
-                            processor = await get_processor(protocol_type)
-                            logger.info(f"Передаем сервер в setup_server: {new_server}")
-                            result = await processor.setup_server(new_server_db)
-                            if not result:
-                                logger.error(
-                                    f"Ошибка при настройке нового сервера {protocol_type}"
-                                )
-                                await send_error_report(
-                                    f"Ошибка при настройке нового сервера {protocol_type}"
-                                )
-                                return
-                            logger.info(f"Настроен сервер {protocol_type}")
+                    ),
+                )
+                .all()
+            )
+
+    @run_in_db_thread
+    def get_keys_by_server_id(self, server_id: int) -> list[VpnKey]:
+        """Возвращает ключи пользователей, находящиеся на сервере."""
+        with self.session_scope() as session:
+            return session.query(VpnKey).filter_by(server_id=server_id).all()
+
+    @run_in_db_thread
+    def move_key(
+            self,
+            key_id: str,
+            new_key_id: str,
+            new_server_id: int,
+            used_bytes_last_month: int,
+            delete_after: datetime,
+            access_url: str | None = None,
+    ) -> KeyMigration:
+        """
+        Переносит ключ пользователя на другой сервер: меняет ID и сервер ключа
+        и сохраняет запись о переносе. Место на новом сервере должно быть уже занято,
+        место на старом освобождается при удалении старого ключа (complete_key_migration).
+        :param key_id: ID ключа на старом сервере
+        :param new_key_id: ID ключа на новом сервере
+        :param new_server_id: ID нового сервера
+        :param used_bytes_last_month: Новое значение used_bytes_last_month
+        :param delete_after: Когда удалить старый ключ
+        :param access_url: Ссылка для подключения нового ключа
+        :return: KeyMigration
+        """
+        with self.session_scope() as session:
+            key = session.query(VpnKey).filter_by(key_id=key_id).one()
+            migration = KeyMigration(
+                old_key_id=key_id,
+                old_server_id=key.server_id,
+                new_key_id=str(new_key_id),
+                new_server_id=new_server_id,
+                protocol_type=key.protocol_type.lower(),
+                created_at=datetime.now(),
+                delete_after=delete_after,
+                old_key_deleted=False,
+            )
+            session.add(migration)
+            session.query(VpnKey).filter_by(key_id=key_id).update(
+                {
+                    VpnKey.key_id: str(new_key_id),
+                    VpnKey.server_id: new_server_id,
+                    VpnKey.used_bytes_last_month: used_bytes_last_month,
+                    VpnKey.access_url: access_url,
+                },
+                synchronize_session=False,
+            )
+            return migration
+
+    @run_in_db_thread
+    def get_due_key_migrations(self, now: datetime) -> list[KeyMigration]:
+        """Возвращает переносы, у которых пора удалить старый ключ."""
+        with self.session_scope() as session:
+            return (
+                session.query(KeyMigration)
+                .filter(
+                    KeyMigration.old_key_deleted.is_(False),
+                    KeyMigration.delete_after <= now,
+                )
+                .all()
+            )
+
+    @run_in_db_thread
+    def complete_key_migration(self, migration_id: int) -> None:
+        """
+        Отмечает, что старый ключ удалён с сервера, и освобождает его место.
+        :param migration_id: ID записи KeyMigration
+        """
+        with self.session_scope() as session:
+            migration = session.get(KeyMigration, migration_id)
+            if migration is None or migration.old_key_deleted:
+                return
+            migration.old_key_deleted = True
+            self._change_server_users(session, migration.old_server_id, -1)
+
+    @run_in_db_thread
+    def get_servers_count(self) -> int:
+        """Возвращает общее количество серверов."""
+        with self.session_scope() as session:
+            return session.query(Server).count()
+
+    @run_in_db_thread
+    def _get_keys_due_for_data_limit_update(self, today: datetime) -> list:
+        """
+        Возвращает действующие ключи, у которых сегодня начинается новый месяц подписки
+        (с даты начала прошло кратное DATA_LIMIT_PERIOD_DAYS число дней).
+        Отбор выполняется в SQL, ключи упорядочены по серверу.
+        :param today: Начало текущего дня
+        :return: Список строк (key_id, server_id, protocol_type, used_bytes_last_month)
+        """
+        days = cast(
+            func.julianday(func.date(today)) - func.julianday(func.date(VpnKey.start_date)),
+            Integer,
+        )
+        with self.session_scope() as session:
+            return (
+                session.query(
+                    VpnKey.key_id,
+                    VpnKey.server_id,
+                    VpnKey.protocol_type,
+                    VpnKey.used_bytes_last_month,
+                )
+                .filter(
+                    VpnKey.expiration_date > today,
+                    days > 0,
+                    days % DATA_LIMIT_PERIOD_DAYS == 0,
+                )
+                .order_by(VpnKey.server_id)
+                .all()
+            )
 
     async def check_and_update_key_data_limit(self):
+        """
+        Ежемесячно продлевает лимит трафика ключей: к текущему лимиту добавляется
+        трафик, израсходованный за прошедший месяц.
+        Расход берётся из одного снимка на сервер, а не из запроса на каждый ключ.
+        """
+        now = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        keys_by_server = defaultdict(list)
+        for key in await self._get_keys_due_for_data_limit_update(now):
+            keys_by_server[(key.server_id, key.protocol_type.lower())].append(key)
+
+        semaphore = asyncio.Semaphore(DATA_LIMIT_SYNC_CONCURRENCY)
+        results = await asyncio.gather(
+            *(
+                self._update_data_limits_on_server(
+                    server_id, protocol_type, server_keys, semaphore
+                )
+                for (server_id, protocol_type), server_keys in keys_by_server.items()
+            ),
+            return_exceptions=True,
+        )
+        updated = 0
+        for (server_id, _), result in zip(keys_by_server, results):
+            if isinstance(result, Exception):
+                error_text = f"Ошибка при обновлении лимитов ключей сервера {server_id}: {result}"
+                logger.error(error_text)
+                await send_error_report(error_text)
+            else:
+                updated += result
+        logger.info(
+            f"Обновлены лимиты ключей: {updated}/"
+            f"{sum(len(keys) for keys in keys_by_server.values())}"
+        )
+
+    async def _update_data_limits_on_server(
+            self,
+            server_id: int,
+            protocol_type: str,
+            keys: list,
+            semaphore: asyncio.Semaphore,
+    ) -> int:
+        """
+        Обновляет лимиты ключей одного сервера по снимку расхода трафика,
+        полученному одним запросом к серверу.
+        :param server_id: ID сервера
+        :param protocol_type: Протокол сервера
+        :param keys: Ключи сервера, для которых наступил новый месяц
+        :param semaphore: Ограничение числа одновременно обрабатываемых серверов
+        :return: Количество ключей с обновлённым лимитом
+        """
         from utils.get_processor import get_processor
 
-        with self.session_scope() as session:
-            keys = session.query(VpnKey).all()
+        async with semaphore:
+            processor = await get_processor(protocol_type)
+            snapshot = {
+                str(key_info.key_id): key_info
+                for key_info in await processor.get_keys(server_id=server_id)
+            }
+
+            limits = {}
+            used_bytes = {}
             for key in keys:
-                now = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-                key_start_date = key.start_date.replace(
-                    hour=0, minute=0, second=0, microsecond=0
-                )
-                if key.expiration_date > now and (now - key_start_date).days > 0 and (
-                        now - key_start_date).days % 30 == 0:
-                    processor = await get_processor(key.protocol_type)
-                    key_info = await processor.get_key_info(
-                        key.key_id, server_id=key.server_id
-                    )
-                    logger.info(
-                        f"Обновляем лимит для ключа {key.key_id} на сервере {key.server_id}"
-                    )
-                    await processor.update_data_limit(
-                        key.key_id,
-                        key_info.data_limit
-                        + (key_info.used_bytes - key.used_bytes_last_month),
-                        server_id=key.server_id,
-                        key_name=key.name,
+                key_info = snapshot.get(str(key.key_id))
+                if key_info is None:
+                    logger.warning(
+                        f"Ключ {key.key_id} не найден на сервере {server_id}"
                     )
-                    key.used_bytes_last_month = key_info.used_bytes
+                    continue
+                limits[key.key_id] = (key_info.data_limit or 0) + (
+                    key_info.used_bytes - (key.used_bytes_last_month or 0)
+                )
+                used_bytes[key.key_id] = key_info.used_bytes
 
+            logger.info(
+                f"Обновляем лимиты {len(limits)} ключей на сервере {server_id}"
+            )
+            results = await processor.update_data_limits(
+                limits,
+                server_id=server_id,
+                concurrency=DATA_LIMIT_UPDATE_CONCURRENCY,
+            )
+            updated = {
+                key_id: used_bytes[key_id]
+                for key_id, ok in results.items()
+                if ok
+            }
+            await self._set_used_bytes_last_month(updated)
+            return len(updated)
+
+    @run_in_db_thread
+    def _set_used_bytes_last_month(self, used_bytes_by_key: dict[str, int]) -> None:
+        """
+        Сохраняет объём трафика ключей на конец месяца одной транзакцией.
+        :param used_bytes_by_key: Словарь {key_id: использовано байтов}
+        """
+        if not used_bytes_by_key:
+            return
+        with self.session_scope() as session:
+            session.bulk_update_mappings(
+                VpnKey,
+                [
+                    {"key_id": key_id, "used_bytes_last_month": used_bytes}
+                    for key_id, used_bytes in used_bytes_by_key.items()
+                ],
+            )
+
+    @run_in_db_thread
     def update_server_by_id(self, server_id, api_url, cert_sha256):
         with self.session_scope() as session:
             # Берём сервер непосредственно в этой же сессии
@@ -644,19 +1440,31 @@ class DbProcessor:
                 f"Сервер {server_id} успешно обновлен, server.api_url={api_url}, server.cert_sha256={cert_sha256}"
             )
 
-    async def get_all_user_ids(self):
+    @run_in_db_thread
+    def get_all_user_ids(self):
         with self.session_scope() as session:
             users = session.query(User).all()
             return [user.user_telegram_id for user in users]
 
-    @staticmethod
-    async def backup_bd():
+    @run_in_db_thread
+    def checkpoint_wal(self) -> None:
+        """
+        Переносит содержимое WAL-журнала в основной файл базы данных,
+        чтобы копия файла содержала все закоммиченные изменения.
+        """
+        with self.engine.connect() as connection:
+            connection.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+
+    async def backup_bd(self):
         db_path = os.path.abspath("database/vpn_users.db")
         if not os.path.exists(db_path):
             logger.error(f"Файл базы данных {db_path} не найден.")
             await send_error_report(f"Файл базы данных {db_path} не найден.")
             return None
 
+        # В режиме WAL последние изменения могут находиться в файле -wal
+        await self.checkpoint_wal()
+
         # Абсолютный путь к каталогу репозитория
         repo_dir = "/app/DB_LISA"
         os.makedirs(repo_dir, exist_ok=True)
@@ -726,7 +1534,8 @@ class DbProcessor:
                 "База данных не изменилась, резервное копирование не требуется."
             )
 
-    async def mark_used_trial_period(self, user_id: int) -> None:
+    @run_in_db_thread
+    def mark_used_trial_period(self, user_id: int) -> None:
         """
         Помечает, что пользователь использовал пробный период.
         :param user_id: идентификатор пользователя
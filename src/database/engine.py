@@ -0,0 +1,122 @@
+import os
+import logging
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+DEFAULT_DB_URI = "sqlite:////app/database/vpn_users.db"
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return int(value)
+
+
+@dataclass
+class SqliteProfile:
+    """
+    Профиль движка SQLite: PRAGMA-настройки соединения и размер пула.
+
+    WAL позволяет читать базу (например, redirect-серверу) во время записи ботом,
+    а busy_timeout заставляет конкурирующего писателя ждать вместо "database is locked".
+    """
+
+    echo: bool = False
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+    busy_timeout_ms: int = 5000
+    mmap_size: int = 256 * 1024**2  # 256 МБ
+    cache_size_kib: int = 64 * 1024  # 64 МБ
+    executor_workers: int = 1
+
+    @property
+    def pool_size(self) -> int:
+        # По соединению на каждый поток БД + одно для прямых сессий (init_db, миграции)
+        return self.executor_workers + 1
+
+    @property
+    def pragmas(self) -> dict[str, str | int]:
+        return {
+            "journal_mode": self.journal_mode,
+            "synchronous": self.synchronous,
+            "busy_timeout": self.busy_timeout_ms,
+            "mmap_size": self.mmap_size,
+            # Отрицательное значение задаёт размер кэша в КиБ, а не в страницах
+            "cache_size": -self.cache_size_kib,
+        }
+
+    @classmethod
+    def from_env(cls) -> "SqliteProfile":
+        """
+        Собирает профиль из переменных окружения.
+        DB_PROFILE=development включает echo SQL-запросов, по умолчанию используется production.
+        """
+        profile = os.getenv("DB_PROFILE", "production").lower()
+        return cls(
+            echo=_env_bool("DB_ECHO", profile == "development"),
+            journal_mode=os.getenv("SQLITE_JOURNAL_MODE", cls.journal_mode),
+            synchronous=os.getenv("SQLITE_SYNCHRONOUS", cls.synchronous),
+            busy_timeout_ms=_env_int("SQLITE_BUSY_TIMEOUT_MS", cls.busy_timeout_ms),
+            mmap_size=_env_int("SQLITE_MMAP_SIZE", cls.mmap_size),
+            cache_size_kib=_env_int("SQLITE_CACHE_SIZE_KIB", cls.cache_size_kib),
+            executor_workers=_env_int("DB_EXECUTOR_WORKERS", cls.executor_workers),
+        )
+
+
+def get_db_uri() -> str:
+    """Возвращает URI базы данных из DATABASE_URL или путь по умолчанию."""
+    return os.getenv("DATABASE_URL") or DEFAULT_DB_URI
+
+
+def create_db_engine(
+    db_uri: str | None = None, profile: SqliteProfile | None = None
+) -> Engine:
+    """
+    Создает движок SQLAlchemy с применением профиля SQLite к каждому новому соединению.
+    :param db_uri: URI базы данных (по умолчанию из окружения)
+    :param profile: Профиль движка (по умолчанию из окружения)
+    :return: Engine
+    """
+    db_uri = db_uri or get_db_uri()
+    profile = profile or SqliteProfile.from_env()
+
+    if not db_uri.startswith("sqlite") or ":memory:" in db_uri:
+        return create_engine(db_uri, echo=profile.echo)
+
+    engine = create_engine(
+        db_uri,
+        echo=profile.echo,
+        pool_size=profile.pool_size,
+        max_overflow=2,
+        connect_args={"timeout": profile.busy_timeout_ms / 1000},
+    )
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in profile.pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    logger.info(
+        f"Движок БД создан: journal_mode={profile.journal_mode}, "
+        f"synchronous={profile.synchronous}, pool_size={profile.pool_size}"
+    )
+    return engine
@@ -0,0 +1,159 @@
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Migration:
+    """
+    Версионированная миграция схемы.
+    statements выполняются по порядку, затем (если задан) вызывается upgrade(connection).
+    """
+
+    version: int
+    description: str
+    statements: list[str] = field(default_factory=list)
+    upgrade: Callable[[Connection], None] | None = None
+
+
+def add_column_if_missing(table: str, column: str, ddl: str) -> Callable[[Connection], None]:
+    """
+    Возвращает upgrade-функцию, добавляющую столбец, если его ещё нет
+    (на новой базе столбец уже создан create_all по models.py).
+    :param table: Имя таблицы
+    :param column: Имя столбца
+    :param ddl: Определение столбца для ALTER TABLE ... ADD COLUMN
+    """
+
+    def upgrade(connection: Connection) -> None:
+        columns = {
+            row[1] for row in connection.execute(text(f"PRAGMA table_info({table})"))
+        }
+        if column not in columns:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+    return upgrade
+
+
+def _add_server_capacity(connection: Connection) -> None:
+    add_column_if_missing("servers", "max_users", "INTEGER")(connection)
+    add_column_if_missing("servers", "bandwidth_budget", "INTEGER")(connection)
+    add_column_if_missing("servers", "weight", "FLOAT DEFAULT 1.0")(connection)
+    # Прежнее правило: первые два сервера вмещают 100 ключей, остальные 200
+    connection.execute(
+        text(
+            "UPDATE servers SET max_users = CASE WHEN id > 2 THEN 200 ELSE 100 END "
+            "WHERE max_users IS NULL"
+        )
+    )
+
+
+def _add_server_traffic(connection: Connection) -> None:
+    add_column_if_missing("servers", "traffic_total", "INTEGER")(connection)
+    add_column_if_missing("servers", "traffic_sampled_at", "DATETIME")(connection)
+    add_column_if_missing("servers", "traffic_rate", "FLOAT")(connection)
+
+
+# Новые миграции добавляются только в конец списка с увеличением версии.
+# Индексы продублированы в models.py, чтобы create_all создавал их на новой базе;
+# IF NOT EXISTS делает миграцию безопасной для такой базы.
+MIGRATIONS: list[Migration] = [
+    Migration(
+        version=1,
+        description="Индексы для выборок по ключам и серверам",
+        statements=[
+            "UPDATE servers SET protocol_type = lower(protocol_type)",
+            "CREATE INDEX IF NOT EXISTS ix_keys_user_telegram_id ON keys (user_telegram_id)",
+            "CREATE INDEX IF NOT EXISTS ix_keys_server_id ON keys (server_id)",
+            "CREATE INDEX IF NOT EXISTS ix_keys_expiration_date ON keys (expiration_date)",
+            "CREATE INDEX IF NOT EXISTS ix_keys_protocol_type ON keys (protocol_type)",
+            "CREATE INDEX IF NOT EXISTS ix_servers_protocol_type_cnt_users "
+            "ON servers (protocol_type, cnt_users)",
+        ],
+    ),
+    Migration(
+        version=2,
+        description="Состояние сервера (active / provisioning / failed)",
+        upgrade=add_column_if_missing("servers", "status", "VARCHAR DEFAULT 'active'"),
+    ),
+    Migration(
+        version=3,
+        description="Вместимость, трафик тарифа и вес сервера",
+        upgrade=_add_server_capacity,
+    ),
+    Migration(
+        version=4,
+        description="Замеры трафика серверов для выбора сервера по загрузке канала",
+        upgrade=_add_server_traffic,
+    ),
+    Migration(
+        version=5,
+        description="Ссылка для подключения в таблице ключей",
+        upgrade=add_column_if_missing("keys", "access_url", "VARCHAR"),
+    ),
+]
+
+
+def _ensure_version_table(connection: Connection) -> None:
+    connection.execute(
+        text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, "
+            "description VARCHAR, "
+            "applied_at DATETIME)"
+        )
+    )
+
+
+def get_schema_version(connection: Connection) -> int:
+    """Возвращает номер последней применённой миграции (0, если миграций не было)."""
+    _ensure_version_table(connection)
+    version = connection.execute(
+        text("SELECT MAX(version) FROM schema_migrations")
+    ).scalar()
+    return version or 0
+
+
+def run_migrations(engine: Engine, migrations: list[Migration] | None = None) -> int:
+    """
+    Применяет все миграции с версией выше текущей.
+    Каждая миграция выполняется в отдельной транзакции вместе с записью о её применении.
+    :param engine: Движок базы данных
+    :param migrations: Список миграций (по умолчанию MIGRATIONS)
+    :return: Версия схемы после применения миграций
+    """
+    migrations = sorted(migrations or MIGRATIONS, key=lambda m: m.version)
+    with engine.begin() as connection:
+        current_version = get_schema_version(connection)
+
+    for migration in migrations:
+        if migration.version <= current_version:
+            continue
+        logger.info(
+            f"Применяем миграцию {migration.version}: {migration.description}"
+        )
+        with engine.begin() as connection:
+            for statement in migration.statements:
+                connection.execute(text(statement))
+            if migration.upgrade is not None:
+                migration.upgrade(connection)
+            connection.execute(
+                text(
+                    "INSERT INTO schema_migrations (version, description, applied_at) "
+                    "VALUES (:version, :description, :applied_at)"
+                ),
+                {
+                    "version": migration.version,
+                    "description": migration.description,
+                    "applied_at": datetime.now(),
+                },
+            )
+        current_version = migration.version
+
+    return current_version
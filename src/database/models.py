@@ -4,7 +4,9 @@ from sqlalchemy import (
     Boolean,
     Column,
     DateTime,
+    Float,
     ForeignKey,
+    Index,
     String,
     Integer,
 )
@@ -34,24 +36,29 @@ class VpnKey(Base):
 
     key_id = Column(String, primary_key=True)  # Уникальный идентификатор ключа
     user_telegram_id = Column(
-        String, ForeignKey("users.user_telegram_id")
+        String, ForeignKey("users.user_telegram_id"), index=True
     )  # telegram_id пользователя
 
     # Связь с таблицей User (обратная связь)
     user = relationship("User", back_populates="keys")
 
     start_date = Column(DateTime)  # Дата начала подписки
-    expiration_date = Column(DateTime)  # Дата окончания подписки
+    expiration_date = Column(DateTime, index=True)  # Дата окончания подписки
 
     name = Column(String, default=None)  # имя ключа
     used_bytes_last_month = Column(
         Integer, default=0
     )  # использовано байтов к концу прошлого месяца
-    protocol_type = Column(String, default="Outline")  # Тип протокола (Outline/VLESS)
+    protocol_type = Column(
+        String, default="Outline", index=True
+    )  # Тип протокола (Outline/VLESS)
 
     server_id = Column(
-        Integer, ForeignKey("servers.id")
+        Integer, ForeignKey("servers.id"), index=True
     )  # ID сервера, на котором находится ключ
+    access_url = Column(
+        String, default=None
+    )  # Ссылка для подключения (не меняется после создания ключа)
 
     # Связь с таблицей Server (каждый ключ привязан к серверу)
     server = relationship("Server", back_populates="keys")
@@ -77,7 +84,104 @@ class Server(Base):
         String, default=None
     )  # SHA-256 сертификат API (заполняется для Outline-сервера)
     cnt_users = Column(Integer, default=0)  # Количество пользователей на сервере
-    protocol_type = Column(String, default="Outline")  # Тип VPN-протокола сервера
+    protocol_type = Column(
+        String, default="outline"
+    )  # Тип VPN-протокола сервера (в нижнем регистре)
+    status = Column(
+        String, default="active"
+    )  # Состояние сервера: active / provisioning (устанавливается) / failed
+    max_users = Column(
+        Integer, default=None
+    )  # Вместимость сервера, ключей (NULL — по умолчанию для тарифа)
+    bandwidth_budget = Column(
+        Integer, default=None
+    )  # Трафик тарифа в месяц, байт (NULL — не ограничен)
+    weight = Column(
+        Float, default=1.0
+    )  # Относительная мощность сервера для выбора при выдаче ключей
+    traffic_total = Column(
+        Integer, default=None
+    )  # Суммарный трафик ключей при последнем замере, байт
+    traffic_sampled_at = Column(DateTime, default=None)  # Время последнего замера трафика
+    traffic_rate = Column(
+        Float, default=None
+    )  # Средняя скорость трафика между двумя последними замерами, байт/с
 
     # Связь один ко многим с таблицей Key (на сервере может быть несколько ключей)
     keys = relationship("VpnKey", back_populates="server")
+
+    # Выбор сервера с минимальной загрузкой для протокола
+    __table_args__ = (
+        Index("ix_servers_protocol_type_cnt_users", "protocol_type", "cnt_users"),
+    )
+
+
+class PooledKey(Base):
+    """
+    Модель таблицы pooled_keys: заранее созданные на серверах ключи,
+    ещё не выданные пользователям (пул ключей для мгновенной выдачи).
+    """
+
+    __tablename__ = "pooled_keys"
+
+    # Идентификаторы ключей Outline уникальны только в пределах сервера
+    server_id = Column(
+        Integer, ForeignKey("servers.id"), primary_key=True
+    )  # Сервер, на котором создан ключ
+    key_id = Column(String, primary_key=True)  # Идентификатор ключа на сервере
+    protocol_type = Column(String, index=True)  # Тип протокола (в нижнем регистре)
+    name = Column(String)  # Имя ключа
+    access_url = Column(String)  # Ссылка для подключения
+    data_limit = Column(Integer)  # Лимит трафика, установленный при создании, байт
+    created_at = Column(DateTime)  # Время создания ключа
+
+
+class PendingKeyLimit(Base):
+    """
+    Модель таблицы pending_key_limits: лимиты трафика выданных из пула ключей,
+    которые ещё не применены на сервере. Запись удаляется после применения лимита.
+    """
+
+    __tablename__ = "pending_key_limits"
+
+    server_id = Column(
+        Integer, ForeignKey("servers.id"), primary_key=True
+    )  # Сервер, на котором находится ключ
+    key_id = Column(String, primary_key=True)  # Идентификатор ключа на сервере
+    protocol_type = Column(String)  # Тип протокола (в нижнем регистре)
+    data_limit = Column(Integer)  # Требуемый лимит трафика, байт
+    created_at = Column(DateTime)  # Время выдачи ключа
+
+
+class ServerLoadSample(Base):
+    """
+    Модель таблицы server_load_samples: периодические замеры числа пользователей
+    по протоколу. По ним оценивается скорость заполнения серверов.
+    """
+
+    __tablename__ = "server_load_samples"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    protocol_type = Column(String, index=True)  # Тип протокола (в нижнем регистре)
+    total_users = Column(Integer)  # Сумма cnt_users по серверам протокола
+    taken_at = Column(DateTime, index=True)  # Время замера
+
+
+class KeyMigration(Base):
+    """
+    Модель таблицы key_migrations: переносы ключей между серверами.
+    Старый ключ удаляется с сервера после delete_after; запись остаётся,
+    чтобы ссылки со старым ID ключа вели на новый ключ.
+    """
+
+    __tablename__ = "key_migrations"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    old_key_id = Column(String, index=True)  # ID ключа до переноса
+    old_server_id = Column(Integer, ForeignKey("servers.id"))  # Сервер, с которого перенесён ключ
+    new_key_id = Column(String)  # ID ключа после переноса
+    new_server_id = Column(Integer, ForeignKey("servers.id"))  # Сервер, на который перенесён ключ
+    protocol_type = Column(String)  # Тип протокола (в нижнем регистре)
+    created_at = Column(DateTime)  # Время переноса
+    delete_after = Column(DateTime, index=True)  # Когда удалить старый ключ с сервера
+    old_key_deleted = Column(Boolean, default=False)  # Удалён ли старый ключ с сервера
@@ -0,0 +1,186 @@
+import os
+import logging
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+from sqlalchemy import case, func
+from sqlalchemy.sql.elements import ColumnElement
+
+from database.models import Server
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+
+@dataclass(frozen=True)
+class ServerPlan:
+    """
+    Тариф VDSina, на котором создаются серверы, и его вместимость.
+    """
+
+    plan_id: int
+    max_users: int  # Сколько ключей помещается на сервер
+    bandwidth_budget: int | None = None  # Трафик тарифа в месяц, байт (None — не ограничен)
+    weight: float = 1.0  # Относительная мощность: чем больше, тем охотнее сервер выбирается
+
+
+# Известные тарифы VDSina
+SERVER_PLANS: dict[int, ServerPlan] = {
+    17: ServerPlan(plan_id=17, max_users=200, bandwidth_budget=64 * 1024**4),
+}
+# Тариф, на котором создаются новые серверы
+SERVER_PLAN_ID = int(os.getenv("SERVER_PLAN_ID", 17))
+# Вместимость серверов на тарифе, которого нет в SERVER_PLANS
+SERVER_MAX_USERS = int(os.getenv("SERVER_MAX_USERS", 200))
+# Вместимость первых серверов, для которых max_users не задан
+LEGACY_SERVER_CAPACITY = 100
+# Длительность расчётного месяца тарифа, сек
+SECONDS_IN_MONTH = 30 * 24 * 3600
+# Стратегия выбора сервера для нового ключа (см. PLACEMENT_STRATEGIES)
+SERVER_PLACEMENT_STRATEGY = os.getenv("SERVER_PLACEMENT_STRATEGY", "least_loaded")
+
+
+def _resolve_server_plan() -> ServerPlan:
+    """
+    Определяет тариф новых серверов по SERVER_PLAN_ID. Для тарифа, которого нет
+    в SERVER_PLANS, вместимость берётся из SERVER_MAX_USERS, трафик не ограничен.
+    :return: ServerPlan
+    """
+    if SERVER_MAX_USERS <= 0:
+        raise ValueError(f"SERVER_MAX_USERS должен быть положительным, получено {SERVER_MAX_USERS}")
+    plan = SERVER_PLANS.get(SERVER_PLAN_ID)
+    if plan is None:
+        logger.warning(
+            f"Тариф сервера {SERVER_PLAN_ID} не описан в SERVER_PLANS, "
+            f"вместимость берётся из SERVER_MAX_USERS={SERVER_MAX_USERS}"
+        )
+        plan = ServerPlan(plan_id=SERVER_PLAN_ID, max_users=SERVER_MAX_USERS)
+    return plan
+
+
+# Тариф новых серверов: определяется один раз при импорте, а не при каждом выборе сервера
+CURRENT_SERVER_PLAN = _resolve_server_plan()
+
+
+def get_server_plan(plan_id: int | None = None) -> ServerPlan:
+    """
+    Возвращает описание тарифа.
+    :param plan_id: ID тарифа VDSina (по умолчанию тариф новых серверов)
+    :return: ServerPlan
+    """
+    if plan_id is None or plan_id == CURRENT_SERVER_PLAN.plan_id:
+        return CURRENT_SERVER_PLAN
+    try:
+        return SERVER_PLANS[plan_id]
+    except KeyError:
+        raise ValueError(f"Неизвестный тариф сервера: {plan_id}")
+
+
+def server_capacity_expr() -> ColumnElement:
+    """
+    SQL-выражение вместимости сервера: max_users, а для серверов без него —
+    100 для id<=2 и вместимость текущего тарифа для остальных.
+    """
+    return func.coalesce(
+        Server.max_users,
+        case((Server.id > 2, CURRENT_SERVER_PLAN.max_users), else_=LEGACY_SERVER_CAPACITY),
+    )
+
+
+def server_weight_expr() -> ColumnElement:
+    """SQL-выражение веса сервера (1.0, если не задан)."""
+    return func.coalesce(Server.weight, 1.0)
+
+
+def server_bandwidth_rate_expr() -> ColumnElement:
+    """
+    SQL-выражение средней скорости трафика (байт/с), которую допускает месячный
+    трафик тарифа сервера с учётом веса (0, если трафик тарифа не задан).
+    """
+    return (
+        func.coalesce(Server.bandwidth_budget, CURRENT_SERVER_PLAN.bandwidth_budget, 0)
+        * 1.0
+        / SECONDS_IN_MONTH
+        * server_weight_expr()
+    )
+
+
+class PlacementStrategy(ABC):
+    """
+    Стратегия выбора сервера для новых ключей.
+    Выбор выполняется в БД одним запросом, поэтому стратегия задаёт порядок
+    кандидатов (серверов с местом) в виде SQL-выражений: берётся первый.
+    """
+
+    name: str
+
+    @abstractmethod
+    def order_by(self) -> list[ColumnElement]:
+        """
+        :return: Выражения ORDER BY для списка серверов-кандидатов
+        """
+
+
+class LeastLoadedPlacement(PlacementStrategy):
+    """
+    Наименее загруженный сервер с учётом вместимости и веса:
+    ключи распределяются по серверам равномерно в долях от их вместимости.
+    """
+
+    name = "least_loaded"
+
+    def order_by(self) -> list[ColumnElement]:
+        load = Server.cnt_users * 1.0 / (server_capacity_expr() * server_weight_expr())
+        return [load.asc(), Server.id.asc()]
+
+
+class BinPackingPlacement(PlacementStrategy):
+    """
+    Плотная упаковка: сначала заполняются серверы с наименьшим числом свободных мест,
+    а среди новых — более мощные. Пустые серверы остаются в резерве дольше,
+    и ключи собираются на меньшем числе серверов.
+    """
+
+    name = "bin_packing"
+
+    def order_by(self) -> list[ColumnElement]:
+        free_slots = server_capacity_expr() - Server.cnt_users
+        return [free_slots.asc(), server_weight_expr().desc(), Server.id.asc()]
+
+
+class BandwidthAwarePlacement(PlacementStrategy):
+    """
+    Сервер с наибольшим запасом канала: из средней скорости, которую допускает
+    месячный трафик тарифа (с учётом веса), вычитается фактическая скорость трафика
+    по последним замерам (Server.traffic_rate). При равном запасе выбирается
+    наименее загруженный по числу ключей.
+    """
+
+    name = "bandwidth_aware"
+
+    def order_by(self) -> list[ColumnElement]:
+        headroom = server_bandwidth_rate_expr() - func.coalesce(Server.traffic_rate, 0)
+        return [headroom.desc(), *LeastLoadedPlacement().order_by()]
+
+
+PLACEMENT_STRATEGIES: dict[str, type[PlacementStrategy]] = {
+    strategy.name: strategy
+    for strategy in (LeastLoadedPlacement, BinPackingPlacement, BandwidthAwarePlacement)
+}
+
+
+def get_placement_strategy(name: str = SERVER_PLACEMENT_STRATEGY) -> PlacementStrategy:
+    """
+    Создаёт стратегию выбора сервера по имени.
+    :param name: Имя стратегии (least_loaded, bin_packing, bandwidth_aware)
+    :return: PlacementStrategy
+    """
+    try:
+        return PLACEMENT_STRATEGIES[name.lower()]()
+    except KeyError:
+        raise ValueError(
+            f"Неизвестная стратегия выбора сервера: {name}. "
+            f"Доступны: {', '.join(PLACEMENT_STRATEGIES)}"
+        )
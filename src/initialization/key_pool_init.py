@@ -0,0 +1,5 @@
+from initialization.db_processor_init import db_processor
+from utils.key_pool import KeyPool
+
+# Пул заранее созданных ключей (размер задаётся KEY_POOL_TARGET_SIZE)
+key_pool = KeyPool(db_processor)
@@ -0,0 +1,5 @@
+from initialization.db_processor_init import db_processor
+from utils.rebalancer import KeyRebalancer
+
+# Перенос ключей с перегруженных серверов (пороги задаются REBALANCE_*)
+key_rebalancer = KeyRebalancer(db_processor)
@@ -8,6 +8,11 @@ from servers.redirect_server import redirect_server
 from initialization.bot_init import dp, bot
 from initialization.vdsina_processor_init import vdsina_processor_init
 from initialization.db_processor_init import db_processor, main_init_db
+from initialization.outline_processor_init import async_outline_processor
+from initialization.vless_processor_init import vless_processor
+from initialization.key_pool_init import key_pool
+from initialization.rebalancer_init import key_rebalancer
+from api_processors.single_flight import request_coalescer
 from bot.routers import (
     admin_router,
     buy_key_router,
@@ -57,6 +62,25 @@ async def scheduled_update_key_data_limit():
 async def scheduled_check_servers():
     await db_processor.check_count_keys_on_servers()
 
+# every 10 minutes
+@aiocron.crontab("*/10 * * * *")
+async def scheduled_sample_server_traffic():
+    await db_processor.sample_server_traffic()
+    logger.info(f"Сессии панелей 3x-ui: {vless_processor.login_stats.summary()}")
+    logger.info(f"Метрики Outline: {async_outline_processor.metrics_stats.summary()}")
+    logger.info(f"Объединение запросов к VPN-серверам: {request_coalescer.stats.summary()}")
+
+# every 5 minutes
+@aiocron.crontab("*/5 * * * *")
+async def scheduled_refill_key_pool():
+    await key_pool.refill_all()
+
+# every hour + 30 minutes
+@aiocron.crontab("30 * * * *")
+async def scheduled_rebalance_keys():
+    await key_rebalancer.delete_migrated_keys()
+    await key_rebalancer.rebalance()
+
 # every hour + 10 minutes
 @aiocron.crontab("10 * * * *")
 async def scheduled_back_up_db():
@@ -67,7 +91,11 @@ async def main() -> None:
     await vdsina_processor_init()  # инициализируем VDSina API
     main_init_db()  # инициализируем БД 1ый раз при запуске
     logger.info("Запуск polling...")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await async_outline_processor.close()
+        await vless_processor.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,71 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд ссылка ключа отдаётся из памяти без обращения к БД
+REDIRECT_CACHE_TTL = float(os.getenv("REDIRECT_CACHE_TTL", 300))
+# Сколько ключей хранится в кэше редирект-сервера
+REDIRECT_CACHE_SIZE = int(os.getenv("REDIRECT_CACHE_SIZE", 10000))
+
+
+@dataclass
+class CachedKey:
+    """
+    Данные ключа, нужные для страницы /open/{key_id}, и сама страница после первого запроса.
+    """
+
+    key_id: str
+    protocol_type: str
+    access_url: str
+    name: str | None
+    server_id: int
+    cached_at: float = field(default_factory=time.monotonic)
+    page: bytes | None = None  # Сформированная страница редиректа
+    etag: str | None = None  # ETag страницы
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.monotonic() - self.cached_at < ttl
+
+
+class AccessUrlCache:
+    """
+    LRU-кэш ссылок ключей по ID, запрошенному в /open/{key_id}.
+    Устаревшая запись не удаляется сразу: её можно отдать, если БД или VPN-сервер недоступны.
+    """
+
+    def __init__(self, ttl: float = REDIRECT_CACHE_TTL, max_size: int = REDIRECT_CACHE_SIZE):
+        """
+        :param ttl: Время жизни записи, сек
+        :param max_size: Максимальное число записей
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: OrderedDict[str, CachedKey] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key_id: str, allow_stale: bool = False) -> CachedKey | None:
+        """
+        :param key_id: ID ключа из ссылки
+        :param allow_stale: Вернуть запись, даже если её время жизни истекло
+        :return: CachedKey или None
+        """
+        entry = self._entries.get(key_id)
+        if entry is None or not (allow_stale or entry.is_fresh(self.ttl)):
+            return None
+        self._entries.move_to_end(key_id)
+        return entry
+
+    def put(self, key_id: str, entry: CachedKey) -> None:
+        self._entries[key_id] = entry
+        self._entries.move_to_end(key_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key_id: str) -> None:
+        self._entries.pop(key_id, None)
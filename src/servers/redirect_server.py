@@ -1,13 +1,22 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import HTMLResponse, Response
+from string import Template
+from typing import Annotated
 from urllib.parse import quote
+import hashlib
+import html
+import json
+import logging
 import uvicorn
 import socket
 from utils.get_processor import get_processor
 from initialization.db_processor_init import db_processor
+from servers.access_url_cache import AccessUrlCache, CachedKey
 
+logger = logging.getLogger(__name__)
 
 redirect_server = FastAPI()
+access_url_cache = AccessUrlCache()
 
 
 # def get_server_ip():
@@ -21,52 +30,72 @@ redirect_server = FastAPI()
 #         return "127.0.0.1"  # fallback на localhost
 
 
-def generate_redirect_html(protocol: str, url: str) -> HTMLResponse:
-    templates = {
-        "outline": f"""
+# Шаблоны страниц запуска приложения. $html_url подставляется в HTML-атрибуты и текст,
+# $js_url — JS-строка в <script>; оба значения экранируются в render_redirect_page
+REDIRECT_TEMPLATES = {
+    "outline": Template(
+        """
         <html>
             <head>
                 <title>Launch Outline</title>
-                <meta http-equiv="refresh" content="0; url='{url}'">
+                <meta http-equiv="refresh" content="0; url=$html_url">
             </head>
             <body>
                 <script>
-                    window.location.href = '{url}';
+                    window.location.href = $js_url;
                     setTimeout(() => window.close(), 30000);
                 </script>
-                <p>Если Outline не открылся, <a href="{url}">нажмите здесь</a></p>
+                <p>Если Outline не открылся, <a href="$html_url">нажмите здесь</a></p>
             </body>
         </html>
-        """,
-        "vless": f"""
+        """
+    ),
+    "vless": Template(
+        """
         <html>
             <head>
                 <title>Launch Hiddify</title>
-                <meta http-equiv="refresh" content="0; url='{url}'">
+                <meta http-equiv="refresh" content="0; url=$html_url">
             </head>
             <body>
                 <h2>Hiddify Connection</h2>
                 <div style="margin: 20px; padding: 15px; border: 1px solid #ddd;">
                     <p>Ссылка для подключения:</p>
-                    <input type="text" value="{url}" 
-                           style="width: 100%; padding: 8px; margin: 10px 0;" 
+                    <input type="text" value="$html_url"
+                           style="width: 100%; padding: 8px; margin: 10px 0;"
                            id="hiddifyUrl" readonly>
-                    <button onclick="navigator.clipboard.writeText('{url}')">
+                    <button onclick="navigator.clipboard.writeText(document.getElementById('hiddifyUrl').value)">
                         Скопировать
                     </button>
                 </div>
                 <script>
                     // Попытка открыть десктопное приложение
-                    window.location.href = '{url}';
+                    window.location.href = $js_url;
 
                     // Автоматическое закрытие через 30 сек
                     setTimeout(() => window.close(), 30000);
                 </script>
             </body>
         </html>
-        """,
-    }
-    return HTMLResponse(content=templates[protocol])
+        """
+    ),
+}
+
+
+def render_redirect_page(protocol: str, url: str) -> bytes:
+    """
+    Формирует страницу запуска приложения.
+    :param protocol: Протокол ключа (outline / vless)
+    :param url: Ссылка, которую откроет приложение
+    :return: HTML-страница в UTF-8
+    """
+    # json.dumps даёт JS-строку в кавычках; "</" экранируется, чтобы ссылка не закрыла <script>
+    js_url = json.dumps(url).replace("</", "<\\/")
+    return (
+        REDIRECT_TEMPLATES[protocol]
+        .substitute(html_url=html.escape(url, quote=True), js_url=js_url)
+        .encode()
+    )
 
 
 def generate_hiddify_url(base_url: str, key_name: str) -> str:
@@ -87,34 +116,98 @@ def generate_hiddify_url(base_url: str, key_name: str) -> str:
     return f"hiddify://import/{encoded_vless}"
 
 
-@redirect_server.get("/open/{key_id}")
-async def open_connection(key_id: str):
-    try:
-        key = db_processor.get_key_by_id(key_id)
+async def resolve_key(key_id: str) -> CachedKey | None:
+    """
+    Возвращает данные ключа для редиректа: из кэша, затем из БД.
+    Ссылка запрашивается у VPN-сервера только для старых ключей без access_url
+    и сохраняется в БД. Если БД или VPN-сервер недоступны, отдаётся устаревшая запись кэша.
+    :param key_id: ID ключа из ссылки
+    :return: CachedKey или None, если ключ не найден
+    """
+    cached = access_url_cache.get(key_id)
+    if cached is not None:
+        return cached
 
+    try:
+        # Ключ мог быть перенесён на другой сервер — тогда ссылка ведёт на новый ключ
+        key = await db_processor.get_key_by_id(key_id) or await db_processor.get_migrated_key(key_id)
         if not key:
-            raise HTTPException(status_code=404, detail="Key not found")
-
-        key_protocol = key.protocol_type.lower()
-        processor = await get_processor(key_protocol)
-        key_info = await processor.get_key_info(key_id, server_id=key.server_id)
-
-        match key_protocol:
+            access_url_cache.invalidate(key_id)
+            return None
+
+        access_url = key.access_url
+        if not access_url:
+            processor = await get_processor(key.protocol_type.lower())
+            key_info = await processor.get_key_info(key.key_id, server_id=key.server_id)
+            access_url = key_info.access_url
+            await db_processor.set_key_access_url(key.key_id, access_url)
+    except Exception as e:
+        stale = access_url_cache.get(key_id, allow_stale=True)
+        if stale is None:
+            raise
+        logger.warning(f"Ключ {key_id} отдан из устаревшего кэша: {e}")
+        return stale
+
+    cached = CachedKey(
+        key_id=key.key_id,
+        protocol_type=key.protocol_type.lower(),
+        access_url=access_url,
+        name=key.name,
+        server_id=key.server_id,
+    )
+    access_url_cache.put(key_id, cached)
+    return cached
+
+
+def get_rendered_page(key: CachedKey) -> CachedKey:
+    """
+    Формирует страницу ключа и её ETag один раз на запись кэша.
+    :param key: Запись кэша ссылок
+    :return: Та же запись с заполненными page и etag
+    """
+    if key.page is None:
+        match key.protocol_type:
             case "outline":
-                url = key_info.access_url
+                url = key.access_url
             case "vless":
                 # Добавляем имя ключа из базы данных
                 url = generate_hiddify_url(
-                    key_info.access_url,
+                    key.access_url,
                     key.name or f"Server-{key.server_id}",  # Дефолтное имя
                 )
             case _:
                 raise HTTPException(status_code=400, detail="Unsupported protocol")
+        page = render_redirect_page(key.protocol_type, url)
+        key.etag = f'"{hashlib.sha1(page).hexdigest()[:20]}"'
+        key.page = page
+    return key
 
-        return generate_redirect_html(key_protocol, url)
 
+@redirect_server.get("/open/{key_id}")
+async def open_connection(
+    key_id: str, if_none_match: Annotated[str | None, Header()] = None
+):
+    try:
+        key = await resolve_key(key_id)
+
+        if not key:
+            raise HTTPException(status_code=404, detail="Key not found")
+
+        key = get_rendered_page(key)
+        headers = {
+            "ETag": key.etag,
+            "Cache-Control": f"private, max-age={int(access_url_cache.ttl)}",
+        }
+        if if_none_match and key.etag in {tag.strip() for tag in if_none_match.split(",")}:
+            return Response(status_code=304, headers=headers)
+        return Response(content=key.page, media_type="text/html", headers=headers)
+
+    except HTTPException:
+        raise
     except Exception as e:
-        return HTMLResponse(content=f"<h1>Error</h1><p>{str(e)}</p>", status_code=500)
+        return HTMLResponse(
+            content=f"<h1>Error</h1><p>{html.escape(str(e))}</p>", status_code=500
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,249 @@
+import os
+import asyncio
+import logging
+from collections import defaultdict
+
+from api_processors.key_models import OutlineKey, VlessKey
+from database.models import PooledKey
+
+logger = logging.getLogger(__name__)
+
+# Сколько готовых ключей держать в пуле для каждого протокола (0 — пул выключен)
+KEY_POOL_TARGET_SIZE = int(os.getenv("KEY_POOL_TARGET_SIZE", 0))
+# При каком остатке ключей в пуле запускается фоновое пополнение
+KEY_POOL_LOW_WATERMARK = int(
+    os.getenv("KEY_POOL_LOW_WATERMARK", KEY_POOL_TARGET_SIZE // 2)
+)
+# Сколько ключей создаётся на одном сервере за один заход пополнения
+KEY_POOL_REFILL_BATCH = int(os.getenv("KEY_POOL_REFILL_BATCH", 20))
+# Протоколы, для которых поддерживается пул
+KEY_POOL_PROTOCOLS = ("outline", "vless")
+# Лимит трафика, с которым создаются ключи пула
+KEY_POOL_DATA_LIMIT = 200 * 1024**3
+
+
+class KeyPool:
+    """
+    Пул заранее созданных ключей.
+
+    Ключи создаются на серверах пачками в фоне и хранятся в таблице pooled_keys,
+    место на сервере (cnt_users) занимается при создании. После оплаты или запроса
+    пробного периода ключ забирается из пула одним запросом к БД, без обращения
+    к VPN-серверу. Если пул пуст или выключен, ключ создаётся как раньше.
+    """
+
+    def __init__(
+        self,
+        db_processor,
+        target_size: int = KEY_POOL_TARGET_SIZE,
+        low_watermark: int = KEY_POOL_LOW_WATERMARK,
+        refill_batch: int = KEY_POOL_REFILL_BATCH,
+    ):
+        """
+        :param db_processor: Экземпляр DbProcessor
+        :param target_size: Сколько ключей держать в пуле для каждого протокола
+        :param low_watermark: Остаток, при котором запускается пополнение
+        :param refill_batch: Сколько ключей создавать на одном сервере за раз
+        """
+        self.db_processor = db_processor
+        self.target_size = target_size
+        self.low_watermark = low_watermark
+        self.refill_batch = refill_batch
+        self._refill_locks: defaultdict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._background_tasks: set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.target_size > 0
+
+    @staticmethod
+    def _to_key(pooled_key: PooledKey) -> OutlineKey | VlessKey:
+        """
+        Преобразует запись пула в объект ключа соответствующего протокола.
+        :param pooled_key: Запись таблицы pooled_keys
+        :return: OutlineKey или VlessKey
+        """
+        if pooled_key.protocol_type == "outline":
+            return OutlineKey(
+                key_id=int(pooled_key.key_id),
+                name=pooled_key.name,
+                password=None,
+                port=None,
+                method=None,
+                access_url=pooled_key.access_url,
+                data_limit=pooled_key.data_limit,
+                used_bytes=0,
+            )
+        return VlessKey(
+            key_id=pooled_key.key_id,
+            name=pooled_key.name,
+            email=pooled_key.key_id,
+            access_url=pooled_key.access_url,
+            used_bytes=0,
+            data_limit=pooled_key.data_limit,
+        )
+
+    async def get_key(
+        self, protocol_type: str, user_id: int, data_limit: int = KEY_POOL_DATA_LIMIT
+    ) -> tuple[OutlineKey | VlessKey, int]:
+        """
+        Выдаёт ключ пользователю: из пула, а если он пуст — создаёт новый на сервере.
+        :param protocol_type: Тип протокола
+        :param user_id: ID пользователя в Telegram
+        :param data_limit: Требуемый лимит трафика в байтах
+        :return: Кортеж из ключа и ID сервера
+        """
+        from utils.get_processor import get_processor
+
+        protocol_type = protocol_type.lower()
+        processor = await get_processor(protocol_type)
+
+        pooled_key = None
+        if self.enabled:
+            pooled_key = await self.db_processor.claim_pooled_key(protocol_type, data_limit)
+            self.schedule_refill(protocol_type)
+
+        if pooled_key is None:
+            logger.info(f"Пул ключей {protocol_type} пуст, создаём ключ для {user_id}")
+            return await processor.create_vpn_key(user_id=user_id, data_limit=data_limit)
+
+        key = self._to_key(pooled_key)
+        if key.data_limit != data_limit:
+            # Лимит применяется на сервере в фоне, чтобы не ждать VPN-сервер при выдаче.
+            # claim_pooled_key сохранил его в pending_key_limits: при ошибке (и после
+            # перезапуска бота) он повторяется при следующем пополнении пула
+            self._spawn(
+                self._apply_limit(protocol_type, pooled_key.server_id, pooled_key.key_id, data_limit)
+            )
+            key.data_limit = data_limit
+        logger.info(f"Ключ {key.key_id} выдан из пула {protocol_type} пользователю {user_id}")
+        return key, pooled_key.server_id
+
+    def _spawn(self, coro) -> None:
+        """
+        Запускает фоновую задачу и хранит ссылку на неё до завершения.
+        """
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _apply_limit(
+        self, protocol_type: str, server_id: int, key_id: str, data_limit: int
+    ) -> bool:
+        """
+        Применяет на сервере лимит ключа, выданного из пула,
+        и удаляет запись о нём из pending_key_limits.
+        :param protocol_type: Тип протокола
+        :param server_id: ID сервера
+        :param key_id: ID ключа на сервере
+        :param data_limit: Лимит в байтах
+        :return: True, если лимит применён
+        """
+        from utils.get_processor import get_processor
+
+        try:
+            processor = await get_processor(protocol_type)
+            applied = await processor.update_data_limit(key_id, data_limit, server_id=server_id)
+            if not applied:
+                logger.error(f"Сервер {server_id} не изменил лимит ключа {key_id} из пула")
+                return False
+            await self.db_processor.complete_pending_key_limit(server_id, key_id, data_limit)
+        except Exception as e:
+            logger.error(f"Ошибка при изменении лимита ключа {key_id} из пула: {e}")
+            return False
+        logger.info(f"Лимит ключа {key_id} из пула изменён на {data_limit} байт")
+        return True
+
+    async def apply_pending_limits(self) -> int:
+        """
+        Повторяет применение лимитов из pending_key_limits, которые не удалось
+        применить при выдаче ключей.
+        :return: Количество применённых лимитов
+        """
+        pending = await self.db_processor.get_pending_key_limits()
+        results = await asyncio.gather(
+            *(
+                self._apply_limit(
+                    limit.protocol_type, limit.server_id, limit.key_id, limit.data_limit
+                )
+                for limit in pending
+            )
+        )
+        return sum(results)
+
+    def schedule_refill(self, protocol_type: str) -> None:
+        """
+        Запускает в фоне пополнение пула, если в нём осталось мало ключей.
+        :param protocol_type: Тип протокола
+        """
+        if not self.enabled or self._refill_locks[protocol_type].locked():
+            return
+        self._spawn(self._refill_if_low(protocol_type))
+
+    async def _refill_if_low(self, protocol_type: str) -> None:
+        try:
+            if await self.db_processor.count_pooled_keys(protocol_type) <= self.low_watermark:
+                await self.refill(protocol_type)
+        except Exception as e:
+            logger.error(f"Ошибка при пополнении пула ключей {protocol_type}: {e}")
+
+    async def refill(self, protocol_type: str) -> int:
+        """
+        Дополняет пул ключей протокола protocol_type до target_size.
+        Места на серверах занимаются заранее; места под ключи, которые не удалось создать,
+        освобождаются. Если свободных мест нет, пополнение прекращается до следующего запуска.
+        :param protocol_type: Тип протокола
+        :return: Количество добавленных в пул ключей
+        """
+        from utils.get_processor import get_processor
+
+        protocol_type = protocol_type.lower()
+        added = 0
+        async with self._refill_locks[protocol_type]:
+            missing = self.target_size - await self.db_processor.count_pooled_keys(protocol_type)
+            processor = await get_processor(protocol_type)
+            while missing > 0:
+                server, reserved = await self.db_processor.reserve_server_slots(
+                    protocol_type, min(missing, self.refill_batch)
+                )
+                if server is None:
+                    logger.info(f"Нет свободных мест для пополнения пула ключей {protocol_type}")
+                    break
+
+                keys = []
+                try:
+                    keys = await processor.create_vpn_keys(
+                        reserved, server_id=server.id, data_limit=KEY_POOL_DATA_LIMIT
+                    )
+                    if keys:
+                        await self.db_processor.add_pooled_keys(keys, server.id, protocol_type)
+                finally:
+                    await self.db_processor.release_server_slots(server.id, reserved - len(keys))
+
+                if not keys:
+                    break
+                added += len(keys)
+                missing -= len(keys)
+
+        if added:
+            logger.info(f"Пул ключей {protocol_type} пополнен на {added}")
+        return added
+
+    async def refill_all(self) -> None:
+        """
+        Дополняет пулы всех протоколов; ошибка одного протокола не мешает остальным.
+        Перед пополнением повторяет неприменённые лимиты выданных ключей.
+        """
+        try:
+            await self.apply_pending_limits()
+        except Exception as e:
+            logger.error(f"Ошибка при повторном применении лимитов ключей из пула: {e}")
+        if not self.enabled:
+            return
+        results = await asyncio.gather(
+            *(self.refill(protocol_type) for protocol_type in KEY_POOL_PROTOCOLS),
+            return_exceptions=True,
+        )
+        for protocol_type, result in zip(KEY_POOL_PROTOCOLS, results):
+            if isinstance(result, Exception):
+                logger.error(f"Ошибка при пополнении пула ключей {protocol_type}: {result}")
@@ -0,0 +1,271 @@
+import os
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from database.models import Server, VpnKey
+from database.placement import (
+    SECONDS_IN_MONTH,
+    BandwidthAwarePlacement,
+    get_server_plan,
+    server_bandwidth_rate_expr,
+)
+
+logger = logging.getLogger(__name__)
+
+# Доля допустимой тарифом скорости трафика, выше которой сервер считается перегруженным
+REBALANCE_MAX_UTILIZATION = float(os.getenv("REBALANCE_MAX_UTILIZATION", 0.9))
+# Доля, до которой разгружается перегруженный сервер (и выше которой сервер не принимает ключи)
+REBALANCE_TARGET_UTILIZATION = float(os.getenv("REBALANCE_TARGET_UTILIZATION", 0.7))
+# Сколько ключей максимум переносится за один запуск
+REBALANCE_MAX_MOVES = int(os.getenv("REBALANCE_MAX_MOVES", 20))
+# Сколько часов старый ключ продолжает работать после переноса
+REBALANCE_GRACE_HOURS = int(os.getenv("REBALANCE_GRACE_HOURS", 24))
+
+
+class KeyRebalancer:
+    """
+    Переносит ключи с перегруженных серверов на менее загруженные.
+
+    Перегруженным считается сервер, на котором ключей больше вместимости или скорость
+    трафика выше REBALANCE_MAX_UTILIZATION от допустимой тарифом. С него переносятся
+    самые активные ключи, пока оценка загрузки не опустится до REBALANCE_TARGET_UTILIZATION.
+    Новый ключ создаётся на сервере с наибольшим запасом канала, пользователь получает
+    новую ссылку, а ссылка /open/<старый ID> ведёт на новый ключ. Старый ключ удаляется
+    с сервера через REBALANCE_GRACE_HOURS часов.
+
+    ID ключей Outline выдаются каждым сервером отдельно, а keys.key_id уникален во всей БД,
+    поэтому новый ключ может получить ID уже существующего ключа. Такой перенос откатывается,
+    а сервер до перезапуска бота больше не выбирается для этого ключа.
+    """
+
+    def __init__(
+        self,
+        db_processor,
+        max_utilization: float = REBALANCE_MAX_UTILIZATION,
+        target_utilization: float = REBALANCE_TARGET_UTILIZATION,
+        max_moves: int = REBALANCE_MAX_MOVES,
+        grace_period: timedelta = timedelta(hours=REBALANCE_GRACE_HOURS),
+    ):
+        """
+        :param db_processor: Экземпляр DbProcessor
+        :param max_utilization: Порог перегрузки сервера по трафику
+        :param target_utilization: Загрузка, до которой разгружается сервер
+        :param max_moves: Максимум переносов за запуск
+        :param grace_period: Сколько старый ключ работает после переноса
+        """
+        self.db_processor = db_processor
+        self.max_utilization = max_utilization
+        self.target_utilization = target_utilization
+        self.max_moves = max_moves
+        self.grace_period = grace_period
+        self.placement = BandwidthAwarePlacement()
+        # Серверы, перенос на которые не удалось сохранить, по ID ключа
+        self._failed_targets: defaultdict[str, set[int]] = defaultdict(set)
+
+    def _target_filters(self) -> tuple:
+        """Условия на сервер, принимающий ключи: он не должен стать перегруженным."""
+        return (
+            (server_bandwidth_rate_expr() <= 0)
+            | (
+                func.coalesce(Server.traffic_rate, 0)
+                <= server_bandwidth_rate_expr() * self.target_utilization
+            ),
+        )
+
+    def _count_keys_to_move(self, server: Server, keys_info: list) -> int:
+        """
+        Оценивает, сколько самых активных ключей нужно перенести с сервера.
+        Доля трафика ключа оценивается по его расходу (used_bytes) среди ключей сервера.
+        :param server: Перегруженный сервер
+        :param keys_info: Ключи сервера, отсортированные по убыванию расхода
+        :return: Количество ключей
+        """
+        capacity = server.max_users or 0
+        count = max(server.cnt_users - capacity, 0) if capacity else 0
+
+        budget = server.bandwidth_budget or get_server_plan().bandwidth_budget
+        if budget and server.traffic_rate:
+            budget_rate = budget / SECONDS_IN_MONTH * (server.weight or 1.0)
+            utilization = server.traffic_rate / budget_rate
+            if utilization > self.max_utilization:
+                share_to_move = 1 - self.target_utilization / utilization
+                total = sum(key.used_bytes or 0 for key in keys_info) or 1
+                moved = 0
+                for index, key in enumerate(keys_info, start=1):
+                    moved += key.used_bytes or 0
+                    if moved / total >= share_to_move:
+                        count = max(count, index)
+                        break
+        return count
+
+    async def rebalance(self) -> int:
+        """
+        Переносит ключи с перегруженных серверов.
+        :return: Количество перенесённых ключей
+        """
+        from utils.get_processor import get_processor
+
+        servers = await self.db_processor.get_overloaded_servers(self.max_utilization)
+        moved = 0
+        for server in servers:
+            if moved >= self.max_moves:
+                break
+            processor = await get_processor(server.protocol_type)
+            try:
+                keys_info = await processor.get_keys(server_id=server.id)
+            except Exception as e:
+                logger.error(f"Не удалось получить ключи сервера {server.id}: {e}")
+                continue
+
+            db_keys = {
+                key.key_id: key
+                for key in await self.db_processor.get_keys_by_server_id(server.id)
+            }
+            # Переносятся только ключи пользователей (не ключи пула), самые активные первыми
+            keys_info = sorted(
+                (key for key in keys_info if str(key.key_id) in db_keys),
+                key=lambda key: key.used_bytes or 0,
+                reverse=True,
+            )
+            to_move = min(
+                self._count_keys_to_move(server, keys_info), self.max_moves - moved
+            )
+            if to_move:
+                logger.info(f"Переносим {to_move} ключей с перегруженного сервера {server.id}")
+            for key_info in keys_info[:to_move]:
+                if not await self._move_key(
+                    server, processor, db_keys[str(key_info.key_id)], key_info
+                ):
+                    break
+                moved += 1
+
+        if moved:
+            logger.info(f"Перенесено ключей: {moved}")
+        return moved
+
+    async def _move_key(self, server: Server, processor, key: VpnKey, key_info) -> bool:
+        """
+        Создаёт замену ключа на другом сервере, сохраняет перенос и уведомляет пользователя.
+        :param server: Сервер, с которого переносится ключ
+        :param processor: Процессор протокола
+        :param key: Ключ в БД
+        :param key_info: Ключ на сервере (с расходом трафика и лимитом)
+        :return: False, если подходящего сервера нет или ключ не удалось создать или сохранить
+        """
+        target = await self.db_processor.reserve_server(
+            server.protocol_type,
+            exclude_server_ids=(server.id, *self._failed_targets[key.key_id]),
+            placement=self.placement,
+            filters=self._target_filters(),
+        )
+        if target is None:
+            logger.info(f"Нет сервера {server.protocol_type} для переноса ключей")
+            return False
+
+        used_bytes = key_info.used_bytes or 0
+        data_limit = key_info.data_limit
+        # Остаток лимита переносится на новый ключ, а used_bytes_last_month сдвигается так,
+        # чтобы ежемесячное пополнение (limit + used - used_last_month) не изменилось
+        new_limit = max(data_limit - used_bytes, 0) if data_limit else 200 * 1024**3
+        try:
+            new_keys = await processor.create_vpn_keys(
+                1, server_id=target.id, data_limit=new_limit
+            )
+        except Exception as e:
+            logger.error(f"Не удалось создать ключ на сервере {target.id}: {e}")
+            new_keys = []
+        if not new_keys:
+            await self.db_processor.release_server_slots(target.id, 1)
+            return False
+        new_key = new_keys[0]
+
+        if key.name:
+            try:
+                await processor.rename_key(
+                    key_id=new_key.key_id, new_key_name=key.name, server_id=target.id
+                )
+            except Exception as e:
+                logger.warning(f"Не удалось переименовать ключ {new_key.key_id}: {e}")
+
+        try:
+            await self.db_processor.move_key(
+                key.key_id,
+                new_key.key_id,
+                target.id,
+                (key.used_bytes_last_month or 0) - used_bytes,
+                datetime.now() + self.grace_period,
+                new_key.access_url,
+            )
+        except Exception as e:
+            # Например, ID нового ключа совпал с ID уже существующего в БД ключа
+            logger.error(
+                f"Не удалось сохранить перенос ключа {key.key_id} на сервер {target.id}: {e}"
+            )
+            try:
+                await processor.delete_key(new_key.key_id, server_id=target.id)
+            except Exception as delete_error:
+                logger.error(
+                    f"Не удалось удалить ключ {new_key.key_id} с сервера {target.id}: {delete_error}"
+                )
+            await self.db_processor.release_server_slots(target.id, 1)
+            # Иначе ключ будет выбирать этот сервер при каждом запуске и снова не переноситься
+            self._failed_targets[key.key_id].add(target.id)
+            return False
+        self._failed_targets.pop(key.key_id, None)
+        logger.info(
+            f"Ключ {key.key_id} перенесён с сервера {server.id} на {target.id} "
+            f"(новый ID {new_key.key_id})"
+        )
+        await self._notify_user(key, new_key.access_url)
+        return True
+
+    async def _notify_user(self, key: VpnKey, access_url: str) -> None:
+        from initialization.bot_init import bot
+
+        hours = int(self.grace_period.total_seconds() // 3600)
+        try:
+            await bot.send_message(
+                key.user_telegram_id,
+                f"Ваш ключ «{key.name}» перенесён на менее загруженный сервер.\n\n"
+                f"Новый ключ:\n<code>{access_url}</code>\n\n"
+                f"Старый ключ продолжит работать ещё {hours} ч., "
+                f"после этого замените его в приложении на новый.",
+                parse_mode="HTML",
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось уведомить пользователя {key.user_telegram_id}: {e}")
+
+    async def delete_migrated_keys(self, now: datetime | None = None) -> int:
+        """
+        Удаляет с серверов старые ключи, у которых истёк период ожидания после переноса.
+        :param now: Текущее время (по умолчанию datetime.now())
+        :return: Количество удалённых ключей
+        """
+        from utils.get_processor import get_processor
+
+        deleted = 0
+        now = now or datetime.now()
+        for migration in await self.db_processor.get_due_key_migrations(now):
+            processor = await get_processor(migration.protocol_type)
+            try:
+                deleted_on_server = await processor.delete_key(
+                    migration.old_key_id, server_id=migration.old_server_id
+                )
+            except Exception as e:
+                logger.error(
+                    f"Не удалось удалить перенесённый ключ {migration.old_key_id} "
+                    f"с сервера {migration.old_server_id}: {e}"
+                )
+                continue
+            if not deleted_on_server:
+                logger.error(
+                    f"Сервер {migration.old_server_id} не удалил перенесённый ключ "
+                    f"{migration.old_key_id}, повторим при следующем запуске"
+                )
+                continue
+            await self.db_processor.complete_key_migration(migration.id)
+            deleted += 1
+        return deleted
@@ -0,0 +1,166 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from api_processors import outline_processor as outline_module
+from api_processors import vless_processor as vless_module
+from api_processors.outline_processor import OutlineProcessor
+from api_processors.session_registry import ServerSessionRegistry
+from api_processors.vless_processor import VlessProcessor
+from initialization.db_processor_init import db_processor
+
+
+@pytest.mark.asyncio
+async def test_outline_create_vpn_keys_single_request_per_key(monkeypatch):
+    """Ключ создаётся одним POST с именем и лимитом, без отдельных rename/limit."""
+    requests = []
+
+    async def create_key(request):
+        body = await request.json()
+        requests.append(request.method)
+        return web.json_response(
+            {
+                "id": str(len(requests)),
+                "name": body["name"],
+                "accessUrl": "ss://key",
+                "dataLimit": body["limit"],
+            },
+            status=201,
+        )
+
+    app = web.Application()
+    app.router.add_post("/api/access-keys/", create_key)
+    server = TestServer(app)
+    await server.start_server()
+
+    async def get_server_by_id(server_id):
+        return SimpleNamespace(
+            id=server_id, api_url=str(server.make_url("/api")), cert_sha256=None
+        )
+
+    monkeypatch.setattr(
+        outline_module,
+        "get_db_processor",
+        lambda: SimpleNamespace(get_server_by_id=get_server_by_id),
+    )
+    processor = OutlineProcessor()
+    processor.sessions = ServerSessionRegistry(ssl_factory=lambda signature: False)
+    try:
+        keys = await processor.create_vpn_keys(5, server_id=1, data_limit=100)
+    finally:
+        await processor.close()
+        await server.close()
+
+    assert len(keys) == 5
+    assert len({key.key_id for key in keys}) == 5
+    assert all(key.data_limit == 100 and key.name for key in keys)
+    assert requests == ["POST"] * 5
+
+
+@pytest.mark.asyncio
+async def test_vless_create_vpn_keys_in_one_add_client(monkeypatch):
+    """Все клиенты пачки добавляются одним запросом addClient."""
+    added = []
+
+    async def login(request):
+        response = web.json_response({"success": True})
+        response.set_cookie("3x-ui", "session")
+        return response
+
+    async def inbound_list(request):
+        return web.json_response(
+            {
+                "success": True,
+                "obj": [
+                    {
+                        "id": 1,
+                        "settings": json.dumps({"clients": []}),
+                        "streamSettings": json.dumps({"realitySettings": {}}),
+                    }
+                ],
+            }
+        )
+
+    async def add_client(request):
+        form = await request.post()
+        added.append(json.loads(form["settings"])["clients"])
+        return web.json_response({"success": True})
+
+    app = web.Application()
+    app.router.add_post("/login", login)
+    app.router.add_post("/panel/inbound/list/", inbound_list)
+    app.router.add_post("/panel/inbound/addClient", add_client)
+    server = TestServer(app)
+    await server.start_server()
+
+    monkeypatch.setattr(
+        vless_module.XuiPanel, "host", property(lambda self: str(server.make_url("")))
+    )
+
+    async def get_server_by_id(server_id):
+        return SimpleNamespace(id=server_id, ip="127.0.0.1", password="password")
+
+    monkeypatch.setattr(db_processor, "get_server_by_id", get_server_by_id)
+    monkeypatch.setattr(vless_module, "VLESS_BATCH_SIZE", 4)
+
+    processor = VlessProcessor(ip=None, password=None)
+    try:
+        keys = await processor.create_vpn_keys(6, server_id=1, data_limit=100)
+    finally:
+        await processor.close()
+        await server.close()
+
+    assert len(keys) == 6
+    assert [len(batch) for batch in added] == [4, 2]
+    assert [client["id"] for batch in added for client in batch] == [
+        key.key_id for key in keys
+    ]
+    assert all(key.access_url.startswith(f"vless://{key.key_id}@127.0.0.1") for key in keys)
+
+
+@pytest.mark.asyncio
+async def test_outline_create_vpn_key_fallback_updates_concurrently(monkeypatch):
+    """Если сервер игнорирует имя и лимит при создании, они задаются параллельно."""
+    in_flight = []
+    max_in_flight = 0
+
+    async def create_key(request):
+        return web.json_response({"id": "7", "accessUrl": "ss://key"}, status=201)
+
+    async def update(request):
+        nonlocal max_in_flight
+        in_flight.append(request.path)
+        max_in_flight = max(max_in_flight, len(in_flight))
+        await asyncio.sleep(0.05)
+        in_flight.remove(request.path)
+        return web.Response(status=204)
+
+    app = web.Application()
+    app.router.add_post("/api/access-keys/", create_key)
+    app.router.add_put("/api/access-keys/7/name", update)
+    app.router.add_put("/api/access-keys/7/data-limit", update)
+    server = TestServer(app)
+    await server.start_server()
+
+    processor = OutlineProcessor()
+    processor.sessions = ServerSessionRegistry(ssl_factory=lambda signature: False)
+
+    async def create_server_session(user_id=None):
+        await processor.create_server_session_for_server(
+            SimpleNamespace(id=1, api_url=str(server.make_url("/api")), cert_sha256=None)
+        )
+
+    monkeypatch.setattr(processor, "create_server_session", create_server_session)
+    try:
+        key, server_id = await processor.create_vpn_key(user_id=1, data_limit=100)
+    finally:
+        await processor.close()
+        await server.close()
+
+    assert (key.key_id, key.data_limit, server_id) == (7, 100, 1)
+    assert key.name
+    assert max_in_flight == 2
@@ -0,0 +1,102 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from api_processors import outline_processor as outline_module
+from api_processors import vless_processor as vless_module
+from api_processors.outline_processor import OutlineProcessor
+from api_processors.session_registry import ServerSessionRegistry
+from api_processors.vless_processor import VlessProcessor
+from initialization.db_processor_init import db_processor
+
+
+@pytest.mark.asyncio
+async def test_outline_delete_key_treats_missing_key_as_deleted(monkeypatch):
+    """Ключ, которого уже нет на сервере (404), считается удалённым, ошибка сервера — нет."""
+
+    async def delete(request):
+        status = {"1": 204, "2": 404}.get(request.match_info["key_id"], 500)
+        return web.Response(status=status)
+
+    app = web.Application()
+    app.router.add_delete("/api/access-keys/{key_id}", delete)
+    server = TestServer(app)
+    await server.start_server()
+
+    async def get_server_by_id(server_id):
+        return SimpleNamespace(
+            id=server_id, api_url=str(server.make_url("/api")), cert_sha256=None
+        )
+
+    monkeypatch.setattr(
+        outline_module,
+        "get_db_processor",
+        lambda: SimpleNamespace(get_server_by_id=get_server_by_id),
+    )
+    processor = OutlineProcessor()
+    processor.sessions = ServerSessionRegistry(ssl_factory=lambda signature: False)
+    try:
+        results = [
+            await processor.delete_key(key_id, server_id=1) for key_id in ("1", "2", "3")
+        ]
+    finally:
+        await processor.close()
+        await server.close()
+
+    assert results == [True, True, False]
+
+
+@pytest.mark.asyncio
+async def test_vless_delete_key_treats_missing_client_as_deleted(monkeypatch):
+    """Клиент, которого нет в inbound'ах, считается удалённым; недоступная панель — нет."""
+    panel = {"available": True}
+
+    async def login(request):
+        response = web.json_response({"success": True})
+        response.set_cookie("3x-ui", "session")
+        return response
+
+    async def inbound_list(request):
+        if not panel["available"]:
+            return web.json_response({"success": False})
+        clients = [{"id": "present", "email": "present"}]
+        return web.json_response(
+            {
+                "success": True,
+                "obj": [{"id": 1, "settings": json.dumps({"clients": clients})}],
+            }
+        )
+
+    async def del_client(request):
+        return web.json_response({"success": True})
+
+    app = web.Application()
+    app.router.add_post("/login", login)
+    app.router.add_post("/panel/inbound/list/", inbound_list)
+    app.router.add_post("/panel/inbound/{inbound_id}/delClient/{key_id}", del_client)
+    server = TestServer(app)
+    await server.start_server()
+
+    monkeypatch.setattr(
+        vless_module.XuiPanel, "host", property(lambda self: str(server.make_url("")))
+    )
+
+    async def get_server_by_id(server_id):
+        return SimpleNamespace(id=server_id, ip="127.0.0.1", password="password")
+
+    monkeypatch.setattr(db_processor, "get_server_by_id", get_server_by_id)
+
+    processor = VlessProcessor(ip=None, password=None)
+    try:
+        present = await processor.delete_key("present", server_id=1)
+        missing = await processor.delete_key("missing", server_id=1)
+        panel["available"] = False
+        unavailable = await processor.delete_key("present", server_id=1)
+    finally:
+        await processor.close()
+        await server.close()
+
+    assert (present, missing, unavailable) == (True, True, False)
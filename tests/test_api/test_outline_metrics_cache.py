@@ -0,0 +1,60 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from api_processors import outline_processor as outline_module
+from api_processors.outline_processor import OutlineProcessor
+from api_processors.session_registry import ServerSessionRegistry
+
+
+@pytest.mark.asyncio
+async def test_concurrent_get_key_info_share_one_metrics_request(monkeypatch):
+    """Параллельные запросы ключей одного сервера скачивают метрики один раз."""
+    metrics_requests = []
+
+    async def get_key(request):
+        key_id = request.match_info["key_id"]
+        return web.json_response({"id": key_id, "name": "key", "accessUrl": "ss://key"})
+
+    async def get_metrics(request):
+        metrics_requests.append(request.path)
+        await asyncio.sleep(0.05)
+        return web.json_response({"bytesTransferredByUserId": {"1": 10, "2": 20}})
+
+    app = web.Application()
+    app.router.add_get("/api/access-keys/{key_id}", get_key)
+    app.router.add_get("/api/metrics/transfer", get_metrics)
+    server = TestServer(app)
+    await server.start_server()
+
+    async def get_server_by_id(server_id):
+        return SimpleNamespace(
+            id=server_id, api_url=str(server.make_url("/api")), cert_sha256=None
+        )
+
+    monkeypatch.setattr(
+        outline_module,
+        "get_db_processor",
+        lambda: SimpleNamespace(get_server_by_id=get_server_by_id),
+    )
+    processor = OutlineProcessor()
+    processor.sessions = ServerSessionRegistry(ssl_factory=lambda signature: False)
+    try:
+        keys = await asyncio.gather(
+            *(processor.get_key_info(key_id, server_id=1) for key_id in range(1, 21))
+        )
+        # Свежие метрики берутся из кэша, а замер трафика запрашивает их заново
+        await processor.get_key_info(1, server_id=1)
+        total = await processor.get_transfer_total(server_id=1)
+    finally:
+        await processor.close()
+        await server.close()
+
+    assert [key.used_bytes for key in keys[:3]] == [10, 20, 0]
+    assert total == 30
+    assert len(metrics_requests) == 2
+    assert (processor.metrics_stats.hits, processor.metrics_stats.fetches) == (20, 2)
+    assert processor.metrics_stats.summary() == "из кэша 20, с сервера 2 (90.9% из кэша)"
@@ -0,0 +1,93 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from api_processors import outline_processor as outline_module
+from api_processors.outline_processor import OutlineProcessor
+from api_processors.session_registry import ServerSessionRegistry
+
+
+@pytest.mark.asyncio
+async def test_registry_reuses_and_recreates_sessions():
+    """Сессия переиспользуется для сервера и пересоздаётся при смене параметров."""
+    registry = ServerSessionRegistry(ssl_factory=lambda signature: False)
+    try:
+        first = await registry.get(1, "http://a", "cert")
+        assert await registry.get(1, "http://a", "cert") is first
+        assert registry.get_cached(1) is first
+
+        other = await registry.get(2, "http://b", "cert")
+        assert other.session is not first.session
+
+        changed = await registry.get(1, "http://a", "new-cert")
+        assert changed.session is not first.session
+        assert first.session.closed
+    finally:
+        await registry.close()
+    assert len(registry) == 0
+
+
+@pytest.mark.asyncio
+async def test_registry_evicts_idle_sessions():
+    """Простаивающие сессии закрываются."""
+    registry = ServerSessionRegistry(ssl_factory=lambda signature: False, idle_timeout=0)
+    entry = await registry.get(1, "http://a")
+    await asyncio.sleep(0.01)
+    await registry.evict_idle()
+    assert entry.session.closed
+    assert registry.get_cached(1) is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_use_own_server(monkeypatch):
+    """Параллельные запросы к ключам разных серверов уходят на свои серверы."""
+    requests = []
+
+    async def rename(request):
+        await asyncio.sleep(0.01)
+        requests.append(request.path)
+        return web.Response(status=204)
+
+    app = web.Application()
+    app.router.add_put("/{server}/access-keys/{key_id}/name", rename)
+    server = TestServer(app)
+    await server.start_server()
+
+    servers = {
+        server_id: SimpleNamespace(
+            id=server_id,
+            api_url=str(server.make_url(f"/server{server_id}")),
+            cert_sha256=None,
+        )
+        for server_id in (1, 2)
+    }
+
+    async def get_server_by_id(server_id):
+        return servers[server_id]
+
+    monkeypatch.setattr(
+        outline_module,
+        "get_db_processor",
+        lambda: SimpleNamespace(get_server_by_id=get_server_by_id),
+    )
+    processor = OutlineProcessor()
+    processor.sessions = ServerSessionRegistry(ssl_factory=lambda signature: False)
+    try:
+        results = await asyncio.gather(
+            *(
+                processor.rename_key(f"{server_id}-{i}", "name", server_id=server_id)
+                for i in range(5)
+                for server_id in (1, 2)
+            )
+        )
+    finally:
+        await processor.close()
+        await server.close()
+
+    assert all(results)
+    assert len(requests) == 10
+    assert all(path.split("/")[1] == f"server{path.split('/')[3][0]}" for path in requests)
+    assert processor.session is None
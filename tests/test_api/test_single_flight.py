@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from api_processors.single_flight import SingleFlight, coalesce_requests, request_coalescer
+
+
+class FakeProcessor:
+    protocol_type = "outline"
+
+    def __init__(self):
+        self.calls = []
+
+    @coalesce_requests("get_key_info")
+    async def get_key_info(self, key_id, server_id=None):
+        self.calls.append((key_id, server_id))
+        await asyncio.sleep(0.01)
+        if key_id == "broken":
+            raise ValueError("boom")
+        return {"key_id": key_id}
+
+
+@pytest.mark.asyncio
+async def test_identical_concurrent_calls_are_collapsed():
+    """Одинаковые параллельные запросы выполняются один раз, разные — отдельно."""
+    processor = FakeProcessor()
+    collapsed_before = request_coalescer.stats.collapsed["get_key_info"]
+
+    results = await asyncio.gather(
+        *(processor.get_key_info(1, server_id=3) for _ in range(5)),
+        processor.get_key_info("1", server_id=4),
+        processor.get_key_info(1),
+    )
+
+    assert results[:5] == [{"key_id": 1}] * 5
+    assert set(processor.calls) == {(1, 3), ("1", 4), (1, None)}
+    assert request_coalescer.stats.collapsed["get_key_info"] - collapsed_before == 4
+    assert len(request_coalescer) == 0
+
+    # После завершения запроса следующий уходит на сервер заново
+    await processor.get_key_info(1, server_id=3)
+    assert len(processor.calls) == 4
+
+
+@pytest.mark.asyncio
+async def test_error_and_cancellation_are_shared_safely():
+    """Ошибку получают все ожидающие, отмена одного не отменяет запрос для остальных."""
+    single_flight = SingleFlight()
+    started = asyncio.Event()
+
+    async def fetch():
+        started.set()
+        await asyncio.sleep(0.01)
+        return 42
+
+    first = asyncio.create_task(single_flight.run(("op", 1), fetch))
+    await started.wait()
+    second = asyncio.create_task(single_flight.run(("op", 1), fetch))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == 42
+    assert (single_flight.stats.calls["op"], single_flight.stats.collapsed["op"]) == (1, 1)
+    assert single_flight.stats.summary() == "op: на сервер 1, объединено 1"
+
+    processor = FakeProcessor()
+    results = await asyncio.gather(
+        processor.get_key_info("broken", server_id=1),
+        processor.get_key_info("broken", server_id=1),
+        return_exceptions=True,
+    )
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(processor.calls) == 1
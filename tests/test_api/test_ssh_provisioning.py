@@ -0,0 +1,91 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+
+from api_processors import ssh_provisioning
+from api_processors.ssh_provisioning import ProvisionStep, SshPipeline
+
+
+class FakeConnection:
+    """SSH-соединение, выполняющее шаги в памяти; отметки сохраняются между подключениями."""
+
+    def __init__(self, markers: set[str], fail: set[str]):
+        self.markers = markers
+        self.fail = fail
+        self.commands = []
+        self.running = 0
+        self.max_running = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def run(self, command, input=None, check=False):
+        if command.startswith("mkdir -p"):
+            stdout = "\n".join(f"{name}.done" for name in self.markers)
+            return SimpleNamespace(exit_status=0, stdout=stdout, stderr="")
+        name = command.split("\n")[1]
+        self.commands.append(name)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0)
+        self.running -= 1
+        if name in self.fail:
+            self.fail.discard(name)
+            return SimpleNamespace(exit_status=1, stdout="", stderr="boom")
+        self.markers.add(name)
+        return SimpleNamespace(exit_status=0, stdout=f"{name} ok", stderr="")
+
+
+@pytest.mark.asyncio
+async def test_pipeline_runs_stage_concurrently_and_resumes_after_failure(monkeypatch):
+    """Шаги этапа идут параллельно, повторная попытка пропускает выполненные шаги."""
+    markers = {"already_done"}
+    fail = {"install"}
+    connections = []
+
+    async def connect(**kwargs):
+        connections.append(FakeConnection(markers, fail))
+        return connections[-1]
+
+    monkeypatch.setattr(ssh_provisioning.asyncssh, "connect", connect)
+    monkeypatch.setattr(ssh_provisioning, "send_error_report", AsyncMock())
+    steps = [
+        [ProvisionStep(name, name) for name in ("already_done", "fetch_a", "fetch_b")],
+        [ProvisionStep("install", "install")],
+    ]
+    server = SimpleNamespace(ip="1.2.3.4", password="secret")
+
+    outputs = await SshPipeline(server, steps, poll_interval=0).run()
+
+    assert outputs == {"install": "install ok"}
+    assert connections[0].commands[:2] == ["fetch_a", "fetch_b"]
+    assert connections[0].max_running == 2
+    # Вторая попытка начинается с упавшего шага
+    assert connections[1].commands == ["install"]
+
+
+@pytest.mark.asyncio
+async def test_pipeline_waits_for_ssh(monkeypatch):
+    """Пока SSH недоступен, подключение повторяется, а не считается ошибкой установки."""
+    attempts = []
+
+    async def connect(**kwargs):
+        attempts.append(kwargs["host"])
+        if len(attempts) < 3:
+            raise OSError("Connection refused")
+        return FakeConnection(set(), fail=set())
+
+    monkeypatch.setattr(ssh_provisioning.asyncssh, "connect", connect)
+    server = SimpleNamespace(ip="1.2.3.4", password="secret")
+
+    outputs = await SshPipeline(
+        server, [[ProvisionStep("install", "install")]], max_attempts=1, poll_interval=0
+    ).run()
+
+    assert outputs == {"install": "install ok"}
+    assert len(attempts) == 3
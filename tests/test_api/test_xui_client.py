@@ -0,0 +1,144 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from api_processors import vless_processor as vless_module
+from api_processors.vless_processor import VlessProcessor
+from initialization.db_processor_init import db_processor
+
+
+def make_panel_app(clients: list[dict], calls: dict) -> web.Application:
+    """Минимальная панель 3x-ui: логин через cookie и список inbound'ов."""
+
+    async def login(request):
+        calls["login"] += 1
+        await asyncio.sleep(0.01)
+        response = web.json_response({"success": True})
+        response.set_cookie("3x-ui", f"session-{calls['login']}")
+        return response
+
+    async def inbound_list(request):
+        calls["list"] += 1
+        if request.cookies.get("3x-ui") != f"session-{calls['login']}":
+            # Сессия на стороне панели истекла
+            raise web.HTTPUnauthorized()
+        await asyncio.sleep(0.05)
+        return web.json_response(
+            {
+                "success": True,
+                "obj": [
+                    {
+                        "id": 1,
+                        "port": 443,
+                        "settings": json.dumps({"clients": clients}),
+                        "streamSettings": json.dumps({"realitySettings": {}}),
+                        "clientStats": [
+                            {"email": client["email"], "up": 10, "down": 5}
+                            for client in clients
+                        ],
+                    }
+                ],
+            }
+        )
+
+    async def update_client(request):
+        calls["update"] += 1
+        return web.json_response({"success": True})
+
+    app = web.Application()
+    app.router.add_post("/login", login)
+    app.router.add_post("/panel/inbound/list/", inbound_list)
+    app.router.add_post("/panel/inbound/updateClient/{key_id}", update_client)
+    return app
+
+
+@pytest_asyncio.fixture
+async def panel(monkeypatch):
+    """Тестовая панель 3x-ui и процессор, который к ней подключается."""
+    clients = [{"id": "key-1", "email": "key-1", "comment": "name", "totalGB": 100}]
+    calls = {"login": 0, "list": 0, "update": 0}
+    server = TestServer(make_panel_app(clients, calls))
+    await server.start_server()
+
+    monkeypatch.setattr(
+        vless_module.XuiPanel, "host", property(lambda self: str(server.make_url("")))
+    )
+
+    async def get_server_by_id(server_id):
+        return SimpleNamespace(id=server_id, ip="127.0.0.1", password="password")
+
+    monkeypatch.setattr(db_processor, "get_server_by_id", get_server_by_id)
+
+    processor = VlessProcessor(ip=None, password=None)
+    try:
+        yield processor, calls
+    finally:
+        await processor.close()
+        await server.close()
+
+
+@pytest.mark.asyncio
+async def test_vless_requests_do_not_block_event_loop(panel):
+    """Запросы к панели асинхронны, логин выполняется один раз на сессию сервера."""
+    processor, calls = panel
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.005)
+
+    ticker_task = asyncio.create_task(ticker())
+    try:
+        keys = await asyncio.gather(
+            *(processor.get_key_info("key-1", server_id=1) for _ in range(3))
+        )
+    finally:
+        ticker_task.cancel()
+
+    assert [key.used_bytes for key in keys] == [15, 15, 15]
+    assert keys[0].data_limit == 100
+    assert ticks > 5
+    # Параллельные операции дожидаются одного логина
+    assert calls["login"] == 1
+    assert processor.login_stats.misses == 1
+    assert processor.login_stats.hits > 0
+
+
+@pytest.mark.asyncio
+async def test_vless_relogin_after_session_expired(panel):
+    """После 401 от панели выполняется один повторный логин, и запрос повторяется."""
+    processor, calls = panel
+    assert await processor.get_key_info("key-1", server_id=1) is not None
+
+    # Панель "забыла" сессию: следующий логин выдаст новый cookie
+    calls["login"] += 1
+    keys = await processor.get_keys(server_id=1)
+
+    assert [key.key_id for key in keys] == ["key-1"]
+    assert calls["login"] == 3
+    assert processor.login_stats.relogins == 1
+    assert processor.login_stats.summary().endswith("повторные логины 1")
+
+
+@pytest.mark.asyncio
+async def test_vless_operations_share_inbound_snapshot(panel):
+    """Операции с ключами используют один снимок inbound'ов до изменения на панели."""
+    processor, calls = panel
+    key = await processor.get_key_info("key-1", server_id=1)
+    assert key.access_url.startswith("vless://key-1@127.0.0.1:443")
+    assert await processor.get_key_info("key-1", server_id=1) is not None
+    assert await processor.get_key_info("unknown", server_id=1) is None
+    # Один запрос на снимок и один повторный — для ключа, которого нет в снимке
+    assert calls["list"] == 2
+
+    assert await processor.rename_key("key-1", server_id=1, new_key_name="new")
+    assert await processor.get_key_info("key-1", server_id=1) is not None
+    # Запись на панель сбрасывает снимок
+    assert calls["list"] == 3
@@ -0,0 +1,44 @@
+import time
+from unittest.mock import AsyncMock
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+
+from bot.utils import send_message
+from bot.utils.rate_limiter import RateLimiter
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_spaces_calls():
+    """Вызовы acquire() распределяются с заданной частотой."""
+    limiter = RateLimiter(50)
+    start = time.monotonic()
+    for _ in range(6):
+        await limiter.acquire()
+    assert time.monotonic() - start >= 5 / 50 * 0.9
+
+
+@pytest.mark.asyncio
+async def test_send_messages_subscription_expired_retries_after_flood(monkeypatch):
+    """Уведомление повторяется после TelegramRetryAfter, ошибки не прерывают рассылку."""
+    calls = []
+
+    async def fake_send(user_tg_id, keys):
+        calls.append(user_tg_id)
+        if user_tg_id == "flood" and calls.count("flood") == 1:
+            raise TelegramRetryAfter(method=None, message="Too Many Requests", retry_after=0)
+        if user_tg_id == "broken":
+            raise RuntimeError("network error")
+
+    monkeypatch.setattr(
+        send_message, "send_message_subscription_expired", AsyncMock(side_effect=fake_send)
+    )
+
+    keys_by_user = {
+        user_id: {"key": ("name", 1)} for user_id in ("1", "flood", "broken", "2")
+    }
+    sent = await send_message.send_messages_subscription_expired(keys_by_user, rate=1000)
+
+    assert sent == 3
+    assert calls.count("flood") == 2
+    assert calls.count("broken") == 1
@@ -0,0 +1,43 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from api_processors.key_models import OutlineKey
+from database.db_processor import DbProcessor
+from database.models import Base
+
+
+@pytest.fixture
+def db_processor(tmp_path):
+    """Создаёт экземпляр DbProcessor с временной файловой базой."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", echo=False)
+    Base.metadata.create_all(engine)
+    processor = DbProcessor()
+    processor.engine = engine
+    processor.Session = sessionmaker(bind=engine, expire_on_commit=False)
+    yield processor
+    engine.dispose()
+
+
+@pytest.fixture
+def make_outline_key():
+    """Фабрика ключей Outline, какими их возвращает процессор."""
+
+    def make(
+        key_id: int | str,
+        name: str | None = None,
+        data_limit: int | None = 200 * 1024**3,
+        used_bytes: int = 0,
+    ) -> OutlineKey:
+        return OutlineKey(
+            key_id=key_id,
+            name=name or f"key {key_id}",
+            password=None,
+            port=None,
+            method=None,
+            access_url=f"ss://{key_id}",
+            data_limit=data_limit,
+            used_bytes=used_bytes,
+        )
+
+    return make
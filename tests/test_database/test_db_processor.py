@@ -0,0 +1,137 @@
+from sqlalchemy import text
+
+from database.engine import SqliteProfile, create_db_engine
+from database.migrations import MIGRATIONS, run_migrations
+
+
+def test_sqlite_profile_pragmas(tmp_path):
+    """Профиль SQLite применяется к каждому новому соединению."""
+    profile = SqliteProfile(busy_timeout_ms=1234, cache_size_kib=2048)
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'test.db'}", profile)
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert connection.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert connection.execute(text("PRAGMA busy_timeout")).scalar() == 1234
+        assert connection.execute(text("PRAGMA cache_size")).scalar() == -2048
+    assert engine.echo is False
+    engine.dispose()
+
+
+def test_sqlite_profile_from_env(monkeypatch):
+    """DB_PROFILE=development включает echo, остальные значения берутся из окружения."""
+    monkeypatch.setenv("DB_PROFILE", "development")
+    monkeypatch.setenv("SQLITE_BUSY_TIMEOUT_MS", "100")
+    profile = SqliteProfile.from_env()
+    assert profile.echo is True
+    assert profile.busy_timeout_ms == 100
+    assert profile.journal_mode == "WAL"
+
+
+def test_read_while_write_transaction_is_open(tmp_path):
+    """В режиме WAL чтение не блокируется открытой транзакцией записи."""
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'test.db'}", SqliteProfile())
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE t (id INTEGER)"))
+
+    with engine.connect() as writer, engine.connect() as reader:
+        writer.execute(text("BEGIN IMMEDIATE"))
+        writer.execute(text("INSERT INTO t VALUES (1)"))
+        assert reader.execute(text("SELECT COUNT(*) FROM t")).scalar() == 0
+        writer.execute(text("COMMIT"))
+    engine.dispose()
+
+
+def test_migrations_add_indexes_to_existing_database(tmp_path):
+    """Миграции добавляют индексы в базу, созданную до их появления, и применяются один раз."""
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'test.db'}", SqliteProfile())
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE servers "
+                "(id INTEGER PRIMARY KEY, cnt_users INTEGER, protocol_type VARCHAR)"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE TABLE keys (key_id VARCHAR PRIMARY KEY, user_telegram_id VARCHAR, "
+                "server_id INTEGER, expiration_date DATETIME, protocol_type VARCHAR)"
+            )
+        )
+        connection.execute(text("INSERT INTO servers VALUES (1, 0, 'Outline')"))
+
+    assert run_migrations(engine) == MIGRATIONS[-1].version
+    assert run_migrations(engine) == MIGRATIONS[-1].version
+
+    with engine.connect() as connection:
+        indexes = {
+            row[1] for row in connection.execute(text("PRAGMA index_list('keys')"))
+        } | {
+            row[1] for row in connection.execute(text("PRAGMA index_list('servers')"))
+        }
+        protocol_type = connection.execute(
+            text("SELECT protocol_type FROM servers")
+        ).scalar()
+    assert {
+        "ix_keys_user_telegram_id",
+        "ix_keys_server_id",
+        "ix_keys_expiration_date",
+        "ix_keys_protocol_type",
+        "ix_servers_protocol_type_cnt_users",
+    } <= indexes
+    assert protocol_type == "outline"
+    engine.dispose()
+
+
+def test_migration_adds_server_status(tmp_path):
+    """Существующие серверы получают состояние active; на новой базе столбец не дублируется."""
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'test.db'}", SqliteProfile())
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE servers "
+                "(id INTEGER PRIMARY KEY, cnt_users INTEGER, protocol_type VARCHAR)"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE TABLE keys (key_id VARCHAR PRIMARY KEY, user_telegram_id VARCHAR, "
+                "server_id INTEGER, expiration_date DATETIME, protocol_type VARCHAR)"
+            )
+        )
+        connection.execute(text("INSERT INTO servers VALUES (1, 0, 'outline')"))
+
+    run_migrations(engine)
+
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT status FROM servers")).scalar() == "active"
+    engine.dispose()
+
+
+def test_migration_backfills_server_capacity(tmp_path):
+    """Вместимость существующих серверов заполняется по прежнему правилу 100/200."""
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'test.db'}", SqliteProfile())
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE servers "
+                "(id INTEGER PRIMARY KEY, cnt_users INTEGER, protocol_type VARCHAR)"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE TABLE keys (key_id VARCHAR PRIMARY KEY, user_telegram_id VARCHAR, "
+                "server_id INTEGER, expiration_date DATETIME, protocol_type VARCHAR)"
+            )
+        )
+        connection.execute(
+            text("INSERT INTO servers VALUES (1, 0, 'outline'), (3, 0, 'outline')")
+        )
+
+    run_migrations(engine)
+
+    with engine.connect() as connection:
+        rows = connection.execute(
+            text("SELECT id, max_users, weight FROM servers ORDER BY id")
+        ).all()
+    assert [tuple(row) for row in rows] == [(1, 100, 1.0), (3, 200, 1.0)]
+    engine.dispose()
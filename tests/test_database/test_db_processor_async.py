@@ -0,0 +1,478 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database.db_processor import DbProcessor
+from database import placement as placement_module
+from database.placement import (
+    BandwidthAwarePlacement,
+    BinPackingPlacement,
+    LeastLoadedPlacement,
+)
+from database.models import Server, VpnKey
+
+
+@pytest.mark.asyncio
+async def test_methods_run_outside_event_loop_thread(db_processor):
+    """Запросы к БД выполняются в отдельном потоке, а не в потоке event loop."""
+    threads = []
+
+    def get_thread_name(_):
+        threads.append(threading.current_thread().name)
+
+    await db_processor.run_sync(get_thread_name, None)
+    assert threads[0] != threading.current_thread().name
+
+
+@pytest.mark.asyncio
+async def test_update_database_with_key_and_get_key(db_processor, make_outline_key):
+    """Ключ, добавленный через update_database_with_key, доступен по ID."""
+    await db_processor.update_database_with_key(
+        12345, make_outline_key("1"), "1 month", server_id=1
+    )
+
+    key = await db_processor.get_key_by_id("1")
+    assert key is not None
+    assert key.user_telegram_id == "12345"
+    assert await db_processor.get_vpn_type_by_key_id("1") == "outline"
+    assert [k.key_id for k in await db_processor.get_keys_by_user_id(12345)] == ["1"]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writes_are_serialized(db_processor, make_outline_key):
+    """Параллельные записи не теряются и не блокируют друг друга."""
+    await asyncio.gather(
+        *(
+            db_processor.update_database_with_key(
+                user_id, make_outline_key(str(user_id)), "1 month", server_id=1
+            )
+            for user_id in range(20)
+        )
+    )
+    assert len(await db_processor.get_all_user_ids()) == 20
+
+
+@pytest.mark.asyncio
+async def test_remove_key_decrements_server_users(db_processor):
+    """Удаление ключа уменьшает количество пользователей на сервере."""
+    with db_processor.session_scope() as session:
+        session.add(Server(id=1, cnt_users=1, protocol_type="outline"))
+        session.add(
+            VpnKey(
+                key_id="1",
+                server_id=1,
+                protocol_type="outline",
+                start_date=datetime(2025, 1, 1),
+                expiration_date=datetime(2025, 2, 1),
+            )
+        )
+
+    assert await db_processor._remove_keys(["1"], 1) == 1
+
+    assert await db_processor.get_key_by_id("1") is None
+    server = await db_processor.get_server_by_id(1)
+    assert server.cnt_users == 0
+
+
+@pytest.mark.asyncio
+async def test_get_expired_keys_filters_by_date(db_processor):
+    """Выбираются только ключи, истекающие сегодня или раньше."""
+    today = datetime(2025, 3, 10)
+    with db_processor.session_scope() as session:
+        for key_id, expiration_date in (
+            ("past", datetime(2025, 3, 1, 12)),
+            ("today", datetime(2025, 3, 10, 23)),
+            ("tomorrow", datetime(2025, 3, 11, 0)),
+        ):
+            session.add(
+                VpnKey(
+                    key_id=key_id,
+                    server_id=1,
+                    protocol_type="outline",
+                    start_date=datetime(2025, 1, 1),
+                    expiration_date=expiration_date,
+                )
+            )
+
+    keys = await db_processor._get_expired_keys(today)
+    assert sorted(key.key_id for key in keys) == ["past", "today"]
+
+
+@pytest.mark.asyncio
+async def test_check_and_delete_expired_keys_groups_by_server(db_processor, monkeypatch):
+    """Истекшие ключи удаляются с серверов и из БД, ошибка или отказ сервера не удаляет ключ из БД."""
+    expired = datetime.now() - timedelta(days=1)
+    with db_processor.session_scope() as session:
+        for server_id, cnt_users in ((1, 3), (2, 2)):
+            session.add(Server(id=server_id, cnt_users=cnt_users, protocol_type="outline"))
+        for key_id, server_id in (("a", 1), ("b", 1), ("c", 2), ("broken", 2), ("kept", 1)):
+            session.add(
+                VpnKey(
+                    key_id=key_id,
+                    server_id=server_id,
+                    protocol_type="outline",
+                    start_date=expired,
+                    expiration_date=expired,
+                )
+            )
+
+    async def delete_key(key_id, server_id=None):
+        if key_id == "broken":
+            raise RuntimeError("server is down")
+        return key_id != "kept"
+
+    processor = AsyncMock()
+    processor.delete_key.side_effect = delete_key
+    monkeypatch.setattr(
+        "utils.get_processor.get_processor", AsyncMock(return_value=processor)
+    )
+
+    await db_processor.check_and_delete_expired_keys()
+
+    assert processor.delete_key.await_count == 5
+    with db_processor.session_scope() as session:
+        assert sorted(key_id for key_id, in session.query(VpnKey.key_id)) == ["broken", "kept"]
+    assert (await db_processor.get_server_by_id(1)).cnt_users == 1
+    assert (await db_processor.get_server_by_id(2)).cnt_users == 1
+
+
+@pytest.mark.asyncio
+async def test_get_expiring_keys(db_processor):
+    """В выборку попадают ключи, истекающие через 1-2 дня, с числом оставшихся дней."""
+    today = datetime(2025, 3, 10)
+    with db_processor.session_scope() as session:
+        for key_id, user_id, expiration_date in (
+            ("today", "1", datetime(2025, 3, 10, 12)),
+            ("one_day", "1", datetime(2025, 3, 11, 0)),
+            ("two_days", "2", datetime(2025, 3, 12, 23)),
+            ("three_days", "2", datetime(2025, 3, 13, 0)),
+        ):
+            session.add(
+                VpnKey(
+                    key_id=key_id,
+                    name=key_id,
+                    user_telegram_id=user_id,
+                    server_id=1,
+                    protocol_type="outline",
+                    start_date=datetime(2025, 1, 1),
+                    expiration_date=expiration_date,
+                )
+            )
+
+    rows = await db_processor._get_expiring_keys(today)
+    assert rows == [("1", "one_day", "one_day", 1), ("2", "two_days", "two_days", 2)]
+    assert await db_processor._get_expiring_keys(today, user_id=2) == [
+        ("2", "two_days", "two_days", 2)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_get_keys_due_for_data_limit_update(db_processor):
+    """Выбираются действующие ключи, у которых сегодня начинается новый месяц подписки."""
+    today = datetime(2025, 3, 31)
+    with db_processor.session_scope() as session:
+        for key_id, start_date, expiration_date in (
+            ("due", datetime(2025, 3, 1, 18), datetime(2025, 5, 1)),
+            ("due2", datetime(2025, 1, 30, 9), datetime(2025, 5, 1)),
+            ("started_today", datetime(2025, 3, 31, 1), datetime(2025, 5, 1)),
+            ("not_due", datetime(2025, 3, 2), datetime(2025, 5, 1)),
+            ("expired", datetime(2025, 3, 1), datetime(2025, 3, 30)),
+        ):
+            session.add(
+                VpnKey(
+                    key_id=key_id,
+                    server_id=1,
+                    protocol_type="outline",
+                    start_date=start_date,
+                    expiration_date=expiration_date,
+                )
+            )
+
+    keys = await db_processor._get_keys_due_for_data_limit_update(today)
+    assert sorted(key.key_id for key in keys) == ["due", "due2"]
+
+
+@pytest.mark.asyncio
+async def test_check_and_update_key_data_limit_uses_server_snapshot(
+    db_processor, monkeypatch, make_outline_key
+):
+    """Расход берётся из одного снимка на сервер, лимит растёт на трафик за месяц."""
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    with db_processor.session_scope() as session:
+        for key_id, start_days_ago in (("due", 30), ("due2", 60), ("not_due", 10)):
+            session.add(
+                VpnKey(
+                    key_id=key_id,
+                    server_id=1,
+                    protocol_type="outline",
+                    start_date=today - timedelta(days=start_days_ago),
+                    expiration_date=today + timedelta(days=30),
+                    used_bytes_last_month=100 if key_id == "due2" else 0,
+                )
+            )
+
+    processor = AsyncMock()
+    processor.get_keys.return_value = [
+        make_outline_key(key_id) for key_id in ("1", "2", "3")
+    ]
+    for key_info, key_id in zip(processor.get_keys.return_value, ("due", "due2", "not_due")):
+        key_info.key_id = key_id
+        key_info.data_limit = 1000
+        key_info.used_bytes = 300
+    processor.update_data_limits.side_effect = lambda limits, **kwargs: {
+        key_id: True for key_id in limits
+    }
+    monkeypatch.setattr(
+        "utils.get_processor.get_processor", AsyncMock(return_value=processor)
+    )
+
+    await db_processor.check_and_update_key_data_limit()
+
+    processor.get_keys.assert_awaited_once_with(server_id=1)
+    limits = processor.update_data_limits.await_args.args[0]
+    assert limits == {"due": 1300, "due2": 1200}
+    assert (await db_processor.get_key_by_id("due2")).used_bytes_last_month == 300
+    assert (await db_processor.get_key_by_id("not_due")).used_bytes_last_month == 0
+
+
+@pytest.mark.asyncio
+async def test_spare_capacity_ignores_servers_being_installed(db_processor):
+    """Устанавливаемые и сломанные серверы не выбираются для ключей и не входят в резерв."""
+    with db_processor.session_scope() as session:
+        session.add(Server(id=1, cnt_users=100, protocol_type="outline"))
+        session.add(Server(id=3, cnt_users=50, protocol_type="outline"))
+        session.add(Server(id=4, cnt_users=0, protocol_type="outline", status="provisioning"))
+        session.add(Server(id=5, cnt_users=0, protocol_type="outline", status="failed"))
+
+    assert await db_processor.get_spare_capacity("outline") == 150
+    server = await db_processor.reserve_server("outline")
+    assert (server.id, server.cnt_users) == (3, 51)
+
+
+@pytest.mark.asyncio
+async def test_fill_rate_from_load_samples(db_processor):
+    """Скорость заполнения считается по первому и последнему замеру в окне."""
+    now = datetime.now()
+    with db_processor.session_scope() as session:
+        server = Server(id=3, cnt_users=10, protocol_type="vless")
+        session.add(server)
+    await db_processor.record_server_load(now - timedelta(hours=2))
+    with db_processor.session_scope() as session:
+        session.query(Server).filter_by(id=3).update({Server.cnt_users: 110})
+    await db_processor.record_server_load(now)
+
+    assert await db_processor.get_fill_rate("vless") == pytest.approx(50)
+    assert await db_processor.get_fill_rate("outline") == 0
+
+
+@pytest.mark.parametrize(
+    "spare_slots, provisioning, fill_rate, expected",
+    [
+        (0, 0, 0, 0),  # без заполнения резерв по умолчанию не нужен
+        (199, 0, 50, 0),  # 50 польз./час * 2 часа = 100 мест, свободных хватает
+        (450, 0, 300, 1),  # 300 польз./час * 2 часа = 600 мест, не хватает 150
+        (200, 1, 300, 1),  # устанавливаемый сервер засчитывается
+        (0, 0, 10_000, 3),  # не больше SERVER_STANDBY_MAX
+    ],
+)
+def test_count_servers_to_provision(spare_slots, provisioning, fill_rate, expected):
+    assert (
+        DbProcessor.count_servers_to_provision(spare_slots, provisioning, fill_rate)
+        == expected
+    )
+
+
+def test_count_servers_to_provision_with_standby_min(monkeypatch):
+    """Минимальный резерв сравнивается со свободными местами, а не с числом пустых серверов."""
+    monkeypatch.setattr("database.db_processor.SERVER_STANDBY_MIN", 1)
+
+    assert DbProcessor.count_servers_to_provision(0, 0, 0) == 1
+    assert DbProcessor.count_servers_to_provision(250, 0, 0) == 0
+    assert DbProcessor.count_servers_to_provision(0, 1, 0) == 0
+
+
+@pytest.mark.asyncio
+async def test_check_count_keys_on_servers_provisions_standby(db_processor, monkeypatch):
+    """Для протокола без свободных мест создаётся резервный сервер."""
+    monkeypatch.setattr("database.db_processor.SERVER_STANDBY_MIN", 1)
+    with db_processor.session_scope() as session:
+        session.add(Server(id=3, cnt_users=0, protocol_type="outline"))
+        session.add(Server(id=4, cnt_users=200, protocol_type="vless"))
+
+    provision_server = AsyncMock(return_value=Server(id=5))
+    monkeypatch.setattr(db_processor, "provision_server", provision_server)
+
+    await db_processor.check_count_keys_on_servers()
+    await asyncio.gather(*db_processor._provisioning_tasks["vless"])
+
+    provision_server.assert_awaited_once_with("vless", 2)
+
+
+@pytest.mark.asyncio
+async def test_server_selection_does_not_wait_for_other_protocol_provisioning(
+    db_processor, monkeypatch
+):
+    """Пока создаётся сервер VLESS, ключи Outline выдаются сразу; ожидающие VLESS получают новый сервер."""
+    with db_processor.session_scope() as session:
+        session.add(Server(id=3, cnt_users=0, protocol_type="outline"))
+        session.add(Server(id=4, cnt_users=200, protocol_type="vless"))
+
+    release = asyncio.Event()
+
+    async def provision_server(protocol_type, count_servers):
+        await release.wait()
+        with db_processor.session_scope() as session:
+            session.add(Server(id=5, cnt_users=0, protocol_type="vless"))
+        return Server(id=5)
+
+    monkeypatch.setattr(db_processor, "provision_server", provision_server)
+    monkeypatch.setattr("initialization.bot_init.bot", AsyncMock())
+
+    waiters = [
+        asyncio.create_task(db_processor.get_server_with_min_users("vless", user_id=1))
+        for _ in range(3)
+    ]
+    await asyncio.sleep(0.1)
+    outline_server = await asyncio.wait_for(
+        db_processor.get_server_with_min_users("outline"), timeout=1
+    )
+    assert outline_server.id == 3
+    assert len(db_processor._provisioning_tasks["vless"]) == 1
+
+    release.set()
+    assert [server.id for server in await asyncio.gather(*waiters)] == [5, 5, 5]
+    assert (await db_processor.get_server_by_id(5)).cnt_users == 3
+
+
+@pytest.mark.asyncio
+async def test_reservation_never_exceeds_capacity(db_processor, tmp_path):
+    """Параллельные резервирования из двух процессоров БД не превышают вместимость сервера."""
+    with db_processor.session_scope() as session:
+        session.add(Server(id=3, cnt_users=190, protocol_type="outline"))
+
+    other = DbProcessor()
+    other.engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", echo=False)
+    other.Session = sessionmaker(bind=other.engine, expire_on_commit=False)
+
+    servers = await asyncio.gather(
+        *(
+            processor.reserve_server("outline")
+            for processor in (db_processor, other) * 10
+        )
+    )
+
+    assert sum(server is not None for server in servers) == 10
+    assert (await db_processor.get_server_by_id(3)).cnt_users == 200
+    other.engine.dispose()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "placement, expected_server_id",
+    [
+        # 150/400 = 0.375 против 60/100 = 0.6 и 10/200 при весе 0.01
+        (LeastLoadedPlacement(), 4),
+        # у сервера 3 осталось меньше всего свободных мест
+        (BinPackingPlacement(), 3),
+    ],
+)
+async def test_placement_strategies(db_processor, placement, expected_server_id):
+    """Стратегия выбора сервера учитывает вместимость и вес сервера."""
+    with db_processor.session_scope() as session:
+        session.add(Server(id=3, cnt_users=60, max_users=100, protocol_type="outline"))
+        session.add(Server(id=4, cnt_users=150, max_users=400, protocol_type="outline"))
+        session.add(
+            Server(id=5, cnt_users=10, max_users=200, weight=0.01, protocol_type="outline")
+        )
+    db_processor.placement = placement
+
+    server = await db_processor.reserve_server("outline")
+    assert server.id == expected_server_id
+
+
+def test_unknown_server_plan_falls_back_to_configured_capacity(monkeypatch):
+    """Тариф, которого нет в SERVER_PLANS, не ломает выбор сервера: вместимость берётся из конфига."""
+    monkeypatch.setattr(placement_module, "SERVER_PLAN_ID", 999)
+    monkeypatch.setattr(placement_module, "SERVER_MAX_USERS", 150)
+
+    plan = placement_module._resolve_server_plan()
+
+    assert (plan.plan_id, plan.max_users, plan.bandwidth_budget) == (999, 150, None)
+
+
+@pytest.mark.asyncio
+async def test_sample_server_traffic_and_bandwidth_aware_placement(db_processor, monkeypatch):
+    """Скорость трафика считается по замерам, новый ключ попадает на сервер с запасом канала."""
+    with db_processor.session_scope() as session:
+        for server_id in (3, 4):
+            session.add(
+                Server(
+                    id=server_id,
+                    cnt_users=10 if server_id == 3 else 100,
+                    max_users=200,
+                    bandwidth_budget=30 * 24 * 3600 * 1000,  # 1000 байт/с в среднем
+                    protocol_type="outline",
+                )
+            )
+
+    totals = {3: 0, 4: 0}
+    processor = AsyncMock()
+    processor.get_transfer_total.side_effect = lambda server_id: totals[server_id]
+    monkeypatch.setattr(
+        "utils.get_processor.get_processor", AsyncMock(return_value=processor)
+    )
+
+    await db_processor.sample_server_traffic()
+    # Через 100 секунд: сервер 3 передал 90 000 байт (900 байт/с), сервер 4 — 10 000 (100 байт/с)
+    with db_processor.session_scope() as session:
+        session.query(Server).update(
+            {Server.traffic_sampled_at: datetime.now() - timedelta(seconds=100)},
+            synchronize_session=False,
+        )
+    totals.update({3: 90_000, 4: 10_000})
+    await db_processor.sample_server_traffic()
+
+    assert (await db_processor.get_server_by_id(3)).traffic_rate == pytest.approx(900, rel=0.01)
+    assert (await db_processor.get_server_by_id(4)).traffic_rate == pytest.approx(100, rel=0.01)
+
+    db_processor.placement = BandwidthAwarePlacement()
+    server = await db_processor.reserve_server("outline")
+    assert server.id == 4
+
+    # Сброс счётчика не даёт отрицательной скорости
+    totals[4] = 0
+    await db_processor.sample_server_traffic()
+    assert (await db_processor.get_server_by_id(4)).traffic_rate == pytest.approx(100, rel=0.01)
+
+
+@pytest.mark.asyncio
+async def test_create_new_server_queries_vdsina_off_event_loop(db_processor, monkeypatch):
+    """Синхронные запросы IP и пароля к VDSina выполняются вне потока цикла событий."""
+    loop_thread = threading.get_ident()
+    threads = []
+
+    def get_server_ip(server_id):
+        threads.append(threading.get_ident())
+        return "1.2.3.4"
+
+    def get_server_password(server_id):
+        threads.append(threading.get_ident())
+        return "secret"
+
+    monkeypatch.setattr(
+        "database.db_processor.vdsina_processor.create_new_server",
+        AsyncMock(return_value={"status": "ok", "data": {"id": 5}}),
+    )
+    monkeypatch.setattr(db_processor, "wait_for_server_ready", AsyncMock(return_value=True))
+    monkeypatch.setattr(db_processor, "get_server_ip", get_server_ip)
+    monkeypatch.setattr(db_processor, "get_server_password", get_server_password)
+
+    _, server_ip, server_password = await db_processor.create_new_server(1)
+
+    assert (server_ip, server_password) == ("1.2.3.4", "secret")
+    assert len(threads) == 2 and loop_thread not in threads
@@ -0,0 +1,101 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+
+from database.models import Server
+from utils.key_pool import KeyPool
+
+
+@pytest.fixture
+def vpn_processor(monkeypatch, make_outline_key):
+    """Процессор, создающий ключи с последовательными ID; 3-й ключ не создаётся."""
+    processor = AsyncMock()
+
+    async def create_vpn_keys(count, server_id=None, data_limit=None):
+        keys = []
+        for _ in range(count):
+            create_vpn_keys.next_id += 1
+            if create_vpn_keys.next_id != 3:
+                keys.append(make_outline_key(create_vpn_keys.next_id))
+        return keys
+
+    create_vpn_keys.next_id = 0
+    processor.create_vpn_keys.side_effect = create_vpn_keys
+    monkeypatch.setattr(
+        "utils.get_processor.get_processor", AsyncMock(return_value=processor)
+    )
+    return processor
+
+
+@pytest.mark.asyncio
+async def test_refill_reserves_slots_and_releases_failed(db_processor, vpn_processor):
+    """Пул пополняется до целевого размера, места под несозданные ключи освобождаются."""
+    with db_processor.session_scope() as session:
+        session.add(Server(id=1, cnt_users=97, protocol_type="outline"))
+        session.add(Server(id=3, cnt_users=198, protocol_type="outline"))
+
+    pool = KeyPool(db_processor, target_size=5, low_watermark=2, refill_batch=10)
+    assert await pool.refill("outline") == 5
+
+    assert await db_processor.count_pooled_keys("outline") == 5
+    # Место под несозданный ключ вернулось и было занято следующей пачкой
+    assert (await db_processor.get_server_by_id(1)).cnt_users == 100
+    assert (await db_processor.get_server_by_id(3)).cnt_users == 200
+    assert await pool.refill("outline") == 0
+
+
+@pytest.mark.asyncio
+async def test_get_key_claims_from_pool_and_applies_limit(
+    db_processor, vpn_processor, make_outline_key
+):
+    """Ключ выдаётся из пула без создания на сервере, лимит пробного ключа выставляется."""
+    await db_processor.add_pooled_keys(
+        [make_outline_key(7), make_outline_key(8)], server_id=1, protocol_type="outline"
+    )
+    pool = KeyPool(db_processor, target_size=2, low_watermark=0)
+
+    key, server_id = await pool.get_key("Outline", user_id=1, data_limit=10 * 1024**3)
+
+    assert (key.key_id, server_id, key.data_limit) == (7, 1, 10 * 1024**3)
+    vpn_processor.create_vpn_key.assert_not_awaited()
+    # Лимит применяется в фоне после выдачи ключа
+    await asyncio.gather(*pool._background_tasks)
+    vpn_processor.update_data_limit.assert_awaited_once_with("7", 10 * 1024**3, server_id=1)
+    assert await db_processor.get_pending_key_limits() == []
+    assert await db_processor.count_pooled_keys("outline") == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_limit_update_is_retried(db_processor, vpn_processor, make_outline_key):
+    """Неприменённый лимит сохраняется в БД и повторяется при пополнении пула новым экземпляром."""
+    await db_processor.add_pooled_keys(
+        [make_outline_key(7)], server_id=1, protocol_type="outline"
+    )
+    vpn_processor.update_data_limit.side_effect = [False, True]
+    pool = KeyPool(db_processor, target_size=1, low_watermark=0)
+
+    key, _ = await pool.get_key("outline", user_id=1, data_limit=10 * 1024**3)
+    await asyncio.gather(*pool._background_tasks)
+
+    assert key.data_limit == 10 * 1024**3
+    pending = await db_processor.get_pending_key_limits()
+    assert [(p.server_id, p.key_id, p.data_limit) for p in pending] == [(1, "7", 10 * 1024**3)]
+    # После перезапуска бота лимит применяет новый экземпляр пула
+    await KeyPool(db_processor, target_size=1, low_watermark=0).refill_all()
+    assert await db_processor.get_pending_key_limits() == []
+    assert vpn_processor.update_data_limit.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_get_key_falls_back_to_creation(db_processor, vpn_processor, make_outline_key):
+    """Если пул выключен, ключ создаётся на сервере как раньше."""
+    vpn_processor.create_vpn_key.return_value = (make_outline_key(1), 3)
+    pool = KeyPool(db_processor, target_size=0)
+
+    key, server_id = await pool.get_key("outline", user_id=1)
+
+    assert (key.key_id, server_id) == (1, 3)
+    vpn_processor.create_vpn_key.assert_awaited_once_with(
+        user_id=1, data_limit=200 * 1024**3
+    )
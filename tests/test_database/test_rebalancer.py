@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock
+
+import pytest
+
+from database.models import Server, VpnKey
+from utils.rebalancer import KeyRebalancer
+
+# Тариф, допускающий в среднем 1000 байт/с
+BANDWIDTH_BUDGET = 30 * 24 * 3600 * 1000
+
+
+@pytest.mark.asyncio
+async def test_rebalance_moves_heaviest_keys_off_overloaded_server(
+    db_processor, monkeypatch, make_outline_key
+):
+    """Самые активные ключи переносятся на сервер с запасом канала, старые удаляются позже."""
+    with db_processor.session_scope() as session:
+        for server_id, cnt_users, traffic_rate in ((3, 3, 2000.0), (4, 0, 100.0), (5, 0, 950.0)):
+            session.add(
+                Server(
+                    id=server_id,
+                    cnt_users=cnt_users,
+                    max_users=200,
+                    bandwidth_budget=BANDWIDTH_BUDGET,
+                    traffic_rate=traffic_rate,
+                    protocol_type="outline",
+                )
+            )
+        for key_id in ("1", "2", "3"):
+            session.add(
+                VpnKey(
+                    key_id=key_id,
+                    name=f"user key {key_id}",
+                    user_telegram_id=key_id,
+                    server_id=3,
+                    protocol_type="outline",
+                    used_bytes_last_month=100,
+                )
+            )
+
+    processor = AsyncMock()
+    # Ключ 2 даёт 70% трафика: его переноса хватает, чтобы снизить загрузку с 2.0 до 0.7
+    processor.get_keys.return_value = [
+        make_outline_key(1, used_bytes=200),
+        make_outline_key(2, data_limit=1000, used_bytes=700),
+        make_outline_key(3, used_bytes=100),
+    ]
+    processor.create_vpn_keys.return_value = [make_outline_key(42)]
+    monkeypatch.setattr(
+        "utils.get_processor.get_processor", AsyncMock(return_value=processor)
+    )
+    bot = AsyncMock()
+    monkeypatch.setattr("initialization.bot_init.bot", bot)
+
+    rebalancer = KeyRebalancer(db_processor, max_utilization=0.9, target_utilization=0.7)
+    assert await rebalancer.rebalance() == 1
+
+    processor.create_vpn_keys.assert_awaited_once_with(1, server_id=4, data_limit=300)
+    moved_key = await db_processor.get_key_by_id("42")
+    assert (moved_key.server_id, moved_key.name) == (4, "user key 2")
+    assert moved_key.used_bytes_last_month == 100 - 700
+    assert (await db_processor.get_migrated_key("2")).key_id == "42"
+    assert (await db_processor.get_server_by_id(4)).cnt_users == 1
+    assert bot.send_message.await_args.args[0] == "2"
+
+    # Пока старый ключ не удалён, сервер повторно не разгружается
+    assert await rebalancer.rebalance() == 0
+
+    assert await rebalancer.delete_migrated_keys() == 0
+    assert await rebalancer.delete_migrated_keys(datetime.now() + timedelta(days=2)) == 1
+    processor.delete_key.assert_awaited_once_with("2", server_id=3)
+    assert (await db_processor.get_server_by_id(3)).cnt_users == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_move_and_delete_keep_state_consistent(
+    db_processor, monkeypatch, make_outline_key
+):
+    """
+    Ошибка сохранения переноса откатывает новый ключ и исключает сервер для этого ключа,
+    неудачное удаление не освобождает место.
+    """
+    with db_processor.session_scope() as session:
+        for server_id, cnt_users, traffic_rate in ((3, 2, 2000.0), (4, 0, 100.0), (5, 0, 200.0)):
+            session.add(
+                Server(
+                    id=server_id,
+                    cnt_users=cnt_users,
+                    max_users=200,
+                    bandwidth_budget=BANDWIDTH_BUDGET,
+                    traffic_rate=traffic_rate,
+                    protocol_type="outline",
+                )
+            )
+        for key_id in ("1", "2"):
+            session.add(
+                VpnKey(key_id=key_id, user_telegram_id=key_id, server_id=3, protocol_type="outline")
+            )
+
+    processor = AsyncMock()
+    processor.get_keys.return_value = [make_outline_key(1, used_bytes=900), make_outline_key(2)]
+    # ID нового ключа совпадает с ID ключа, уже записанного в БД
+    processor.create_vpn_keys.return_value = [make_outline_key(2)]
+    monkeypatch.setattr(
+        "utils.get_processor.get_processor", AsyncMock(return_value=processor)
+    )
+    rebalancer = KeyRebalancer(db_processor, max_utilization=0.9, target_utilization=0.7)
+
+    assert await rebalancer.rebalance() == 0
+    processor.delete_key.assert_awaited_once_with(2, server_id=4)
+    assert (await db_processor.get_server_by_id(4)).cnt_users == 0
+
+    processor.create_vpn_keys.return_value = [make_outline_key(42)]
+    assert await rebalancer.rebalance() == 1
+    # Сервер 4, на котором ID совпал, для ключа больше не выбирается
+    assert processor.create_vpn_keys.await_args.kwargs["server_id"] == 5
+    assert (await db_processor.get_key_by_id("42")).server_id == 5
+    processor.delete_key.return_value = False
+    assert await rebalancer.delete_migrated_keys(datetime.now() + timedelta(days=2)) == 0
+    assert (await db_processor.get_server_by_id(3)).cnt_users == 2
@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+
+from servers import redirect_server as redirect_module
+from servers.access_url_cache import AccessUrlCache
+from servers.redirect_server import open_connection, render_redirect_page
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """БД с одним старым ключом Outline без сохранённой ссылки."""
+    key = SimpleNamespace(
+        key_id="7", protocol_type="Outline", access_url=None, name="key", server_id=1
+    )
+    db = SimpleNamespace(
+        get_key_by_id=AsyncMock(return_value=key),
+        get_migrated_key=AsyncMock(return_value=None),
+        set_key_access_url=AsyncMock(),
+    )
+    monkeypatch.setattr(redirect_module, "db_processor", db)
+    monkeypatch.setattr(redirect_module, "access_url_cache", AccessUrlCache(ttl=60))
+    return db
+
+
+@pytest.mark.asyncio
+async def test_open_backfills_access_url_and_serves_from_cache(db, monkeypatch):
+    """Ссылка старого ключа запрашивается у сервера один раз, дальше отдаётся из памяти."""
+    processor = AsyncMock()
+    processor.get_key_info.return_value = SimpleNamespace(access_url="ss://seven")
+    monkeypatch.setattr(redirect_module, "get_processor", AsyncMock(return_value=processor))
+
+    first = await open_connection("7")
+    second = await open_connection("7")
+
+    assert "ss://seven" in first.body.decode() and second.body == first.body
+    processor.get_key_info.assert_awaited_once_with("7", server_id=1)
+    db.set_key_access_url.assert_awaited_once_with("7", "ss://seven")
+    db.get_key_by_id.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_open_serves_stale_entry_when_db_is_down(db, monkeypatch):
+    """Если после истечения кэша БД недоступна, отдаётся последняя известная ссылка."""
+    db.get_key_by_id.return_value.access_url = "ss://stored"
+    redirect_module.access_url_cache.ttl = 0
+
+    assert "ss://stored" in (await open_connection("7")).body.decode()
+    db.get_key_by_id.side_effect = RuntimeError("database is locked")
+    response = await open_connection("7")
+
+    assert response.status_code == 200
+    assert "ss://stored" in response.body.decode()
+
+
+@pytest.mark.asyncio
+async def test_open_returns_etag_and_not_modified(db):
+    """Страница отдаётся с ETag, при совпадении If-None-Match — 304 без тела."""
+    db.get_key_by_id.return_value.access_url = "ss://stored"
+
+    response = await open_connection("7")
+    etag = response.headers["etag"]
+    not_modified = await open_connection("7", if_none_match=etag)
+
+    assert response.headers["cache-control"] == "private, max-age=60"
+    assert (not_modified.status_code, not_modified.body) == (304, b"")
+
+
+def test_render_redirect_page_escapes_url():
+    """Ссылка не может выйти за пределы HTML-атрибута или JS-строки."""
+    page = render_redirect_page("vless", "vless://x'\"><script>alert(1)</script>").decode()
+
+    assert "alert(1)</script>" not in page
+    assert 'value="vless://x&#x27;&quot;&gt;&lt;script&gt;' in page
+    assert 'window.location.href = "vless://x\'\\"><script>alert(1)<\\/script>";' in page